@@ -0,0 +1,55 @@
+"""Store exercise name/description only as overrides
+
+Revision ID: b7d41e9c0a52
+Revises: f79c16648e14
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d41e9c0a52'
+down_revision: Union[str, None] = 'f79c16648e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('exercise') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(length=150), nullable=True)
+        batch_op.alter_column('description', existing_type=sa.Text(), nullable=True)
+
+    # Бот никогда не записывал в exercise собственных названий: там лежат копии из каталога,
+    # которые теперь подставляются при чтении
+    op.execute("UPDATE exercise SET name = NULL, description = NULL")
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        UPDATE exercise SET
+            name = COALESCE(
+                name,
+                (SELECT admin_exercises.name FROM admin_exercises
+                 WHERE admin_exercises.id = exercise.admin_exercise_id),
+                (SELECT user_exercises.name FROM user_exercises
+                 WHERE user_exercises.id = exercise.user_exercise_id),
+                ''
+            ),
+            description = COALESCE(
+                description,
+                (SELECT admin_exercises.description FROM admin_exercises
+                 WHERE admin_exercises.id = exercise.admin_exercise_id),
+                (SELECT user_exercises.description FROM user_exercises
+                 WHERE user_exercises.id = exercise.user_exercise_id),
+                ''
+            )
+        """
+    )
+    with op.batch_alter_table('exercise') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(length=150), nullable=False)
+        batch_op.alter_column('description', existing_type=sa.Text(), nullable=False)
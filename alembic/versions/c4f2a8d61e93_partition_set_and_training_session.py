@@ -0,0 +1,125 @@
+"""Monthly range partitioning of set and training_session (Postgres)
+
+Revision ID: c4f2a8d61e93
+Revises: b7d41e9c0a52
+Create Date: 2026-10-19 13:00:00.000000
+
+Включается переменной окружения DB_PARTITION_BY_MONTH=1 и только на Postgres; на SQLite и без
+переменной миграция ничего не меняет. Секции будущих месяцев создаются при запуске бота
+(database.partitions.ensure_future_partitions).
+
+Ключ секционирования должен входить в первичный ключ, поэтому первичные ключи становятся
+(id, created) и (id, date), а внешний ключ set.training_session_id -> training_session.id
+на секционированных таблицах не создается: подходы тренировки удаляет orm_delete_training_session.
+"""
+import os
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.partitions import add_months, create_default_partition_sql, create_partition_sql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f2a8d61e93'
+down_revision: Union[str, None] = 'b7d41e9c0a52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+# таблица -> (ключ секционирования, индексы, внешние ключи)
+TABLES = {
+    "set": (
+        "created",
+        {
+            "idx_set_exercise_id": "exercise_id",
+            "idx_set_training_session_id": "training_session_id",
+        },
+        {
+            "set_exercise_id_fkey": "FOREIGN KEY (exercise_id) REFERENCES exercise (id) ON DELETE CASCADE",
+        },
+    ),
+    "training_session": (
+        "date",
+        {
+            "idx_training_session_user_id_date": "user_id, date",
+        },
+        {
+            "training_session_user_id_fkey":
+                'FOREIGN KEY (user_id) REFERENCES "user" (user_id) ON DELETE CASCADE',
+        },
+    ),
+}
+SET_SESSION_FKEY = (
+    'ALTER TABLE "set" ADD CONSTRAINT set_training_session_id_fkey '
+    'FOREIGN KEY (training_session_id) REFERENCES training_session (id) ON DELETE CASCADE'
+)
+
+
+def _enabled() -> bool:
+    return op.get_bind().dialect.name == "postgresql" and os.getenv("DB_PARTITION_BY_MONTH", "0") == "1"
+
+
+def _is_partitioned(table: str) -> bool:
+    return op.get_bind().execute(
+        sa.text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": f'"{table}"'},
+    ).scalar() is not None
+
+
+def _rebuild(table: str, old: str, partitioned: bool) -> None:
+    """
+    Пересоздает таблицу (секционированной или обычной) и переносит в нее данные
+    :param table: имя таблицы
+    :param old: имя, под которым остается старая таблица до удаления
+    :param partitioned: секционировать ли новую таблицу
+    """
+    key, indexes, foreign_keys = TABLES[table]
+    bind = op.get_bind()
+
+    op.execute(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+    op.execute(f'ALTER INDEX "{table}_pkey" RENAME TO "{old}_pkey"')
+    for index in indexes:
+        op.execute(f'DROP INDEX IF EXISTS "{index}"')
+
+    partition_by = f' PARTITION BY RANGE ("{key}")' if partitioned else ""
+    op.execute(f'CREATE TABLE "{table}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS){partition_by}')
+    op.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY ({"id, " + key if partitioned else "id"})')
+    for index, columns in indexes.items():
+        op.execute(f'CREATE INDEX "{index}" ON "{table}" ({columns})')
+    for name, definition in foreign_keys.items():
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+
+    if partitioned:
+        first = bind.execute(sa.text(f'SELECT min("{key}") FROM "{old}"')).scalar()
+        month = (first.date() if first is not None else date.today()).replace(day=1)
+        last = add_months(date.today().replace(day=1), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(create_partition_sql(table, month))
+            month = add_months(month, 1)
+        op.execute(create_default_partition_sql(table))
+
+    op.execute(f'INSERT INTO "{table}" SELECT * FROM "{old}"')
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": f'"{old}"'}).scalar()
+    if sequence is not None:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".id')
+    op.execute(f'DROP TABLE "{old}" CASCADE')
+
+
+def upgrade() -> None:
+    if not _enabled() or _is_partitioned("set"):
+        return
+    # Сначала set: вместе со старой таблицей уходит ее внешний ключ на training_session
+    _rebuild("set", "set_unpartitioned", partitioned=True)
+    _rebuild("training_session", "training_session_unpartitioned", partitioned=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql" or not _is_partitioned("set"):
+        return
+    _rebuild("training_session", "training_session_partitioned", partitioned=False)
+    _rebuild("set", "set_partitioned", partitioned=False)
+    op.execute(SET_SESSION_FKEY)
@@ -0,0 +1,29 @@
+"""Add training_session.archived
+
+Revision ID: d91b3e07c5a8
+Revises: c4f2a8d61e93
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91b3e07c5a8'
+down_revision: Union[str, None] = 'c4f2a8d61e93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'training_session',
+        sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=False)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('training_session', 'archived')
@@ -0,0 +1,68 @@
+"""Add daily/weekly training rollups
+
+Revision ID: e3a7c1f05b62
+Revises: d91b3e07c5a8
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a7c1f05b62'
+down_revision: Union[str, None] = 'd91b3e07c5a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _timestamps() -> list[sa.Column]:
+    return [sa.Column('created', sa.DateTime(), nullable=True), sa.Column('updated', sa.DateTime(), nullable=True)]
+
+
+def _user_id() -> sa.Column:
+    return sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
+
+
+def upgrade() -> None:
+    # Итоги заполняются при первом чтении (database/rollups.py: нет строки rollup_state - пересборка)
+    op.create_table(
+        'daily_rollup',
+        _user_id(),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('sets', sa.Integer(), nullable=False),
+        sa.Column('reps', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.Float(), nullable=False),
+        sa.Column('first_set', sa.DateTime(), nullable=False),
+        sa.Column('last_set', sa.DateTime(), nullable=False),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'category_id'),
+    )
+    op.create_table(
+        'weekly_rollup',
+        _user_id(),
+        sa.Column('week', sa.Date(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('sets', sa.Integer(), nullable=False),
+        sa.Column('reps', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.Float(), nullable=False),
+        sa.Column('training_days', sa.Integer(), nullable=False),
+        sa.Column('duration', sa.Integer(), nullable=False),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint('user_id', 'week', 'category_id'),
+    )
+    op.create_table(
+        'rollup_state',
+        _user_id(),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rollup_state')
+    op.drop_table('weekly_rollup')
+    op.drop_table('daily_rollup')
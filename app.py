@@ -7,15 +7,24 @@ from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import find_dotenv, load_dotenv
 
 
 from middlewares.db import DataBaseSession
-from database.engine import create_db, drop_db, session_maker
+from middlewares.fsm import FSMUnitOfWork
+from database.engine import DB_URL, create_db, drop_db, engine, session_maker
+from database.invalidation import create_bus
+from database.maintenance import EmptySessionSweeper, HistoryArchiver
+from database.partitions import ensure_future_partitions
+from database.orm_query import orm_get_info_pages
 from handlers.user_private import user_private_router
 from handlers.admin_private import admin_router
 from handlers.user_group import user_group_router
+from utils.charts import chart_renderer
+from utils.fsm_payload import PayloadStorage
+from utils.media import ERROR_IMAGE, prepare_banner_media
 
 load_dotenv(find_dotenv())
 
@@ -32,9 +41,25 @@ WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 bot.my_admins_list = [851690283]
 
-dp = Dispatcher()
+dp = Dispatcher(storage=PayloadStorage(MemoryStorage()))
 dp.include_routers(user_private_router, user_group_router, admin_router)
 
+background_tasks: set[asyncio.Task] = set()
+
+invalidation_bus = create_bus(DB_URL)
+session_sweeper = EmptySessionSweeper(session_maker)
+history_archiver = HistoryArchiver(session_maker)
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """
+    Запускает фоновую задачу и держит на неё ссылку до завершения
+    """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
 
 async def on_startup(bot: Bot):
     logging.info("Бот запускается (webhook)...")
@@ -43,6 +68,14 @@ async def on_startup(bot: Bot):
     if run_param:
         await drop_db()
     await create_db()
+    await ensure_future_partitions(engine)
+    await invalidation_bus.start()
+    await session_sweeper.start()
+    await history_archiver.start()
+
+    async with session_maker() as session:
+        banner_images = [banner.image for banner in await orm_get_info_pages(session)]
+    run_in_background(prepare_banner_media(banner_images + [ERROR_IMAGE]))
 
     await bot.set_webhook(
         url=WEBHOOK_URL,
@@ -60,11 +93,16 @@ async def on_shutdown(bot: Bot):
     logging.info("Выключаем вебхук...")
     with contextlib.suppress(Exception):
         await bot.delete_webhook(drop_pending_updates=False)
+    await history_archiver.stop()
+    await session_sweeper.stop()
+    await invalidation_bus.stop()
+    chart_renderer.shutdown()
 
 
 async def init_app() -> web.Application:
 
     dp.update.middleware(DataBaseSession(session_pool=session_maker))
+    dp.update.middleware(FSMUnitOfWork())
 
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
@@ -0,0 +1,71 @@
+"""
+Микро-бенчмарк упаковки callback_data меню.
+
+Сравнивает стандартный CallbackData.pack()/unpack() aiogram (формат "menu:...")
+с компактным кодеком MENU_CODEC и предупакованными шаблонами MenuCallBack.template()
+на типичной клавиатуре категории из 40 упражнений. Также выводит длины строк.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_callback_codec
+"""
+import timeit
+
+from aiogram.filters.callback_data import CallbackData
+
+from kbds.inline import MenuCallBack
+
+ROUNDS = 200
+EXERCISES = 40
+
+FIXED = dict(
+    action="shd/add_ex",
+    level=6,
+    training_day_id=18452,
+    program_id=3071,
+    page=2,
+    circle_training=True,
+)
+
+
+def legacy_keyboard() -> list[str]:
+    """Как раньше: модель и pydantic-упаковка на каждую кнопку"""
+    return [
+        CallbackData.pack(MenuCallBack(exercise_id=100_000 + i, category_id=4, **FIXED))
+        for i in range(EXERCISES)
+    ]
+
+
+def compact_keyboard() -> list[str]:
+    return [MenuCallBack(exercise_id=100_000 + i, category_id=4, **FIXED).pack() for i in range(EXERCISES)]
+
+
+def template_keyboard() -> list[str]:
+    template = MenuCallBack.template(category_id=4, **FIXED)
+    return [template.pack(exercise_id=100_000 + i) for i in range(EXERCISES)]
+
+
+def _bench(name: str, func, calls: int) -> None:
+    seconds = timeit.timeit(func, number=ROUNDS)
+    print(f"{name:<34} {seconds / (ROUNDS * calls) * 1e6:8.2f} мкс/кнопку")
+
+
+def main():
+    legacy = legacy_keyboard()
+    compact = compact_keyboard()
+    assert compact == template_keyboard()
+    assert [MenuCallBack.unpack(value) for value in legacy] == [MenuCallBack.unpack(value) for value in compact]
+
+    print(f"Клавиатура: {EXERCISES} кнопок")
+    _bench("pack: CallbackData.pack", legacy_keyboard, EXERCISES)
+    _bench("pack: компактный кодек", compact_keyboard, EXERCISES)
+    _bench("pack: шаблон", template_keyboard, EXERCISES)
+    _bench("unpack: menu:...", lambda: [MenuCallBack.unpack(value) for value in legacy], EXERCISES)
+    _bench("unpack: компактный кодек", lambda: [MenuCallBack.unpack(value) for value in compact], EXERCISES)
+
+    print(f"\nДлина: {len(legacy[0])} -> {len(compact[0])} байт")
+    print(f"  {legacy[0]}")
+    print(f"  {compact[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Бенчмарк хранения названий и описаний упражнений программы.
+
+Сравнивает на одинаковом наборе данных прежнюю схему (название и описание из каталога копируются
+в каждую строку exercise) с текущей (в exercise только переопределения, остальное - из каталога):
+размер таблицы exercise, объем данных, возвращаемых select(Exercise) для всех дней, и время этих запросов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_exercise_storage
+"""
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import Session
+
+from database.models import (
+    AdminExercises, Base, Exercise, ExerciseCategory, TrainingDay, TrainingProgram, User, UserExercises
+)
+
+USERS = 300
+PROGRAMS_PER_USER = 2
+DAYS_PER_PROGRAM = 4
+EXERCISES_PER_DAY = 6
+ADMIN_EXERCISES = 120
+USER_EXERCISES_PER_USER = 3
+DESCRIPTION_LENGTH = 600
+
+
+def _description(rnd: random.Random) -> str:
+    words = ["Исходное", "положение", "лопатки", "сведены", "спина", "прямая", "локти", "вдох", "выдох",
+             "медленно", "опустите", "поднимите", "вес", "колени", "корпус", "зафиксируйте"]
+    result = []
+    while sum(len(word) + 1 for word in result) < DESCRIPTION_LENGTH:
+        result.append(rnd.choice(words))
+    return " ".join(result)
+
+
+def _seed(session: Session, copy_catalog: bool) -> None:
+    rnd = random.Random(42)
+    session.execute(insert(ExerciseCategory), [{"id": 1, "name": "Грудь"}])
+    admin_rows = [
+        {"id": i, "category_id": 1, "name": f"Упражнение {i}", "description": _description(rnd)}
+        for i in range(1, ADMIN_EXERCISES + 1)
+    ]
+    session.execute(insert(AdminExercises), admin_rows)
+    session.execute(insert(User), [{"user_id": u, "name": f"user{u}", "weight": 80.0} for u in range(1, USERS + 1)])
+
+    user_rows = []
+    for u in range(1, USERS + 1):
+        for j in range(USER_EXERCISES_PER_USER):
+            user_rows.append({"id": len(user_rows) + 1, "category_id": 1, "user_id": u,
+                              "name": f"Свое упражнение {u}-{j}", "description": _description(rnd)})
+    session.execute(insert(UserExercises), user_rows)
+
+    programs, days, exercises = [], [], []
+    for u in range(1, USERS + 1):
+        own = user_rows[(u - 1) * USER_EXERCISES_PER_USER:u * USER_EXERCISES_PER_USER]
+        for _ in range(PROGRAMS_PER_USER):
+            programs.append({"id": len(programs) + 1, "name": "Программа", "user_id": u})
+            for day in range(DAYS_PER_PROGRAM):
+                days.append({"id": len(days) + 1, "day_of_week": f"День {day}",
+                             "training_program_id": programs[-1]["id"]})
+                for position in range(EXERCISES_PER_DAY):
+                    if rnd.random() < 0.2:
+                        source = rnd.choice(own)
+                        admin_id, user_id = None, source["id"]
+                    else:
+                        source = rnd.choice(admin_rows)
+                        admin_id, user_id = source["id"], None
+                    exercises.append({
+                        "training_day_id": days[-1]["id"], "position": position, "base_sets": 3, "base_reps": 10,
+                        "circle_training": False, "admin_exercise_id": admin_id, "user_exercise_id": user_id,
+                        "name_override": source["name"] if copy_catalog else None,
+                        "description_override": source["description"] if copy_catalog else None,
+                    })
+    session.execute(insert(TrainingProgram), programs)
+    session.execute(insert(TrainingDay), days)
+    session.execute(insert(Exercise), exercises)
+    session.commit()
+
+
+def _measure(copy_catalog: bool) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            _seed(session, copy_catalog)
+        with engine.connect() as connection:
+            connection.execute(text("VACUUM"))
+            table_bytes = connection.execute(
+                text("SELECT SUM(LENGTH(COALESCE(name, '')) + LENGTH(COALESCE(description, ''))) FROM exercise")
+            ).scalar()
+        file_bytes = os.path.getsize(path)
+
+        with Session(engine) as session:
+            day_ids = session.scalars(select(TrainingDay.id)).all()
+            started = time.perf_counter()
+            result_bytes = 0
+            for day_id in day_ids:
+                rows = session.execute(
+                    select(Exercise.__table__).where(Exercise.training_day_id == day_id).order_by(Exercise.position)
+                ).all()
+                result_bytes += sum(len(str(value)) for row in rows for value in row if value is not None)
+            elapsed = time.perf_counter() - started
+        return {"file": file_bytes, "text": table_bytes or 0, "result": result_bytes,
+                "per_day_ms": elapsed / len(day_ids) * 1000}
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+def main():
+    total = USERS * PROGRAMS_PER_USER * DAYS_PER_PROGRAM * EXERCISES_PER_DAY
+    print(f"Строк exercise: {total}, описание ~{DESCRIPTION_LENGTH} символов")
+    legacy = _measure(copy_catalog=True)
+    current = _measure(copy_catalog=False)
+    print(f"{'':<34}{'копии':>14}{'переопределения':>18}")
+    print(f"{'Файл базы, КБ':<34}{legacy['file'] / 1024:>14.0f}{current['file'] / 1024:>18.0f}")
+    print(f"{'name+description в exercise, КБ':<34}{legacy['text'] / 1024:>14.0f}{current['text'] / 1024:>18.0f}")
+    print(f"{'select(Exercise) по всем дням, КБ':<34}{legacy['result'] / 1024:>14.0f}"
+          f"{current['result'] / 1024:>18.0f}")
+    print(f"{'select(Exercise) на день, мс':<34}{legacy['per_day_ms']:>14.3f}{current['per_day_ms']:>18.3f}")
+
+
+if __name__ == "__main__":
+    main()
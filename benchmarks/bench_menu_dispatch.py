@@ -0,0 +1,123 @@
+"""
+Микро-бенчмарк стоимости маршрутизации действий меню.
+
+Сравнивает таблицу маршрутов (MENU_ROUTES, USER_MENU_ACTIONS) со старой цепочкой
+if/elif/startswith на всех известных действиях, включая варианты "shd/".
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_menu_dispatch
+"""
+import timeit
+
+from handlers.menu_processing import MENU_ROUTES
+from handlers.user_private import USER_MENU_ACTIONS
+from utils.separator import get_action_part
+
+ROUNDS = 200_000
+
+MENU_ACTIONS = [
+    (0, "main"),
+    (1, "program"), (1, "profile"), (1, "schedule"), (1, "month_schedule"), (1, "t_day"),
+    (2, "training_process"), (2, "trd_sts"), (2, "n_t"), (2, "p_t"), (2, "program_Full body"),
+    (3, "prg_stg"), (3, "turn_on_prgm"), (3, "turn_off_prgm"), (3, "to_del_prgm"), (3, "prgm_del"),
+    (3, "t_d"), (3, "n_d"), (3, "p_d"), (3, "training_day"),
+    (4, "edit_trd"), (4, "shd/edit_trd"),
+    (5, "edit_excs"), (5, "shd/edit_excs"), (5, "to_edit"), (5, "shd/to_edit"), (5, "del"), (5, "mv"),
+    (5, "ctgs"), (5, "shd/ctgs"), (5, "start_circle"), (5, "shd/end_circle"),
+    (6, "ex_stg"), (6, "shd/ex_stg"), (6, "➕_1_sets"), (6, "shd/➖_1_sets"), (6, "ctg"), (6, "shd/add_ex_custom"),
+    (7, "custom_excs"), (7, "shd/custom_excs"),
+]
+
+CALLBACK_ACTIONS = [
+    "to_edit", "shd/to_edit", "del", "shd/del_custom", "mv_up", "shd/mv_down", "to_del_prgm", "prgm_del",
+    "➕_1_sets", "shd/➖_1_reps", "training_process", "finish_training", "program", "shd/ctg", "trd_sts",
+]
+
+
+def legacy_menu_dispatch(level: int, action: str) -> str | None:
+    """Копия прежней цепочки условий из get_menu_content"""
+    if level == 0:
+        return "main_menu"
+    elif level == 1:
+        if action == "program":
+            return "programs_catalog"
+        elif action == "profile":
+            return "profile"
+        elif action in ["schedule", "month_schedule", "t_day"]:
+            return "schedule"
+    elif level == 2:
+        if action == "training_process":
+            return "training_process"
+        if action == "trd_sts" or action.startswith("n_t") or action.startswith("p_t"):
+            return "training_results"
+        return "program"
+    elif level == 3:
+        if action in ["prg_stg", "turn_on_prgm", "turn_off_prgm"] or action.startswith(
+                "to_del_prgm") or action.startswith("prgm_del"):
+            return "program_settings"
+        if action == "t_d" or action.startswith("n_d") or action.startswith("p_d"):
+            return "show_result"
+        return "training_days"
+    elif level == 4:
+        return "edit_training_day"
+    elif level == 5:
+        if action in ["edit_excs", "shd/edit_excs", "to_edit", "shd/to_edit",
+                      "del", "shd/del", "mv", "shd/mv"]:
+            return "edit_exercises"
+        return "show_categories"
+    elif level == 6:
+        if action in ["ex_stg", "shd/ex_stg"] or action.startswith("➕") or action.startswith(
+                "➖") or action.startswith("shd/➕") or action.startswith("shd/➖"):
+            return "exercise_settings"
+        return "show_exercises_in_category"
+    elif level == 7:
+        return "custom_exercises"
+    return None
+
+
+def legacy_user_menu_dispatch(action: str) -> str:
+    """Копия прежней цепочки условий из user_menu"""
+    if get_action_part(action) == "to_edit":
+        return "to_edit"
+    elif get_action_part(action).startswith("del"):
+        return "del"
+    elif get_action_part(action).startswith("mv"):
+        return "mv"
+    elif get_action_part(action) == "to_del_prgm":
+        return "to_del_prgm"
+    elif get_action_part(action) == "prgm_del":
+        return "prgm_del"
+    elif get_action_part(action).startswith("➕") or get_action_part(action).startswith("➖"):
+        return "incr"
+    elif get_action_part(action) == "training_process":
+        return "training_process"
+    elif get_action_part(action) == "finish_training":
+        return "finish_training"
+    return "navigate"
+
+
+def _bench(name: str, func, items) -> None:
+    seconds = timeit.timeit(lambda: [func(*item) for item in items], number=ROUNDS // len(items))
+    per_call = seconds / (ROUNDS // len(items) * len(items)) * 1e9
+    print(f"{name:<28} {per_call:8.1f} нс/вызов")
+
+
+def main():
+    print(f"Действий меню: {len(MENU_ACTIONS)}, действий callback: {len(CALLBACK_ACTIONS)}")
+    _bench("get_menu_content: if/elif", legacy_menu_dispatch, MENU_ACTIONS)
+    _bench("get_menu_content: registry", MENU_ROUTES.resolve, MENU_ACTIONS)
+    callback_items = [(action,) for action in CALLBACK_ACTIONS]
+    _bench("user_menu: if/elif", legacy_user_menu_dispatch, callback_items)
+    _bench("user_menu: registry", lambda action: USER_MENU_ACTIONS.resolve(None, action), callback_items)
+
+    print("\nСамые дорогие действия (if/elif):")
+    costs = []
+    for level, action in MENU_ACTIONS:
+        seconds = timeit.timeit(lambda: legacy_menu_dispatch(level, action), number=20_000)
+        costs.append((seconds, level, action))
+    for seconds, level, action in sorted(costs, reverse=True)[:5]:
+        print(f"  level={level} action={action!r}: {seconds / 20_000 * 1e9:.1f} нс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Бенчмарк расчета статистики профиля (database/stats.py) на синтетической истории:
+расчетный 1ПМ по упражнениям, недельный объем, зоны интенсивности и тренды.
+
+Запуск из корня репозитория (по умолчанию 10 000 подходов):
+    python -m benchmarks.bench_stats [кол-во подходов]
+"""
+import sys
+import timeit
+from datetime import date
+
+import numpy as np
+
+from database.stats import SetHistory, compute_stats, format_stats
+
+SETS = 10_000
+EXERCISES = 30
+SETS_PER_DAY = 20
+ROUNDS = 200
+
+
+def make_history(sets: int) -> SetHistory:
+    rng = np.random.default_rng(0)
+    last_day = (date.today() - date(1970, 1, 1)).days
+    days = last_day - (sets - 1 - np.arange(sets)) // SETS_PER_DAY
+    exercises = rng.integers(1, EXERCISES + 1, sets)
+    return SetHistory(
+        days=days.astype(np.int64),
+        exercises=exercises.astype(np.int64),
+        categories=(exercises % 7 + 1).astype(np.int64),
+        weights=np.round(40 + exercises + np.arange(sets) * 0.002 + rng.random(sets) * 10, 1),
+        reps=rng.integers(1, 13, sets).astype(np.float64),
+        names={key: f"Упражнение {key}" for key in range(1, EXERCISES + 1)},
+    )
+
+
+def main():
+    sets = int(sys.argv[1]) if len(sys.argv) > 1 else SETS
+    history = make_history(sets)
+    seconds = timeit.timeit(lambda: compute_stats(history), number=ROUNDS)
+    print(f"Подходов: {sets}, упражнений: {EXERCISES}")
+    print(f"compute_stats: {seconds / ROUNDS * 1e3:.2f} мс")
+    seconds = timeit.timeit(lambda: compute_stats(history.category(1)), number=ROUNDS)
+    print(f"compute_stats (категория): {seconds / ROUNDS * 1e3:.2f} мс\n")
+    print(format_stats(compute_stats(history)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Бенчмарк ключей тренировок: uuid4 (случайные) против uuid7 (упорядоченные по времени).
+
+Заполняет таблицы training_session и set (по SETS_PER_SESSION подходов на тренировку, индекс по
+set.training_session_id - как в базе бота) пачками по BATCH_SIZE строк и сравнивает скорость вставки
+и размер индексов. Ключи хранятся 16 байтами, как UUID в Postgres.
+
+Запуск из корня репозитория (по умолчанию 2 000 000 подходов):
+    python -m benchmarks.bench_uuid_keys [кол-во подходов]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+from database.models import uuid7
+
+SET_ROWS = 2_000_000
+SETS_PER_SESSION = 15
+BATCH_SIZE = 10_000
+
+SCHEMA = """
+CREATE TABLE training_session (id BLOB PRIMARY KEY, user_id INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE "set" (
+    id INTEGER PRIMARY KEY,
+    exercise_id INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    repetitions INTEGER NOT NULL,
+    training_session_id BLOB NOT NULL REFERENCES training_session(id)
+);
+CREATE INDEX idx_set_training_session_id ON "set" (training_session_id);
+"""
+
+
+def _index_sizes(connection: sqlite3.Connection) -> dict[str, int]:
+    try:
+        rows = connection.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat "
+            "WHERE name IN ('training_session', 'idx_set_training_session_id') GROUP BY name"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # SQLite собран без dbstat
+        return {}
+    return dict(rows)
+
+
+def _run(make_key, set_rows: int) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fd)
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(SCHEMA)
+        sessions, sets = [], []
+        elapsed = 0.0
+        for number in range(set_rows):
+            if number % SETS_PER_SESSION == 0:
+                key = make_key().bytes
+                sessions.append((key, number % 1000))
+            sets.append((number % 40, 60.0, 10, key))
+            if len(sets) == BATCH_SIZE or number == set_rows - 1:
+                started = time.perf_counter()
+                connection.executemany("INSERT INTO training_session VALUES (?, ?)", sessions)
+                connection.executemany(
+                    'INSERT INTO "set" (exercise_id, weight, repetitions, training_session_id) VALUES (?, ?, ?, ?)',
+                    sets,
+                )
+                connection.commit()
+                elapsed += time.perf_counter() - started
+                sessions, sets = [], []
+        sizes = _index_sizes(connection)
+        return {
+            "rows_per_sec": set_rows / elapsed,
+            "pk": sizes.get("training_session"),
+            "fk": sizes.get("idx_set_training_session_id"),
+            "file": os.path.getsize(path),
+        }
+    finally:
+        connection.close()
+        os.remove(path)
+
+
+def _mb(value) -> str:
+    return "-" if value is None else f"{value / 2 ** 20:.1f}"
+
+
+def main():
+    set_rows = int(sys.argv[1]) if len(sys.argv) > 1 else SET_ROWS
+    print(f"Подходов: {set_rows}, тренировок: {-(-set_rows // SETS_PER_SESSION)}, пачка: {BATCH_SIZE}")
+    results = {"uuid4": _run(uuid.uuid4, set_rows), "uuid7": _run(uuid7, set_rows)}
+    print(f"{'':<34}{'uuid4':>12}{'uuid7':>12}")
+    print(f"{'Вставка, подходов/с':<34}" + "".join(f"{r['rows_per_sec']:>12.0f}" for r in results.values()))
+    print(f"{'PK training_session, МБ':<34}" + "".join(f"{_mb(r['pk']):>12}" for r in results.values()))
+    print(f"{'Индекс set.training_session_id, МБ':<34}" + "".join(f"{_mb(r['fk']):>12}" for r in results.values()))
+    print(f"{'Файл базы, МБ':<34}" + "".join(f"{_mb(r['file']):>12}" for r in results.values()))
+
+
+if __name__ == "__main__":
+    main()
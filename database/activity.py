@@ -0,0 +1,96 @@
+import os
+from collections import OrderedDict
+from datetime import date
+from typing import Hashable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.orm_query import orm_get_daily_rollups
+from utils.versions import ALL, get_version, subscribe, track
+
+MONTH_ACTIVITY_CACHE_SIZE = int(os.getenv("MONTH_ACTIVITY_CACHE_SIZE", 5000))
+
+
+def shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+    """
+    Месяц, отстоящий от данного на delta месяцев
+    """
+    index = year * 12 + month - 1 + delta
+    return index // 12, index % 12 + 1
+
+
+class MonthActivityCache:
+    """
+    LRU-кэш дней с тренировками: (пользователь, год, месяц) -> номера дней месяца.
+    Запись актуальна, пока не изменилась версия подходов пользователя (utils.versions, область sets)
+    """
+
+    def __init__(self, maxsize: int = MONTH_ACTIVITY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: OrderedDict[tuple[int, int, int], tuple[int, frozenset[int]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, year: int, month: int) -> frozenset[int] | None:
+        key = (user_id, year, month)
+        entry = self._data.get(key)
+        if entry is None or entry[0] != get_version("sets", user_id):
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: int, year: int, month: int, version: int, days: frozenset[int]) -> None:
+        if self.maxsize <= 0:
+            return
+        key = (user_id, year, month)
+        self._data[key] = (version, days)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def on_remote_change(self, scope: str, key: Hashable) -> None:
+        if scope == ALL:
+            self.clear()
+
+
+month_activity_cache = MonthActivityCache()
+subscribe(month_activity_cache.on_remote_change)
+
+
+async def get_trained_days(session: AsyncSession, user_id: int, year: int, month: int) -> frozenset[int]:
+    """
+    Дни месяца, в которые пользователь тренировался. Соседние месяцы подгружаются тем же запросом
+    по дневным итогам (database/rollups.py), чтобы листание календаря не ходило в базу
+    :param session:
+    :param user_id: Telegram ID
+    :param year:
+    :param month:
+    :return: номера дней месяца
+    """
+    track("sets", user_id)
+    window = [shift_month(year, month, delta) for delta in (-1, 0, 1)]
+    found = {item: month_activity_cache.get(user_id, *item) for item in window}
+    missing = [item for item, days in found.items() if days is None]
+    if not missing:
+        return found[(year, month)]
+
+    version = get_version("sets", user_id)
+    rollups = await orm_get_daily_rollups(
+        session, user_id, date(*missing[0], 1), date(*shift_month(*missing[-1], 1), 1)
+    )
+    loaded: dict[tuple[int, int], set[int]] = {item: set() for item in missing}
+    for rollup in rollups:
+        days = loaded.get((rollup.day.year, rollup.day.month))
+        if days is not None:
+            days.add(rollup.day.day)
+    for item, days in loaded.items():
+        found[item] = frozenset(days)
+        month_activity_cache.put(user_id, *item, version, found[item])
+    return found[(year, month)]
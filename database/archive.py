@@ -0,0 +1,299 @@
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Set, TrainingSession, User
+from utils.versions import bump
+
+# Каталог архивов истории (по файлу на пользователя). Без него архивация выключена.
+# При нескольких экземплярах бота каталог должен быть общим
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR")
+# Тренировки старше стольких дней переносятся в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 365))
+ARCHIVE_SESSIONS_PER_RUN = int(os.getenv("ARCHIVE_SESSIONS_PER_RUN", 500))
+ARCHIVE_READERS_CACHE_SIZE = int(os.getenv("ARCHIVE_READERS_CACHE_SIZE", 256))
+
+# Формат файла <user_id>.gsa (little-endian, массивы выровнены по 8 байт):
+#   заголовок: MAGIC, кол-во тренировок S, подходов N, упражнений в словаре E, ширина кода упражнения (2/4),
+#              ширина повторений (2/4; 0 в архивах до ее появления означает 2)
+#   session_ids   S x 16 байт      - uuid тренировок
+#   offsets       int64[S + 1]     - подходы тренировки i: [offsets[i], offsets[i + 1])
+#   exercise_ids  int64[E]         - словарь id упражнений
+#   codes         uint16/uint32[N] - номер упражнения подхода в словаре
+#   weights       float32[N]
+#   reps          uint16/uint32[N]
+MAGIC = b"GSARCH1\0"
+HEADER = struct.Struct("<8sIIIII")
+
+
+class ArchivedSet(NamedTuple):
+    """
+    Подход из архива; поля совпадают с используемыми полями Set
+    """
+    exercise_id: int
+    weight: float
+    repetitions: int
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def archive_path(user_id: int) -> str:
+    return os.path.join(HISTORY_ARCHIVE_DIR, f"{user_id}.gsa")
+
+
+class UserArchive:
+    """
+    Архив пользователя, отображенный в память (mmap). Массивы - представления numpy поверх mmap,
+    поэтому в память читаются только затронутые страницы
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, sessions, sets, exercises, code_width, reps_width = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: неизвестный формат архива")
+        offset = HEADER.size
+        self.session_ids, offset = self._array(offset, np.dtype("V16"), sessions)
+        self.offsets, offset = self._array(offset, np.dtype("<i8"), sessions + 1)
+        self.exercise_ids, offset = self._array(offset, np.dtype("<i8"), exercises)
+        self.codes, offset = self._array(offset, np.dtype("<u2" if code_width == 2 else "<u4"), sets)
+        self.weights, offset = self._array(offset, np.dtype("<f4"), sets)
+        self.reps, offset = self._array(offset, np.dtype("<u4" if reps_width == 4 else "<u2"), sets)
+        self._index: dict[bytes, int] | None = None
+
+    def _array(self, offset: int, dtype: np.dtype, count: int) -> tuple[np.ndarray, int]:
+        offset = _align(offset)
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset), offset + dtype.itemsize * count
+
+    def _session_index(self) -> dict[bytes, int]:
+        if self._index is None:
+            self._index = {session_id.tobytes(): i for i, session_id in enumerate(self.session_ids)}
+        return self._index
+
+    def __contains__(self, session_id: uuid.UUID) -> bool:
+        return session_id.bytes in self._session_index()
+
+    def session_sets(self, session_id: uuid.UUID) -> list[ArchivedSet]:
+        """
+        Подходы тренировки в порядке выполнения
+        """
+        i = self._session_index().get(session_id.bytes)
+        if i is None:
+            return []
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        exercise_ids = self.exercise_ids[self.codes[start:end]]
+        return [
+            ArchivedSet(int(exercise_id), round(float(weight), 2), int(reps))
+            for exercise_id, weight, reps in zip(exercise_ids, self.weights[start:end], self.reps[start:end])
+        ]
+
+    def _exercise_mask(self, exercise_id: int) -> np.ndarray | None:
+        codes = np.flatnonzero(self.exercise_ids == exercise_id)
+        if not codes.size:
+            return None
+        return self.codes == codes[0]
+
+    def max_weight(self, exercise_id: int) -> float:
+        mask = self._exercise_mask(exercise_id)
+        if mask is None or not mask.any():
+            return 0
+        return round(float(self.weights[mask].max()), 2)
+
+    def max_volume(self, exercise_id: int) -> float:
+        mask = self._exercise_mask(exercise_id)
+        if mask is None or not mask.any():
+            return 0
+        return round(float((self.weights[mask] * self.reps[mask]).max()), 2)
+
+    def sessions(self) -> dict[bytes, tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Все тренировки архива: uuid -> (id упражнений, веса, повторения); для перезаписи архива
+        """
+        result = {}
+        for i, session_id in enumerate(self.session_ids):
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            result[session_id.tobytes()] = (
+                self.exercise_ids[self.codes[start:end]], self.weights[start:end], self.reps[start:end]
+            )
+        return result
+
+
+def write_archive(path: str, sessions: dict[bytes, tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+    """
+    Записывает архив целиком: во временный файл, затем атомарная замена. Уже открытые читатели
+    продолжают видеть старую версию файла
+    :param path:
+    :param sessions: uuid -> (id упражнений, веса, повторения)
+    :return:
+    """
+    session_ids = np.array(list(sessions), dtype="V16") if sessions else np.empty(0, dtype="V16")
+    lengths = [len(exercise_ids) for exercise_ids, _, _ in sessions.values()]
+    offsets = np.zeros(len(sessions) + 1, dtype="<i8")
+    np.cumsum(lengths, out=offsets[1:])
+    columns = list(zip(*sessions.values())) if sessions else ([], [], [])
+    all_exercise_ids = np.concatenate(columns[0]).astype("<i8") if sessions else np.empty(0, dtype="<i8")
+    exercise_ids, codes = np.unique(all_exercise_ids, return_inverse=True)
+    code_width = 2 if len(exercise_ids) <= 0xFFFF else 4
+    codes = codes.astype("<u2" if code_width == 2 else "<u4")
+    weights = np.concatenate(columns[1]).astype("<f4") if sessions else np.empty(0, dtype="<f4")
+    reps = np.concatenate(columns[2]) if sessions else np.empty(0, dtype="<u2")
+    reps_width = 2 if not reps.size or reps.max() <= 0xFFFF else 4
+    reps = reps.astype("<u2" if reps_width == 2 else "<u4")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(session_ids), len(codes), len(exercise_ids), code_width, reps_width))
+        for array in (session_ids, offsets, exercise_ids, codes, weights, reps):
+            file.write(b"\0" * (_align(file.tell()) - file.tell()))
+            file.write(array.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# user_id -> ((inode, mtime), архив); читается из потоков asyncio.to_thread
+_readers: OrderedDict[int, tuple[tuple[int, int], UserArchive]] = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def open_archive(user_id: int) -> UserArchive | None:
+    """
+    Архив пользователя; открытые архивы кэшируются, пока файл не заменен
+    :param user_id: Telegram ID
+    :return: None, если архива нет
+    """
+    if not HISTORY_ARCHIVE_DIR:
+        return None
+    path = archive_path(user_id)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        with _readers_lock:
+            _readers.pop(user_id, None)
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns)
+    with _readers_lock:
+        cached = _readers.get(user_id)
+        if cached is not None and cached[0] == key:
+            _readers.move_to_end(user_id)
+            return cached[1]
+        archive = UserArchive(path)
+        _readers[user_id] = (key, archive)
+        while len(_readers) > ARCHIVE_READERS_CACHE_SIZE:
+            _readers.popitem(last=False)
+        return archive
+
+
+async def read_archived_sets(user_id: int, session_id: uuid.UUID) -> list[ArchivedSet]:
+    """
+    Подходы архивированной тренировки
+    """
+    archive = await asyncio.to_thread(open_archive, user_id)
+    if archive is None:
+        return []
+    return await asyncio.to_thread(archive.session_sets, session_id)
+
+
+async def archived_max(user_id: int, exercise_id: int, volume: bool = False) -> float:
+    """
+    Максимальный вес (или вес * повторения) упражнения в архиве пользователя
+    """
+    archive = await asyncio.to_thread(open_archive, user_id)
+    if archive is None:
+        return 0
+    return await asyncio.to_thread(archive.max_volume if volume else archive.max_weight, exercise_id)
+
+
+def _merge_into_archive(user_id: int, new_sessions: dict[bytes, tuple[list, list, list]]) -> None:
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(user_id)
+    sessions = UserArchive(path).sessions() if os.path.exists(path) else {}
+    for session_id, (exercise_ids, weights, reps) in new_sessions.items():
+        # Повторный перенос (после сбоя до commit) заменяет тренировку, а не дублирует ее
+        sessions[session_id] = (np.array(exercise_ids, dtype="<i8"), np.array(weights, dtype="<f4"),
+                                np.array(reps, dtype="<i8"))
+    write_archive(path, sessions)
+
+
+async def archive_user_history(session: AsyncSession, user_id: int, older_than: datetime,
+                               limit: int = ARCHIVE_SESSIONS_PER_RUN) -> int:
+    """
+    Переносит подходы старых тренировок пользователя в архив: сначала записывается файл архива,
+    затем в одной транзакции удаляются подходы и тренировки помечаются archived.
+    Строка пользователя блокируется (на Postgres), чтобы архив одного пользователя
+    не переписывали одновременно несколько экземпляров бота
+    :param session:
+    :param user_id: Telegram ID
+    :param older_than: переносятся тренировки раньше этого момента
+    :param limit: максимум тренировок за вызов
+    :return: кол-во перенесенных тренировок
+    """
+    locked = await session.scalar(
+        select(User.id).where(User.user_id == user_id).with_for_update(skip_locked=True)
+    )
+    if locked is None:
+        await session.rollback()
+        return 0
+    session_ids = (await session.execute(
+        select(TrainingSession.id)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(False),
+               TrainingSession.date < older_than)
+        .order_by(TrainingSession.date)
+        .limit(limit)
+    )).scalars().all()
+    if not session_ids:
+        await session.rollback()
+        return 0
+
+    rows = await session.execute(
+        select(Set.training_session_id, Set.exercise_id, Set.weight, Set.repetitions)
+        .where(Set.training_session_id.in_(session_ids))
+        .order_by(Set.training_session_id, Set.id)
+    )
+    new_sessions: dict[bytes, tuple[list, list, list]] = {
+        session_id.bytes: ([], [], []) for session_id in session_ids
+    }
+    for training_session_id, exercise_id, weight, repetitions in rows:
+        exercise_ids, weights, reps = new_sessions[training_session_id.bytes]
+        exercise_ids.append(exercise_id)
+        weights.append(weight)
+        reps.append(repetitions)
+
+    try:
+        await asyncio.to_thread(_merge_into_archive, user_id, new_sessions)
+        await session.execute(delete(Set).where(Set.training_session_id.in_(session_ids)))
+        await session.execute(
+            update(TrainingSession).where(TrainingSession.id.in_(session_ids)).values(archived=True)
+        )
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    bump("sessions", user_id)
+    return len(session_ids)
+
+
+async def users_with_archivable_history(session: AsyncSession, older_than: datetime, limit: int) -> list[int]:
+    """
+    Пользователи, у которых есть тренировки для переноса в архив
+    """
+    result = await session.execute(
+        select(TrainingSession.user_id)
+        .where(TrainingSession.archived.is_(False), TrainingSession.date < older_than)
+        .group_by(TrainingSession.user_id)
+        .limit(limit)
+    )
+    return list(result.scalars())
@@ -0,0 +1,182 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Iterable, NamedTuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import AdminExercises, Exercise, ExerciseCategory, UserExercises
+from utils.versions import ALL, get_version, subscribe, track
+
+USER_COUNTS_CACHE_SIZE = int(os.getenv("USER_COUNTS_CACHE_SIZE", 10000))
+USER_EXERCISES_CACHE_SIZE = int(os.getenv("USER_EXERCISES_CACHE_SIZE", 50000))
+
+
+class CatalogCategory(NamedTuple):
+    id: int
+    name: str
+
+
+class CatalogExercise(NamedTuple):
+    id: int
+    name: str
+    description: str
+    category_id: int
+
+
+class CatalogSnapshot(NamedTuple):
+    """
+    Неизменяемый снимок каталога предустановленных упражнений
+    """
+    version: int
+    categories: tuple[CatalogCategory, ...]
+    categories_by_id: dict[int, CatalogCategory]
+    exercises: tuple[CatalogExercise, ...]
+    exercises_by_id: dict[int, CatalogExercise]
+    exercises_by_category: dict[int, tuple[CatalogExercise, ...]]
+    counts: dict[int, int]
+
+
+_snapshot: CatalogSnapshot | None = None
+_lock = asyncio.Lock()
+
+# user_id -> (версия пользователя, {category_id: кол-во пользовательских упражнений})
+_user_counts: OrderedDict[int, tuple[int, dict[int, int]]] = OrderedDict()
+
+# user_exercise_id -> (версия пользовательского упражнения, его данные)
+_user_exercises: OrderedDict[int, tuple[int, CatalogExercise]] = OrderedDict()
+
+
+async def _build_snapshot(session: AsyncSession, version: int) -> CatalogSnapshot:
+    categories = tuple(
+        CatalogCategory(row.id, row.name)
+        for row in await session.execute(
+            select(ExerciseCategory.id, ExerciseCategory.name).order_by(ExerciseCategory.name)
+        )
+    )
+    exercises = tuple(
+        CatalogExercise(row.id, row.name, row.description, row.category_id)
+        for row in await session.execute(
+            select(AdminExercises.id, AdminExercises.name, AdminExercises.description, AdminExercises.category_id)
+            .order_by(AdminExercises.id)
+        )
+    )
+    by_category: dict[int, list[CatalogExercise]] = {category.id: [] for category in categories}
+    for exercise in exercises:
+        by_category.setdefault(exercise.category_id, []).append(exercise)
+    return CatalogSnapshot(
+        version=version,
+        categories=categories,
+        categories_by_id={category.id: category for category in categories},
+        exercises=exercises,
+        exercises_by_id={exercise.id: exercise for exercise in exercises},
+        exercises_by_category={category_id: tuple(items) for category_id, items in by_category.items()},
+        counts={category_id: len(items) for category_id, items in by_category.items()},
+    )
+
+
+async def get_catalog(session: AsyncSession) -> CatalogSnapshot:
+    """
+    Возвращает актуальный снимок каталога. Пересобирается целиком (двумя запросами) только после
+    изменения каталога администратором (bump("catalog")), одновременные запросы ждут одну пересборку
+    :param session:
+    :return:
+    """
+    global _snapshot
+    track("catalog")
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == get_version("catalog"):
+        return snapshot
+    async with _lock:
+        version = get_version("catalog")
+        if _snapshot is None or _snapshot.version != version:
+            # Версия фиксируется до запросов: запись во время пересборки оставит снимок устаревшим
+            _snapshot = await _build_snapshot(session, version)
+        return _snapshot
+
+
+async def get_user_category_counts(session: AsyncSession, user_id: int) -> dict[int, int]:
+    """
+    Количество пользовательских упражнений по категориям (кэшируется до изменения данных пользователя)
+    :param session:
+    :param user_id: Telegram ID
+    :return: {category_id: кол-во}
+    """
+    track("user", user_id)
+    version = get_version("user", user_id)
+    cached = _user_counts.get(user_id)
+    if cached is not None and cached[0] == version:
+        _user_counts.move_to_end(user_id)
+        return cached[1]
+    result = await session.execute(
+        select(UserExercises.category_id, func.count())
+        .where(UserExercises.user_id == user_id)
+        .group_by(UserExercises.category_id)
+    )
+    counts = dict(result.all())
+    _user_counts[user_id] = (version, counts)
+    _user_counts.move_to_end(user_id)
+    while len(_user_counts) > USER_COUNTS_CACHE_SIZE:
+        _user_counts.popitem(last=False)
+    return counts
+
+
+async def load_exercise_info(session: AsyncSession, exercises: Iterable[Exercise]) -> None:
+    """
+    Подставляет упражнениям программы название и описание из каталога (Exercise.catalog_info).
+    Предустановленные берутся из снимка каталога, пользовательские - из кэша по версии
+    "user_exercise", недостающие загружаются одним запросом
+    :param session:
+    :param exercises: объекты Exercise
+    :return:
+    """
+    exercises = list(exercises)
+    if not exercises:
+        return
+    catalog = await get_catalog(session)
+
+    missing: dict[int, int] = {}
+    for exercise in exercises:
+        user_exercise_id = exercise.user_exercise_id
+        if user_exercise_id is None:
+            continue
+        track("user_exercise", user_exercise_id)
+        version = get_version("user_exercise", user_exercise_id)
+        cached = _user_exercises.get(user_exercise_id)
+        if cached is None or cached[0] != version:
+            missing[user_exercise_id] = version
+        else:
+            _user_exercises.move_to_end(user_exercise_id)
+
+    if missing:
+        result = await session.execute(
+            select(UserExercises.id, UserExercises.name, UserExercises.description, UserExercises.category_id)
+            .where(UserExercises.id.in_(missing))
+        )
+        for row in result:
+            _user_exercises[row.id] = (missing[row.id],
+                                       CatalogExercise(row.id, row.name, row.description, row.category_id))
+        while len(_user_exercises) > USER_EXERCISES_CACHE_SIZE:
+            _user_exercises.popitem(last=False)
+
+    for exercise in exercises:
+        if exercise.admin_exercise_id is not None:
+            exercise.catalog_info = catalog.exercises_by_id.get(exercise.admin_exercise_id)
+        else:
+            cached = _user_exercises.get(exercise.user_exercise_id)
+            exercise.catalog_info = cached[1] if cached is not None else None
+
+
+def _on_remote_change(scope: str, key) -> None:
+    """
+    Снимок каталога и счетчики сверяются с версиями сами; при полном сбросе выбрасываем их
+    """
+    global _snapshot
+    if scope == ALL:
+        _snapshot = None
+        _user_counts.clear()
+        _user_exercises.clear()
+
+
+subscribe(_on_remote_change)
@@ -0,0 +1,165 @@
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+from datetime import date
+
+from aiogram import Bot
+from aiogram.types import FSInputFile
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.archive import read_archived_sets
+from database.models import AdminExercises, Exercise, Set, TrainingSession, UserExercises
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_COLUMNS = ("date", "session_id", "exercise", "weight", "repetitions")
+# Строк за одну выборку с сервера и за одну запись в файл
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Лимит Telegram на отправку документа ботом
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+# user_id -> задача выгрузки; одна выгрузка на пользователя
+_exports: dict[int, asyncio.Task] = {}
+
+# Название упражнения: собственное, иначе из каталога (см. Exercise.name)
+_exercise_name = func.coalesce(Exercise.name_override, AdminExercises.name, UserExercises.name)
+
+
+class _ExportWriter:
+    """
+    Построчная запись в gzip-файл. Сжатие и запись выполняются в отдельном потоке пачками
+    """
+
+    def __init__(self, path: str, fmt: str):
+        self.fmt = fmt
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.csv = csv.writer(self.file) if fmt == "csv" else None
+        self.rows = 0
+
+    def _write(self, batch: list[tuple]) -> None:
+        if self.csv is not None:
+            self.csv.writerows(batch)
+        else:
+            self.file.writelines(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in batch
+            )
+
+    async def header(self) -> None:
+        if self.csv is not None:
+            await asyncio.to_thread(self.csv.writerow, EXPORT_COLUMNS)
+
+    async def write(self, batch: list[tuple]) -> None:
+        if batch:
+            await asyncio.to_thread(self._write, batch)
+            self.rows += len(batch)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def _export_archived(session: AsyncSession, user_id: int, writer: _ExportWriter) -> None:
+    """
+    Подходы архивированных тренировок (по одной тренировке из архива за раз)
+    """
+    sessions = await session.stream(
+        select(TrainingSession.id, TrainingSession.date)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(True))
+        .order_by(TrainingSession.date)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    names: dict[int, str] = {}
+    async for training_session_id, session_date in sessions:
+        sets = await read_archived_sets(user_id, training_session_id)
+        missing = {archived.exercise_id for archived in sets} - names.keys()
+        if missing:
+            result = await session.execute(
+                select(Exercise.id, _exercise_name)
+                .outerjoin(AdminExercises, Exercise.admin_exercise_id == AdminExercises.id)
+                .outerjoin(UserExercises, Exercise.user_exercise_id == UserExercises.id)
+                .where(Exercise.id.in_(missing))
+            )
+            names.update(result.tuples().all())
+        await writer.write([
+            (session_date.isoformat(sep=" "), str(training_session_id), names.get(archived.exercise_id, ""),
+             archived.weight, archived.repetitions)
+            for archived in sets
+        ])
+
+
+async def _export_sets(session: AsyncSession, user_id: int, writer: _ExportWriter) -> None:
+    """
+    Подходы из таблицы set одним запросом с серверным курсором: в памяти не больше пачки строк
+    """
+    result = await session.stream(
+        select(TrainingSession.date, TrainingSession.id, _exercise_name, Set.weight, Set.repetitions)
+        .join(Set, Set.training_session_id == TrainingSession.id)
+        .join(Exercise, Set.exercise_id == Exercise.id)
+        .outerjoin(AdminExercises, Exercise.admin_exercise_id == AdminExercises.id)
+        .outerjoin(UserExercises, Exercise.user_exercise_id == UserExercises.id)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(False))
+        .order_by(TrainingSession.date, Set.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async for partition in result.partitions():
+        await writer.write([
+            (session_date.isoformat(sep=" "), str(training_session_id), name, weight, repetitions)
+            for session_date, training_session_id, name, weight, repetitions in partition
+        ])
+
+
+async def export_user_history(session_pool: async_sessionmaker, bot: Bot, chat_id: int, user_id: int,
+                              fmt: str) -> None:
+    """
+    Выгружает все подходы пользователя в сжатый файл и отправляет его документом
+    :param session_pool:
+    :param bot:
+    :param chat_id:
+    :param user_id: Telegram ID
+    :param fmt: csv или jsonl
+    :return:
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        writer = _ExportWriter(path, fmt)
+        try:
+            await writer.header()
+            async with session_pool() as session:
+                await _export_archived(session, user_id, writer)
+                await _export_sets(session, user_id, writer)
+        finally:
+            await asyncio.to_thread(writer.close)
+
+        if not writer.rows:
+            await bot.send_message(chat_id, "Нет ни одного выполненного подхода для выгрузки.")
+        elif os.path.getsize(path) > EXPORT_MAX_BYTES:
+            await bot.send_message(chat_id, "Файл выгрузки получился больше 50 МБ и не может быть отправлен.")
+        else:
+            await bot.send_document(
+                chat_id,
+                FSInputFile(path, filename=f"gym_history_{date.today().isoformat()}.{fmt}.gz"),
+                caption=f"История тренировок: {writer.rows} подходов",
+            )
+    except Exception:
+        logging.exception(f"Ошибка выгрузки истории пользователя {user_id}")
+        await bot.send_message(chat_id, "Не удалось выгрузить историю тренировок, попробуйте позже.")
+    finally:
+        os.remove(path)
+
+
+def start_export(session_pool: async_sessionmaker, bot: Bot, chat_id: int, user_id: int, fmt: str) -> bool:
+    """
+    Запускает выгрузку в фоне, чтобы обработчик сразу вернул ответ
+    :return: False, если выгрузка этого пользователя уже идет
+    """
+    running = _exports.get(user_id)
+    if running is not None and not running.done():
+        return False
+    task = asyncio.create_task(export_user_history(session_pool, bot, chat_id, user_id, fmt))
+    _exports[user_id] = task
+    task.add_done_callback(lambda done: _exports.pop(user_id, None) if _exports.get(user_id) is done else None)
+    return True
@@ -0,0 +1,505 @@
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import math
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import NamedTuple
+
+from aiogram import Bot
+from rapidfuzz import fuzz, process, utils as fuzz_utils
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database.catalog import get_catalog
+from database.models import Exercise, Set, TrainingDay, TrainingProgram, TrainingSession, User, UserExercises
+from database.rollups import rollup_sets
+from utils.versions import bump
+
+# Колонки файла (как в выгрузке database/export.py) и их допустимые названия
+IMPORT_COLUMNS = {
+    "date": ("date", "дата"),
+    "session_id": ("session_id", "тренировка"),
+    "exercise": ("exercise", "упражнение"),
+    "weight": ("weight", "вес"),
+    "repetitions": ("repetitions", "reps", "повторения"),
+}
+# Лимит Telegram на скачивание файла ботом
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+# Строк в одной транзакции (и в одном многострочном INSERT)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))
+# Минимальная оценка нечеткого совпадения названия упражнения (0-100, fuzz.token_sort_ratio)
+IMPORT_MATCH_SCORE = float(os.getenv("IMPORT_MATCH_SCORE", 80))
+# Не чаще чем раз в столько секунд обновляется сообщение о ходе импорта
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", 3))
+IMPORT_PROGRAM_NAME = "Импорт истории"
+IMPORT_DAY_NAME = "Импорт"
+
+# Сколько ошибок и нераспознанных названий показывать в отчете
+_REPORT_LIMIT = 5
+# Кроме ISO 8601 (как в выгрузке)
+_DATE_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y")
+# Пространство имен uuid тренировок, сгруппированных по дате: повторный импорт дает те же id
+_SESSION_NAMESPACE = uuid.UUID("0f4bd3c2-7a0e-4c4e-9a3e-5b7f2f6d9c11")
+
+# user_id -> задача импорта; один импорт на пользователя
+_imports: dict[int, asyncio.Task] = {}
+
+
+class HistoryImportError(ValueError):
+    """
+    Файл нельзя импортировать (нет нужных колонок, неизвестная кодировка и т.п.)
+    """
+
+
+class ImportRow(NamedTuple):
+    line: int
+    date: datetime
+    session_key: str
+    exercise: str
+    weight: float
+    repetitions: int
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.sets = 0
+        self.sessions = 0
+        self.duplicates = 0
+        self.errors: list[str] = []
+        self.invalid = 0
+        self.unmatched: dict[str, int] = {}
+
+    def error(self, line: int, text: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < _REPORT_LIMIT:
+            self.errors.append(f"строка {line}: {text}")
+
+    def progress(self) -> str:
+        return f"Импорт истории: обработано строк {self.rows}, добавлено подходов {self.sets}..."
+
+    def report(self) -> str:
+        lines = [
+            "Импорт завершен.",
+            f"Строк в файле: {self.rows}",
+            f"Добавлено тренировок: {self.sessions}, подходов: {self.sets}",
+        ]
+        if self.duplicates:
+            lines.append(f"Уже были загружены ранее, пропущено подходов: {self.duplicates}")
+        if self.invalid:
+            lines.append(f"Строк с ошибками: {self.invalid}")
+            lines.extend(f"  {error}" for error in self.errors)
+        if self.unmatched:
+            top = sorted(self.unmatched.items(), key=lambda item: -item[1])[:_REPORT_LIMIT]
+            lines.append(f"Не найдены упражнения ({sum(self.unmatched.values())} подходов пропущено):")
+            lines.extend(f"  {name} - {count}" for name, count in top)
+            lines.append("Добавьте их как свои упражнения и загрузите файл еще раз: "
+                         "уже загруженные подходы повторно не добавятся.")
+        return "\n".join(lines)
+
+
+def _parse_date(text: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(text).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def _normalize(name: str) -> str:
+    return fuzz_utils.default_process(name).replace("ё", "е")
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    raw = gzip.open(path, "rb") if compressed else open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+class _CsvSource:
+    """
+    Построчное чтение CSV (в т.ч. .gz) с проверкой строк. Читается в отдельном потоке пачками
+    """
+
+    def __init__(self, path: str, user_id: int):
+        self.user_id = user_id
+        self.file = _open_text(path)
+        try:
+            header = self.file.readline()
+        except (UnicodeDecodeError, OSError):
+            self.file.close()
+            raise HistoryImportError("Файл должен быть CSV в кодировке UTF-8 (можно сжатый gzip).")
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        names = [name.strip().lower() for name in next(csv.reader([header], delimiter=delimiter), [])]
+        self.columns: dict[str, int] = {}
+        for column, aliases in IMPORT_COLUMNS.items():
+            for alias in aliases:
+                if alias in names:
+                    self.columns[column] = names.index(alias)
+                    break
+        missing = [column for column in IMPORT_COLUMNS if column != "session_id" and column not in self.columns]
+        if missing:
+            self.file.close()
+            raise HistoryImportError(f"В первой строке файла нет колонок: {', '.join(missing)}.")
+        self.reader = csv.reader(self.file, delimiter=delimiter)
+
+    def _value(self, row: list[str], column: str) -> str:
+        index = self.columns.get(column)
+        return row[index].strip() if index is not None and index < len(row) else ""
+
+    def _parse(self, line: int, row: list[str]) -> ImportRow | str:
+        """
+        :return: проверенная строка или текст ошибки
+        """
+        text = self._value(row, "date")
+        row_date = _parse_date(text)
+        if row_date is None:
+            return f"неверная дата «{text}»"
+        if row_date > datetime.now():
+            return "дата из будущего"
+
+        name = self._value(row, "exercise")
+        if not name:
+            return "нет названия упражнения"
+        try:
+            weight = float(self._value(row, "weight").replace(",", ".") or 0)
+            repetitions = float(self._value(row, "repetitions").replace(",", "."))
+            if not math.isfinite(weight) or not math.isfinite(repetitions):
+                raise ValueError
+            repetitions = int(repetitions)
+        except (ValueError, OverflowError):
+            return "вес и повторения должны быть числами"
+        if not 0 <= weight <= 1000 or not 0 < repetitions <= 1000:
+            return "вес должен быть от 0 до 1000, повторения - от 1 до 1000"
+
+        session_key = self._value(row, "session_id")
+        try:
+            session_key = str(uuid.UUID(session_key))
+        except ValueError:
+            # Без uuid тренировки подходы одного дня считаются одной тренировкой
+            session_key = str(uuid.uuid5(_SESSION_NAMESPACE, f"{self.user_id}:{row_date.date().isoformat()}"))
+        return ImportRow(line, row_date, session_key, name, weight, repetitions)
+
+    def read(self, size: int) -> list[tuple[int, ImportRow | str]]:
+        chunk = []
+        try:
+            for row in self.reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                chunk.append((self.reader.line_num, self._parse(self.reader.line_num, row)))
+                if len(chunk) >= size:
+                    break
+        except (UnicodeDecodeError, csv.Error):
+            raise HistoryImportError(f"Ошибка чтения файла в строке {self.reader.line_num + 1}.")
+        return chunk
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _ExerciseIndex:
+    """
+    Сопоставление названий из файла с упражнениями пользователя и каталога. Обработанные названия
+    вычисляются один раз, результат сопоставления запоминается для каждого названия файла
+    """
+
+    def __init__(self, choices: list[tuple[str, tuple[str, int]]]):
+        self.targets = [target for _, target in choices]
+        self.names = [_normalize(name) for name, _ in choices]
+        self.exact = {}
+        for name, target in zip(self.names, self.targets):
+            self.exact.setdefault(name, target)
+        self.cache: dict[str, tuple[str, int] | None] = {}
+
+    def match(self, name: str) -> tuple[str, int] | None:
+        """
+        :return: ("exercise", Exercise.id), ("admin", AdminExercises.id), ("user", UserExercises.id) или None
+        """
+        if name in self.cache:
+            return self.cache[name]
+        processed = _normalize(name)
+        target = self.exact.get(processed)
+        if target is None and self.names:
+            found = process.extractOne(processed, self.names, scorer=fuzz.token_sort_ratio, processor=None,
+                                       score_cutoff=IMPORT_MATCH_SCORE)
+            if found is not None:
+                target = self.targets[found[2]]
+        self.cache[name] = target
+        return target
+
+
+async def _build_index(session: AsyncSession, user_id: int) -> tuple[_ExerciseIndex, dict[tuple[str, int], int]]:
+    """
+    :return: индекс названий и уже существующие упражнения программ пользователя по источнику
+        (("admin"/"user", id) -> Exercise.id), упражнения активной программы в приоритете
+    """
+    catalog = await get_catalog(session)
+    actual_program_id = await session.scalar(select(User.actual_program_id).where(User.user_id == user_id))
+    result = await session.execute(
+        select(Exercise.id, Exercise.name_override, Exercise.admin_exercise_id, Exercise.user_exercise_id,
+               TrainingDay.training_program_id)
+        .join(TrainingDay, Exercise.training_day_id == TrainingDay.id)
+        .join(TrainingProgram, TrainingDay.training_program_id == TrainingProgram.id)
+        .where(TrainingProgram.user_id == user_id)
+        .order_by(Exercise.id)
+    )
+    choices: list[tuple[str, tuple[str, int]]] = []
+    existing: dict[tuple[str, int], int] = {}
+    for exercise_id, name_override, admin_exercise_id, user_exercise_id, program_id in result:
+        if name_override:
+            choices.append((name_override, ("exercise", exercise_id)))
+        source = ("admin", admin_exercise_id) if admin_exercise_id is not None else ("user", user_exercise_id)
+        if source not in existing or program_id == actual_program_id:
+            existing[source] = exercise_id
+
+    user_exercises = await session.execute(
+        select(UserExercises.name, UserExercises.id).where(UserExercises.user_id == user_id)
+    )
+    choices.extend((name, ("user", user_exercise_id)) for name, user_exercise_id in user_exercises)
+    choices.extend((exercise.name, ("admin", exercise.id)) for exercise in catalog.exercises)
+    return _ExerciseIndex(choices), existing
+
+
+class _HistoryImporter:
+    def __init__(self, session_pool: async_sessionmaker, user_id: int):
+        self.session_pool = session_pool
+        self.user_id = user_id
+        self.stats = ImportStats()
+        self.index: _ExerciseIndex | None = None
+        # ("admin"/"user", id) -> Exercise.id, в которое пишутся подходы
+        self.exercises: dict[tuple[str, int], int] = {}
+        self.program_id: int | None = None
+        self.day_id: int | None = None
+        self.position = 0
+        self.program_created = False
+        # uuid тренировки -> (дата, упражнения, подходы которых уже были в базе до импорта)
+        self.sessions: dict[str, tuple[datetime, frozenset[int]]] = {}
+        # Тренировки, в которые импорт не пишет: чужие и архивированные
+        self.skipped: set[str] = set()
+
+    async def _import_day(self, session: AsyncSession) -> int:
+        """
+        День программы «Импорт истории», куда добавляются упражнения, которых нет в программах пользователя
+        """
+        if self.day_id is None:
+            self.program_id = await session.scalar(
+                select(TrainingProgram.id)
+                .where(TrainingProgram.user_id == self.user_id, TrainingProgram.name == IMPORT_PROGRAM_NAME)
+                .limit(1)
+            )
+            if self.program_id is None:
+                program = TrainingProgram(name=IMPORT_PROGRAM_NAME, user_id=self.user_id)
+                session.add(program)
+                await session.flush()
+                self.program_id = program.id
+                self.program_created = True
+            self.day_id = await session.scalar(
+                select(TrainingDay.id).where(TrainingDay.training_program_id == self.program_id).limit(1)
+            )
+            if self.day_id is None:
+                day = TrainingDay(day_of_week=IMPORT_DAY_NAME, training_program_id=self.program_id)
+                session.add(day)
+                await session.flush()
+                self.day_id = day.id
+            max_position = await session.scalar(
+                select(func.max(Exercise.position)).where(Exercise.training_day_id == self.day_id)
+            )
+            self.position = -1 if max_position is None else max_position
+        return self.day_id
+
+    async def _exercise_id(self, session: AsyncSession, target: tuple[str, int]) -> int:
+        kind, target_id = target
+        if kind == "exercise":
+            return target_id
+        exercise_id = self.exercises.get(target)
+        if exercise_id is None:
+            day_id = await self._import_day(session)
+            self.position += 1
+            exercise = Exercise(
+                training_day_id=day_id,
+                position=self.position,
+                admin_exercise_id=target_id if kind == "admin" else None,
+                user_exercise_id=target_id if kind == "user" else None,
+            )
+            session.add(exercise)
+            await session.flush()
+            exercise_id = self.exercises[target] = exercise.id
+        return exercise_id
+
+    async def _load_sessions(self, session: AsyncSession, keys: set[str]) -> None:
+        """
+        Тренировки пачки, которые уже есть в базе (повторный импорт того же файла или выгрузки).
+        В свои тренировки дописываются только упражнения, которых в них еще нет
+        """
+        result = await session.execute(
+            select(TrainingSession.id, TrainingSession.user_id, TrainingSession.date, TrainingSession.archived)
+            .where(TrainingSession.id.in_([uuid.UUID(key) for key in keys]))
+        )
+        own = {}
+        for training_session_id, user_id, session_date, archived in result:
+            if user_id != self.user_id or archived:
+                self.skipped.add(str(training_session_id))
+            else:
+                own[training_session_id] = session_date
+        if own:
+            result = await session.execute(
+                select(Set.training_session_id, Set.exercise_id).distinct()
+                .where(Set.training_session_id.in_(own))
+            )
+            exercises: dict[uuid.UUID, set[int]] = {}
+            for training_session_id, exercise_id in result:
+                exercises.setdefault(training_session_id, set()).add(exercise_id)
+            for training_session_id, session_date in own.items():
+                self.sessions[str(training_session_id)] = (
+                    session_date, frozenset(exercises.get(training_session_id, ()))
+                )
+
+    async def _write_chunk(self, session: AsyncSession, rows: list[ImportRow]) -> None:
+        """
+        Одна транзакция: новые тренировки и подходы пачки многострочными INSERT
+        """
+        new_keys = {row.session_key for row in rows} - self.sessions.keys() - self.skipped
+        if new_keys:
+            await self._load_sessions(session, new_keys)
+
+        sessions = []
+        sets = []
+        for row in rows:
+            if row.session_key in self.skipped:
+                self.stats.duplicates += 1
+                continue
+            target = self.index.match(row.exercise)
+            if target is None:
+                self.stats.unmatched[row.exercise] = self.stats.unmatched.get(row.exercise, 0) + 1
+                continue
+            exercise_id = await self._exercise_id(session, target)
+            known = self.sessions.get(row.session_key)
+            if known is None:
+                known = self.sessions[row.session_key] = (row.date, frozenset())
+                sessions.append({"id": uuid.UUID(row.session_key), "user_id": self.user_id,
+                                 "date": row.date, "note": IMPORT_PROGRAM_NAME})
+            session_date, existing_exercises = known
+            if exercise_id in existing_exercises:
+                self.stats.duplicates += 1
+                continue
+            sets.append({
+                "exercise_id": exercise_id,
+                "weight": row.weight,
+                "repetitions": row.repetitions,
+                "training_session_id": uuid.UUID(row.session_key),
+                # Подходы тренировки не раньше ее даты (см. _sets_of_session)
+                "created": session_date,
+            })
+        if sessions:
+            await session.execute(insert(TrainingSession).values(sessions))
+        if sets:
+            await session.execute(insert(Set).values(sets))
+            await rollup_sets(session, self.user_id, [
+                (item["exercise_id"], item["weight"], item["repetitions"], item["created"]) for item in sets
+            ])
+        await session.commit()
+        self.stats.sessions += len(sessions)
+        self.stats.sets += len(sets)
+
+    async def run(self, source: _CsvSource, on_progress) -> ImportStats:
+        async with self.session_pool() as session:
+            self.index, self.exercises = await _build_index(session, self.user_id)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(source.read, IMPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                valid = []
+                for line, row in chunk:
+                    if isinstance(row, str):
+                        self.stats.error(line, row)
+                    else:
+                        valid.append(row)
+                self.stats.rows += len(chunk)
+                if valid:
+                    async with self.session_pool() as session:
+                        await self._write_chunk(session, valid)
+                await on_progress(self.stats)
+        finally:
+            if self.stats.sets:
+                bump("sets", self.user_id)
+                bump("sessions", self.user_id)
+            if self.program_created:
+                bump("user", self.user_id)
+            if self.program_id is not None:
+                bump("program", self.program_id)
+                bump("day", self.day_id)
+        return self.stats
+
+
+async def import_user_history(session_pool: async_sessionmaker, bot: Bot, chat_id: int, user_id: int,
+                              path: str) -> None:
+    """
+    Загружает историю тренировок из CSV-файла (колонки как в выгрузке /export) и сообщает о ходе импорта,
+    редактируя одно сообщение
+    :param session_pool:
+    :param bot:
+    :param chat_id:
+    :param user_id: Telegram ID
+    :param path: скачанный файл, удаляется после импорта
+    :return:
+    """
+    message = None
+    last_edit = time.monotonic()
+
+    async def on_progress(stats: ImportStats) -> None:
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await bot.edit_message_text(stats.progress(), chat_id=chat_id, message_id=message.message_id)
+        except Exception:
+            logging.exception("Не удалось обновить сообщение о ходе импорта")
+
+    source = None
+    try:
+        message = await bot.send_message(chat_id, "Импорт истории: читаю файл...")
+        source = await asyncio.to_thread(_CsvSource, path, user_id)
+        stats = await _HistoryImporter(session_pool, user_id).run(source, on_progress)
+        text = stats.report() if stats.rows else "В файле нет ни одной строки с подходами."
+    except HistoryImportError as e:
+        text = f"Не удалось импортировать файл. {e}"
+    except Exception:
+        logging.exception(f"Ошибка импорта истории пользователя {user_id}")
+        text = "Импорт прерван из-за ошибки, попробуйте позже. Уже загруженные тренировки сохранены."
+    finally:
+        if source is not None:
+            await asyncio.to_thread(source.close)
+        os.remove(path)
+    if message is not None:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message.message_id)
+
+
+def import_running(user_id: int) -> bool:
+    running = _imports.get(user_id)
+    return running is not None and not running.done()
+
+
+def start_import(session_pool: async_sessionmaker, bot: Bot, chat_id: int, user_id: int, path: str) -> bool:
+    """
+    Запускает импорт в фоне, чтобы обработчик сразу вернул ответ
+    :return: False, если импорт этого пользователя уже идет
+    """
+    if import_running(user_id):
+        return False
+    task = asyncio.create_task(import_user_history(session_pool, bot, chat_id, user_id, path))
+    _imports[user_id] = task
+    task.add_done_callback(lambda done: _imports.pop(user_id, None) if _imports.get(user_id) is done else None)
+    return True
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Hashable
+
+from utils.versions import ALL, apply_remote, invalidate_all, set_publisher
+
+INVALIDATION_CHANNEL = os.getenv("INVALIDATION_CHANNEL", "gym_cache_invalidation")
+# Лимит NOTIFY - 8000 байт, оставляем запас
+INVALIDATION_PAYLOAD_LIMIT = 7500
+# Если накопилось больше событий (например, пока не было соединения), рассылаем "сбросить всё"
+INVALIDATION_MAX_PENDING = int(os.getenv("INVALIDATION_MAX_PENDING", 5000))
+INVALIDATION_KEEPALIVE = float(os.getenv("INVALIDATION_KEEPALIVE", 30))
+INVALIDATION_RECONNECT_DELAY = 1.0
+
+
+class InvalidationBus:
+    """
+    Шина инвалидации кэшей. Функции записи вызывают bump(), bump() передает событие в publish(),
+    а шина доставляет его остальным экземплярам бота, где оно применяется через apply_remote()
+    """
+
+    async def start(self) -> None:
+        set_publisher(self.publish)
+
+    async def stop(self) -> None:
+        set_publisher(None)
+
+    def publish(self, scope: str, key: Hashable = None) -> None:
+        raise NotImplementedError
+
+
+class LocalBus(InvalidationBus):
+    """
+    Один процесс (SQLite): версии общие для всех обработчиков, рассылать некому
+    """
+
+    def publish(self, scope: str, key: Hashable = None) -> None:
+        pass
+
+
+class PostgresBus(InvalidationBus):
+    """
+    Рассылка через Postgres LISTEN/NOTIFY на отдельном соединении asyncpg.
+    События копятся до ближайшего прохода цикла отправки и уходят пачкой,
+    поэтому задержка между экземплярами - время одного NOTIFY
+    """
+
+    def __init__(self, dsn: str, channel: str = INVALIDATION_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex
+        self._pending: dict[tuple[str, Hashable], None] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await super().start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, scope: str, key: Hashable = None) -> None:
+        if len(self._pending) >= INVALIDATION_MAX_PENDING:
+            self._pending = {(ALL, None): None}
+        else:
+            self._pending[(scope, key)] = None
+        self._wakeup.set()
+
+    def _payloads(self, events: list[tuple[str, Hashable]]) -> list[str]:
+        """
+        Разбивает события на сообщения, укладывающиеся в лимит NOTIFY
+        """
+        payloads, chunk, size = [], [], 0
+        for scope, key in events:
+            item = json.dumps([scope, key], ensure_ascii=False)
+            if chunk and size + len(item.encode()) > INVALIDATION_PAYLOAD_LIMIT:
+                payloads.append(self._encode(chunk))
+                chunk, size = [], 0
+            chunk.append([scope, key])
+            size += len(item.encode()) + 1
+        if chunk:
+            payloads.append(self._encode(chunk))
+        return payloads
+
+    def _encode(self, chunk: list) -> str:
+        return json.dumps({"n": self.node_id, "e": chunk}, ensure_ascii=False, separators=(",", ":"))
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logging.warning(f"Некорректное событие инвалидации: {payload[:200]}")
+            return
+        if message.get("n") == self.node_id:
+            return
+        for scope, key in message.get("e", ()):
+            if scope == ALL:
+                invalidate_all()
+            else:
+                apply_remote(scope, key)
+
+    async def _run(self) -> None:
+        import asyncpg
+
+        connected_before = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: (lost.set(), self._wakeup.set()))
+                await connection.add_listener(self.channel, self._on_notify)
+                if connected_before:
+                    # Пока соединения не было, изменения других экземпляров могли пройти мимо
+                    logging.warning("Шина инвалидации переподключена, сбрасываем кэши")
+                    invalidate_all()
+                connected_before = True
+                logging.info(f"Шина инвалидации слушает канал {self.channel}")
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=INVALIDATION_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        await connection.execute("SELECT 1")
+                        continue
+                    self._wakeup.clear()
+                    if not self._pending:
+                        continue
+                    events, self._pending = list(self._pending), {}
+                    try:
+                        await connection.executemany(
+                            "SELECT pg_notify($1, $2)",
+                            [(self.channel, payload) for payload in self._payloads(events)],
+                        )
+                    except Exception:
+                        # Возвращаем неотправленные события в очередь, они уйдут после переподключения
+                        self._pending = dict.fromkeys(events) | self._pending
+                        raise
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("Ошибка шины инвалидации, переподключение")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    try:
+                        await connection.close(timeout=5)
+                    except Exception:
+                        connection.terminate()
+            await asyncio.sleep(INVALIDATION_RECONNECT_DELAY)
+
+
+def create_bus(db_url: str) -> InvalidationBus:
+    """
+    Выбирает реализацию шины по адресу базы данных
+    :param db_url: DB_URL из database.engine
+    :return: PostgresBus для asyncpg, иначе LocalBus
+    """
+    from sqlalchemy.engine import make_url
+
+    url = make_url(db_url)
+    if url.drivername == "postgresql+asyncpg":
+        return PostgresBus(url.set(drivername="postgresql").render_as_string(hide_password=False))
+    return LocalBus()
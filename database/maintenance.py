@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.archive import (
+    ARCHIVE_AFTER_DAYS, HISTORY_ARCHIVE_DIR, archive_user_history, users_with_archivable_history
+)
+from database.orm_query import orm_delete_empty_training_sessions
+
+# Раз в сколько секунд запускается очистка
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 3600))
+# Тренировки моложе этого возраста (часы) не трогаем
+SESSION_SWEEP_MIN_AGE = float(os.getenv("SESSION_SWEEP_MIN_AGE", 24))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", 500))
+# Пауза между пачками, чтобы не занимать базу надолго
+SESSION_SWEEP_BATCH_PAUSE = float(os.getenv("SESSION_SWEEP_BATCH_PAUSE", 0.5))
+
+# Раз в сколько секунд запускается перенос старой истории в архив
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 86400))
+ARCHIVE_USERS_PER_RUN = int(os.getenv("ARCHIVE_USERS_PER_RUN", 100))
+
+
+class PeriodicJob:
+    """
+    Фоновая задача, которая выполняет run_once() каждые interval секунд
+    """
+    interval: float = 3600
+
+    def __init__(self, session_pool: async_sessionmaker):
+        self.session_pool = session_pool
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> None:
+        raise NotImplementedError
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logging.exception(f"Ошибка фоновой задачи {type(self).__name__}")
+            await asyncio.sleep(self.interval)
+
+
+class EmptySessionSweeper(PeriodicJob):
+    """
+    Фоновая очистка тренировок без подходов. Удаляет их небольшими пачками отдельными транзакциями
+    """
+    interval = SESSION_SWEEP_INTERVAL
+
+    async def sweep(self) -> int:
+        """
+        Один проход очистки
+        :return: кол-во удаленных тренировок
+        """
+        older_than = datetime.now() - timedelta(hours=SESSION_SWEEP_MIN_AGE)
+        total = 0
+        while True:
+            async with self.session_pool() as session:
+                deleted = await orm_delete_empty_training_sessions(session, older_than, SESSION_SWEEP_BATCH_SIZE)
+            total += deleted
+            if deleted < SESSION_SWEEP_BATCH_SIZE:
+                return total
+            await asyncio.sleep(SESSION_SWEEP_BATCH_PAUSE)
+
+    async def run_once(self) -> None:
+        deleted = await self.sweep()
+        if deleted:
+            logging.info(f"Удалено пустых тренировок: {deleted}")
+
+
+class HistoryArchiver(PeriodicJob):
+    """
+    Перенос подходов тренировок старше ARCHIVE_AFTER_DAYS в архивы пользователей (database/archive.py).
+    Работает, только если задан HISTORY_ARCHIVE_DIR
+    """
+    interval = ARCHIVE_INTERVAL
+
+    async def start(self) -> None:
+        if HISTORY_ARCHIVE_DIR:
+            await super().start()
+
+    async def run_once(self) -> None:
+        older_than = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+        async with self.session_pool() as session:
+            user_ids = await users_with_archivable_history(session, older_than, ARCHIVE_USERS_PER_RUN)
+        archived = 0
+        for user_id in user_ids:
+            try:
+                async with self.session_pool() as session:
+                    archived += await archive_user_history(session, user_id, older_than)
+            except Exception:
+                logging.exception(f"Ошибка архивации истории пользователя {user_id}")
+            await asyncio.sleep(SESSION_SWEEP_BATCH_PAUSE)
+        if archived:
+            logging.info(f"Перенесено в архив тренировок: {archived}")
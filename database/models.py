@@ -1,15 +1,45 @@
+import os
+import threading
+import time
 import uuid
 from typing import List
 
 from sqlalchemy import (
-    String, Float, DateTime, func, Integer, ForeignKey, Text,
-    BigInteger, Index, CheckConstraint, Boolean
+    String, Float, DateTime, Date, func, Integer, ForeignKey, Text,
+    BigInteger, Index, CheckConstraint, Boolean, false
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import (
     DeclarativeBase, Mapped, mapped_column, relationship
 )
 
+_uuid7_lock = threading.Lock()
+_uuid7_last = (0, 0)
+
+
+def uuid7() -> uuid.UUID:
+    """
+    UUID версии 7 (RFC 9562): 48 бит - время в мс, далее 12-битный счетчик и 62 случайных бита.
+    Ключи возрастают во времени (в пределах процесса - строго), поэтому новые строки дописываются
+    в конец индекса, а не в случайное место, как с uuid4
+    :return:
+    """
+    global _uuid7_last
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        last_ms, counter = _uuid7_last
+        if ms <= last_ms:
+            ms, counter = last_ms, counter + 1
+            if counter > 0xFFF:
+                ms, counter = last_ms + 1, 0
+        else:
+            counter = 0
+        _uuid7_last = (ms, counter)
+    rand_b = int.from_bytes(os.urandom(8), "big") & 0x3FFF_FFFF_FFFF_FFFF
+    value = (ms & 0xFFFF_FFFF_FFFF) << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | rand_b
+    return uuid.UUID(int=value)
+
+
 class Base(DeclarativeBase):
     """
     Базовый класс с полями created/updated для всех таблиц.
@@ -174,8 +204,10 @@ class Exercise(Base):
     )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str] = mapped_column(String(150))
-    description: Mapped[str] = mapped_column(Text)
+    # Только собственные название/описание упражнения в программе; NULL - берутся из каталога
+    # (AdminExercises/UserExercises), см. name/description и database/catalog.py
+    name_override: Mapped[str] = mapped_column('name', String(150), nullable=True)
+    description_override: Mapped[str] = mapped_column('description', Text, nullable=True)
     base_sets: Mapped[int] = mapped_column(Integer(), default=3)
     base_reps: Mapped[int] = mapped_column(Integer(), default=10)
     training_day_id: Mapped[int] = mapped_column(ForeignKey("training_day.id", ondelete='CASCADE'), nullable=False)
@@ -208,6 +240,21 @@ class Exercise(Base):
         passive_deletes=True
     )
 
+    # Данные каталога (CatalogExercise), подставляются database.catalog.load_exercise_info()
+    catalog_info = None
+
+    @property
+    def name(self) -> str:
+        if self.name_override is not None:
+            return self.name_override
+        return self.catalog_info.name if self.catalog_info is not None else ""
+
+    @property
+    def description(self) -> str:
+        if self.description_override is not None:
+            return self.description_override
+        return self.catalog_info.description if self.catalog_info is not None else ""
+
 
 class ExerciseSet(Base):
     """
@@ -228,15 +275,17 @@ class TrainingSession(Base):
     """
     __tablename__ = 'training_session'
 
-    # Используем UUID в качестве первичного ключа
+    # Используем UUID в качестве первичного ключа; uuid7 упорядочены по времени
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True),
         primary_key=True,
-        default=uuid.uuid4
+        default=uuid7
     )
     user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False)
     date: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now())
     note: Mapped[str] = mapped_column(Text, nullable=True)
+    # Подходы перенесены из таблицы set в архив пользователя (database/archive.py)
+    archived: Mapped[bool] = mapped_column(Boolean(), default=False, server_default=false(), nullable=False)
 
     user: Mapped['User'] = relationship(
         "User",
@@ -283,3 +332,52 @@ class Set(Base):
         back_populates="sets",
         lazy='select'
     )
+
+
+class DailyRollup(Base):
+    """
+    Итоги тренировок пользователя за день по категории упражнений; category_id = 0 - по всем категориям.
+    Поддерживаются при сохранении подходов (database/rollups.py)
+    """
+    __tablename__ = 'daily_rollup'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True, default=0)
+    sets: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    reps: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    volume: Mapped[float] = mapped_column(Float(), nullable=False, default=0)  # сумма вес * повторения
+    first_set: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    last_set: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+
+    @property
+    def duration(self) -> int:
+        """
+        Время от первого до последнего подхода за день, секунды
+        """
+        return int((self.last_set - self.first_set).total_seconds())
+
+
+class WeeklyRollup(Base):
+    """
+    Итоги тренировок пользователя за неделю (week - понедельник) по категории; category_id = 0 - все категории
+    """
+    __tablename__ = 'weekly_rollup'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
+    week: Mapped[Date] = mapped_column(Date, primary_key=True)
+    category_id: Mapped[int] = mapped_column(Integer, primary_key=True, default=0)
+    sets: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    reps: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    volume: Mapped[float] = mapped_column(Float(), nullable=False, default=0)
+    training_days: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    duration: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # сумма длительностей дней, секунды
+
+
+class RollupState(Base):
+    """
+    Итоги пользователя собраны полностью. Нет строки - итоги пересобираются при следующем чтении
+    """
+    __tablename__ = 'rollup_state'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.user_id', ondelete='CASCADE'), primary_key=True)
@@ -1,6 +1,9 @@
-from sqlalchemy import select, update, delete, func, union_all, and_
+import uuid
+
+from sqlalchemy import select, update, delete, insert, func, and_, literal, exists
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from database.models import (
     User,
@@ -11,8 +14,13 @@ from database.models import (
     Set,
     AdminExercises,
     ExerciseCategory,
-    UserExercises, TrainingSession
+    UserExercises, TrainingSession, DailyRollup, WeeklyRollup
 )
+from database.archive import archived_max, read_archived_sets
+from database.catalog import get_catalog, get_user_category_counts, load_exercise_info
+from database.rollups import ensure_rollups, rollup_sets, stale_rollups
+from database.user_cache import CachedUser, user_cache
+from utils.versions import bump, get_version, track
 
 async def _one(session: AsyncSession, stmt):
     res = await session.execute(stmt)
@@ -22,6 +30,20 @@ async def _all(session: AsyncSession, stmt):
     res = await session.execute(stmt)
     return res.scalars().all() 
 
+
+def _exercise_owners(*where):
+    """
+    Telegram ID владельцев упражнений, подходящих под условия
+    """
+    return (
+        select(TrainingProgram.user_id)
+        .join(TrainingDay, TrainingDay.training_program_id == TrainingProgram.id)
+        .join(Exercise, Exercise.training_day_id == TrainingDay.id)
+        .where(*where)
+        .distinct()
+    )
+
+
 """
 Работа с изображениями
 """
@@ -43,6 +65,8 @@ async def orm_add_banner_description(session: AsyncSession, data: dict):
         else:
             session.add(Banner(name=name, description=description))
     await session.commit()
+    for name in data:
+        bump("banner", name)
 
 
 async def orm_change_banner_image(session: AsyncSession, name: str, image: str):
@@ -56,6 +80,7 @@ async def orm_change_banner_image(session: AsyncSession, name: str, image: str):
     query = update(Banner).where(Banner.name == name).values(image=image)
     await session.execute(query)
     await session.commit()
+    bump("banner", name)
 
 
 async def orm_get_banner(session: AsyncSession, page: str):
@@ -65,6 +90,7 @@ async def orm_get_banner(session: AsyncSession, page: str):
     :param page:
     :return:
     """
+    track("banner", page)
     stmt = select(Banner).where(Banner.name == page).limit(1)
     return await _one(session, stmt)
 
@@ -98,6 +124,7 @@ async def orm_add_program(session: AsyncSession, data: dict):
     )
     session.add(obj)
     await session.commit()
+    bump("user", data['user_id'])
 
 
 async def orm_update_program(session: AsyncSession, program_id: int, data: dict):
@@ -112,9 +139,12 @@ async def orm_update_program(session: AsyncSession, program_id: int, data: dict)
         update(TrainingProgram)
         .where(TrainingProgram.id == program_id)
         .values(name=data["name"])
+        .returning(TrainingProgram.user_id)
     )
-    await session.execute(query)
+    user_id = (await session.execute(query)).scalar()
     await session.commit()
+    bump("program", program_id)
+    bump("user", user_id)
 
 
 async def orm_get_programs(session: AsyncSession, user_id: int):
@@ -124,6 +154,7 @@ async def orm_get_programs(session: AsyncSession, user_id: int):
     :param user_id: Telegram ID
     :return:
     """
+    track("user", user_id)
     query = select(TrainingProgram).filter(TrainingProgram.user_id == user_id)
     result = await session.execute(query)
     return result.scalars().all()
@@ -136,6 +167,7 @@ async def orm_get_program(session: AsyncSession, program_id: int):
     :param program_id:
     :return:
     """
+    track("program", program_id)
     stmt = select(TrainingProgram).where(TrainingProgram.id == program_id).limit(1)
     return await _one(session, stmt)
 
@@ -146,9 +178,178 @@ async def orm_delete_program(session: AsyncSession, program_id: int):
     :param program_id:
     :return:
     """
-    query = delete(TrainingProgram).where(TrainingProgram.id == program_id)
-    await session.execute(query)
+    day_ids = (await session.execute(
+        select(TrainingDay.id).where(TrainingDay.training_program_id == program_id)
+    )).scalars().all()
+    query = delete(TrainingProgram).where(TrainingProgram.id == program_id).returning(TrainingProgram.user_id)
+    user_id = (await session.execute(query)).scalar()
+    if user_id is not None:
+        await session.execute(stale_rollups([user_id]))
     await session.commit()
+    bump("program", program_id)
+    bump("user", user_id)
+    bump("sets", user_id)
+    for day_id in day_ids:
+        bump("day", day_id)
+
+
+async def orm_clone_program(session: AsyncSession, program_id: int, user_id: int, name: str | None = None):
+    """
+    Копирует программу со всеми днями, упражнениями и шаблонными подходами целиком на стороне базы:
+    по одному INSERT ... SELECT на таблицу в одной транзакции, независимо от размера программы.
+    Дни копии сопоставляются с оригиналами по дню недели и порядку среди одноименных дней,
+    упражнения - по порядковому номеру в дне.
+    Пользовательские упражнения чужой программы копируются в библиотеку получателя, если их там еще нет
+    :param session:
+    :param program_id: id исходной программы
+    :param user_id: Telegram ID получателя копии
+    :param name: название копии (по умолчанию - как у исходной)
+    :return: id новой программы или None, если исходная не найдена
+    """
+    from database.models import ExerciseSet
+
+    settings = (
+        TrainingProgram.rest_between_exercise,
+        TrainingProgram.rest_between_set,
+        TrainingProgram.circular_rounds,
+        TrainingProgram.circular_rest_between_rounds,
+        TrainingProgram.circular_rest_between_exercise,
+    )
+    new_program_id = (await session.execute(
+        insert(TrainingProgram)
+        .from_select(
+            ["name", "user_id", *(column.key for column in settings)],
+            select(literal(name) if name else TrainingProgram.name, literal(user_id), *settings)
+            .where(TrainingProgram.id == program_id),
+        )
+        .returning(TrainingProgram.id)
+    )).scalar()
+    if new_program_id is None:
+        await session.rollback()
+        return None
+
+    new_day_ids = (await session.execute(
+        insert(TrainingDay)
+        .from_select(
+            ["training_program_id", "day_of_week"],
+            select(literal(new_program_id), TrainingDay.day_of_week)
+            .where(TrainingDay.training_program_id == program_id)
+            .order_by(TrainingDay.id),
+        )
+        .returning(TrainingDay.id)
+    )).scalars().all()
+
+    old_day = aliased(TrainingDay)
+
+    # В программе может быть несколько дней с одним названием: пары дней - по названию и порядку внутри него
+    def numbered_days(training_program_id):
+        return (
+            select(
+                TrainingDay.id,
+                TrainingDay.day_of_week,
+                func.row_number().over(partition_by=TrainingDay.day_of_week, order_by=TrainingDay.id).label("ordinal"),
+            )
+            .where(TrainingDay.training_program_id == training_program_id)
+            .subquery()
+        )
+
+    old_days = numbered_days(program_id)
+    new_days = numbered_days(new_program_id)
+    day_pairs = (
+        select(old_days.c.id.label("old_id"), new_days.c.id.label("new_id"))
+        .join(new_days, and_(new_days.c.day_of_week == old_days.c.day_of_week,
+                             new_days.c.ordinal == old_days.c.ordinal))
+        .subquery()
+    )
+
+    # Чужие пользовательские упражнения: копии в библиотеке получателя, если такого упражнения у него еще нет
+    own_copy = aliased(UserExercises)
+    foreign = (
+        select(func.min(UserExercises.id))
+        .join(Exercise, Exercise.user_exercise_id == UserExercises.id)
+        .join(old_day, Exercise.training_day_id == old_day.id)
+        .where(old_day.training_program_id == program_id, UserExercises.user_id != user_id)
+        .group_by(UserExercises.name, UserExercises.category_id)
+    )
+    await session.execute(
+        insert(UserExercises).from_select(
+            ["category_id", "user_id", "name", "description", "circle_training"],
+            select(
+                UserExercises.category_id, literal(user_id), UserExercises.name,
+                UserExercises.description, UserExercises.circle_training,
+            )
+            .where(
+                UserExercises.id.in_(foreign),
+                ~exists().where(
+                    own_copy.user_id == user_id,
+                    own_copy.name == UserExercises.name,
+                    own_copy.category_id == UserExercises.category_id,
+                ),
+            )
+            .order_by(UserExercises.id),
+        )
+    )
+    source_user_exercise = aliased(UserExercises)
+    own_user_exercise = aliased(UserExercises)
+    user_exercise_id = func.coalesce(
+        select(func.max(own_user_exercise.id))
+        .where(
+            source_user_exercise.user_id != user_id,
+            own_user_exercise.user_id == user_id,
+            own_user_exercise.name == source_user_exercise.name,
+            own_user_exercise.category_id == source_user_exercise.category_id,
+        )
+        .scalar_subquery(),
+        Exercise.user_exercise_id,
+    )
+
+    ordinal = func.row_number().over(
+        partition_by=Exercise.training_day_id, order_by=(Exercise.position, Exercise.id)
+    ) - 1
+    await session.execute(
+        insert(Exercise).from_select(
+            ["training_day_id", "name", "description", "base_sets", "base_reps", "position", "circle_training",
+             "admin_exercise_id", "user_exercise_id"],
+            select(
+                day_pairs.c.new_id, Exercise.name_override, Exercise.description_override, Exercise.base_sets,
+                Exercise.base_reps, ordinal, Exercise.circle_training, Exercise.admin_exercise_id, user_exercise_id,
+            )
+            .select_from(Exercise)
+            .join(day_pairs, Exercise.training_day_id == day_pairs.c.old_id)
+            .outerjoin(source_user_exercise, Exercise.user_exercise_id == source_user_exercise.id),
+        )
+    )
+
+    numbered = (
+        select(
+            Exercise.id,
+            Exercise.training_day_id,
+            (func.row_number().over(
+                partition_by=Exercise.training_day_id, order_by=(Exercise.position, Exercise.id)
+            ) - 1).label("ordinal"),
+        )
+        .join(old_day, Exercise.training_day_id == old_day.id)
+        .where(old_day.training_program_id == program_id)
+        .subquery()
+    )
+    new_exercise = aliased(Exercise)
+    await session.execute(
+        insert(ExerciseSet).from_select(
+            ["exercise_id", "reps"],
+            select(new_exercise.id, ExerciseSet.reps)
+            .join(numbered, ExerciseSet.exercise_id == numbered.c.id)
+            .join(day_pairs, numbered.c.training_day_id == day_pairs.c.old_id)
+            .join(new_exercise, and_(new_exercise.training_day_id == day_pairs.c.new_id,
+                                     new_exercise.position == numbered.c.ordinal))
+            .order_by(ExerciseSet.id),
+        )
+    )
+    await session.commit()
+    bump("user", user_id)
+    bump("program", new_program_id)
+    for day_id in new_day_ids:
+        bump("day", day_id)
+    return new_program_id
 
 
 """
@@ -170,6 +371,7 @@ async def orm_add_training_day(session: AsyncSession, day_of_week: str, program_
     )
     session.add(obj)
     await session.commit()
+    bump("program", program_id)
 
 
 async def orm_get_training_day(session: AsyncSession, training_day_id: int):
@@ -179,6 +381,7 @@ async def orm_get_training_day(session: AsyncSession, training_day_id: int):
     :param training_day_id:
     :return:
     """
+    track("day", training_day_id)
     stmt = select(TrainingDay).where(TrainingDay.id == training_day_id).limit(1)
     return await _one(session, stmt)
 
@@ -190,11 +393,34 @@ async def orm_get_training_days(session: AsyncSession, training_program_id: int)
     :param training_program_id:
     :return:
     """
+    track("program", training_program_id)
     query = select(TrainingDay).filter(TrainingDay.training_program_id == training_program_id)
     result = await session.execute(query)
     return result.scalars().all()
 
 
+async def orm_get_planned_training_days(session: AsyncSession, training_program_id: int) -> set[int]:
+    """
+    Получаем дни программы, в которых есть упражнения (одним запросом с группировкой)
+    :param session:
+    :param training_program_id:
+    :return: id тренировочных дней
+    """
+    track("program", training_program_id)
+    result = await session.execute(
+        select(TrainingDay.id, func.count(Exercise.id))
+        .outerjoin(Exercise, Exercise.training_day_id == TrainingDay.id)
+        .where(TrainingDay.training_program_id == training_program_id)
+        .group_by(TrainingDay.id)
+    )
+    planned = set()
+    for training_day_id, exercises in result:
+        track("day", training_day_id)
+        if exercises:
+            planned.add(training_day_id)
+    return planned
+
+
 async def orm_delete_training_day(session: AsyncSession, training_day_id: int):
     """
     Удаляем тренировочный день
@@ -202,9 +428,20 @@ async def orm_delete_training_day(session: AsyncSession, training_day_id: int):
     :param training_day_id:
     :return:
     """
-    query = delete(TrainingDay).where(TrainingDay.id == training_day_id)
-    await session.execute(query)
+    user_ids = (await session.execute(_exercise_owners(Exercise.training_day_id == training_day_id))).scalars().all()
+    if user_ids:
+        await session.execute(stale_rollups(user_ids))
+    query = (
+        delete(TrainingDay)
+        .where(TrainingDay.id == training_day_id)
+        .returning(TrainingDay.training_program_id)
+    )
+    program_id = (await session.execute(query)).scalar()
     await session.commit()
+    bump("day", training_day_id)
+    bump("program", program_id)
+    for user_id in user_ids:
+        bump("sets", user_id)
 
 
 """
@@ -243,10 +480,11 @@ async def orm_add_exercise(session: AsyncSession, data: dict, training_day_id: i
     else:
         raise ValueError("Неверный тип упражнения. Должно быть 'admin' или 'user'.")
 
+    # Название и описание хранятся, только если отличаются от каталога
     obj = Exercise(
         training_day_id=training_day_id,
-        name=data['name'],
-        description=data['description'],
+        name_override=data.get('name'),
+        description_override=data.get('description'),
         position=max_position + 1,
         admin_exercise_id=admin_exercise_id,
         user_exercise_id=user_exercise_id,
@@ -259,6 +497,7 @@ async def orm_add_exercise(session: AsyncSession, data: dict, training_day_id: i
     except IntegrityError as e:
         await session.rollback()
         raise e
+    bump("day", training_day_id)
 
 
 async def orm_get_exercises(session: AsyncSession, training_day_id: int):
@@ -268,9 +507,11 @@ async def orm_get_exercises(session: AsyncSession, training_day_id: int):
     :param training_day_id:
     :return:
     """
+    track("day", training_day_id)
     query = select(Exercise).where(Exercise.training_day_id == training_day_id).order_by(Exercise.position)
-    result = await session.execute(query)
-    return result.scalars().all()
+    exercises = (await session.execute(query)).scalars().all()
+    await load_exercise_info(session, exercises)
+    return exercises
 
 
 async def orm_get_circular_exercises(session: AsyncSession, training_day_id: int):
@@ -280,13 +521,15 @@ async def orm_get_circular_exercises(session: AsyncSession, training_day_id: int
     :param training_day_id:
     :return:
     """
+    track("day", training_day_id)
     query = (
         select(Exercise)
         .where(and_(Exercise.training_day_id == training_day_id, Exercise.circle_training.is_(True)))
         .order_by(Exercise.position)
     )
-    result = await session.execute(query)
-    return result.scalars().all()
+    exercises = (await session.execute(query)).scalars().all()
+    await load_exercise_info(session, exercises)
+    return exercises
 
 
 async def orm_get_standard_exercises(session: AsyncSession, training_day_id: int):
@@ -296,13 +539,15 @@ async def orm_get_standard_exercises(session: AsyncSession, training_day_id: int
     :param training_day_id:
     :return:
     """
+    track("day", training_day_id)
     query = (
         select(Exercise)
         .where(and_(Exercise.training_day_id == training_day_id, Exercise.circle_training.is_(False)))
         .order_by(Exercise.position)
     )
-    result = await session.execute(query)
-    return result.scalars().all()
+    exercises = (await session.execute(query)).scalars().all()
+    await load_exercise_info(session, exercises)
+    return exercises
 
 
 async def orm_get_exercise(session: AsyncSession, exercise_id: int):
@@ -312,8 +557,12 @@ async def orm_get_exercise(session: AsyncSession, exercise_id: int):
     :param exercise_id:
     :return:
     """
+    track("exercise", exercise_id)
     stmt = select(Exercise).where(Exercise.id == exercise_id).limit(1)
-    return await _one(session, stmt)
+    exercise = await _one(session, stmt)
+    if exercise is not None:
+        await load_exercise_info(session, [exercise])
+    return exercise
 
 
 async def orm_update_exercise(session: AsyncSession, exercise_id: int, data: dict):
@@ -328,9 +577,9 @@ async def orm_update_exercise(session: AsyncSession, exercise_id: int, data: dic
     update_data = {}
 
     if 'name' in data:
-        update_data['name'] = data['name']
+        update_data['name_override'] = data['name']
     if 'description' in data:
-        update_data['description'] = data['description']
+        update_data['description_override'] = data['description']
     if 'reps' in data:
         update_data['base_reps'] = data['reps']
     if 'sets' in data:
@@ -356,18 +605,27 @@ async def orm_update_exercise(session: AsyncSession, exercise_id: int, data: dic
         else:
             raise ValueError("Неверный тип упражнения. Должно быть 'admin' или 'user'.")
 
+    old_day_id = None
+    if 'training_day_id' in update_data:
+        old_day_id = await session.scalar(select(Exercise.training_day_id).where(Exercise.id == exercise_id))
+
     query = (
         update(Exercise)
         .where(Exercise.id == exercise_id)
         .values(**update_data)
+        .returning(Exercise.training_day_id)
         .execution_options(synchronize_session="fetch")
     )
-    await session.execute(query)
+    training_day_id = (await session.execute(query)).scalar()
     try:
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise e
+    bump("exercise", exercise_id)
+    bump("day", training_day_id)
+    if old_day_id is not None and old_day_id != training_day_id:
+        bump("day", old_day_id)
 
 
 async def orm_delete_exercise(session: AsyncSession, exercise_id: int):
@@ -377,13 +635,20 @@ async def orm_delete_exercise(session: AsyncSession, exercise_id: int):
     :param exercise_id:
     :return:
     """
-    query = delete(Exercise).where(Exercise.id == exercise_id)
-    await session.execute(query)
+    user_ids = (await session.execute(_exercise_owners(Exercise.id == exercise_id))).scalars().all()
+    if user_ids:
+        await session.execute(stale_rollups(user_ids))
+    query = delete(Exercise).where(Exercise.id == exercise_id).returning(Exercise.training_day_id)
+    training_day_id = (await session.execute(query)).scalar()
     try:
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise e
+    bump("exercise", exercise_id)
+    bump("day", training_day_id)
+    for user_id in user_ids:
+        bump("sets", user_id)
 
 
 async def move_exercise_up(session: AsyncSession, exercise_id: int):
@@ -413,6 +678,7 @@ async def move_exercise_up(session: AsyncSession, exercise_id: int):
 
     previous_exercise = exercises[index - 1]
     exercise.position, previous_exercise.position = previous_exercise.position, exercise.position
+    training_day_id = exercise.training_day_id
 
     session.add_all([exercise, previous_exercise])
     try:
@@ -421,6 +687,7 @@ async def move_exercise_up(session: AsyncSession, exercise_id: int):
         await session.rollback()
         print("Ошибка при перемещении вверх:", e)
         return "Ошибка при перемещении вверх."
+    bump("day", training_day_id)
 
     return "Упражнение перемещено вверх."
 
@@ -452,6 +719,7 @@ async def move_exercise_down(session: AsyncSession, exercise_id: int):
 
     next_exercise = exercises[index + 1]
     exercise.position, next_exercise.position = next_exercise.position, exercise.position
+    training_day_id = exercise.training_day_id
 
     session.add_all([exercise, next_exercise])
     try:
@@ -460,6 +728,7 @@ async def move_exercise_down(session: AsyncSession, exercise_id: int):
         await session.rollback()
         print("Ошибка при перемещении вниз:", e)
         return "Ошибка при перемещении вниз."
+    bump("day", training_day_id)
 
     return "Упражнение перемещено вниз."
 
@@ -484,6 +753,7 @@ async def orm_add_exercise_set(session: AsyncSession, exercise_id: int, reps: in
     )
     session.add(obj)
     await session.commit()
+    bump("exercise", exercise_id)
 
 
 async def orm_get_exercise_set(session: AsyncSession, exercise_set_id: int):
@@ -541,9 +811,11 @@ async def orm_update_exercise_set(session: AsyncSession, exercise_set_id: int, r
         update(ExerciseSet)
         .where(ExerciseSet.id == exercise_set_id)
         .values(reps=reps)
+        .returning(ExerciseSet.exercise_id)
     )
-    await session.execute(query)
+    exercise_id = (await session.execute(query)).scalar()
     await session.commit()
+    bump("exercise", exercise_id)
 
 
 """
@@ -551,21 +823,81 @@ async def orm_update_exercise_set(session: AsyncSession, exercise_set_id: int, r
 """
 
 
+async def _ensure_training_session(session: AsyncSession, training_session_id: uuid.UUID, user_id: int) -> bool:
+    """
+    Создает запись о тренировке при сохранении первого подхода (в той же транзакции).
+    До этого тренировка существует только в FSM, поэтому прерванные тренировки не оставляют пустых записей
+    :param session:
+    :param training_session_id: uuid тренировки, выданный при ее запуске
+    :param user_id: Telegram ID
+    :return: True, если запись создана сейчас
+    """
+    query = insert(TrainingSession).from_select(
+        ["id", "user_id", "note"],
+        select(
+            literal(training_session_id, TrainingSession.id.type),
+            literal(user_id, TrainingSession.user_id.type),
+            literal("Запуск тренировки", TrainingSession.note.type),
+        ).where(~exists().where(TrainingSession.id == training_session_id)),
+    )
+    result = await session.execute(query)
+    return result.rowcount > 0
+
+
 async def orm_add_set(session: AsyncSession, data: dict):
     """
     Добавляем уже отработанный подход
     :param session:
-    :param data: вес, повторения, uuid тренировки
+    :param data: вес, повторения, uuid тренировки, Telegram ID
     :return:
     """
-    obj = Set(
+    training_session_id = uuid.UUID(str(data['training_session_id']))
+    created = await _ensure_training_session(session, training_session_id, data['user_id'])
+    query = insert(Set).values(
         exercise_id=data['exercise_id'],
         weight=data['weight'],
         repetitions=data['repetitions'],
-        training_session_id=data['training_session_id'],
+        training_session_id=training_session_id,
+    ).returning(Set.exercise_id, Set.weight, Set.repetitions, Set.created)
+    await rollup_sets(session, data['user_id'], (await session.execute(query)).tuples().all())
+    await session.commit()
+    bump("sets", data['user_id'])
+    if created:
+        bump("sessions", data['user_id'])
+
+
+async def orm_add_sets(session: AsyncSession, exercise_id: int, training_session_id: str, user_id: int,
+                       sets: list[tuple[float, int]]):
+    """
+    Добавляем несколько отработанных подходов одним INSERT в одной транзакции
+    :param session:
+    :param exercise_id:
+    :param training_session_id: uuid тренировки
+    :param user_id: Telegram ID
+    :param sets: [(вес, повторения), ...]
+    :return:
+    """
+    if not sets:
+        return
+    training_session_id = uuid.UUID(str(training_session_id))
+    created = await _ensure_training_session(session, training_session_id, user_id)
+    result = await session.execute(
+        insert(Set).returning(Set.exercise_id, Set.weight, Set.repetitions, Set.created),
+        [
+            {
+                "exercise_id": exercise_id,
+                "weight": weight,
+                "repetitions": repetitions,
+                "training_session_id": training_session_id,
+            }
+            for weight, repetitions in sets
+        ],
     )
-    session.add(obj)
+    await rollup_sets(session, user_id, result.tuples().all())
     await session.commit()
+    bump("sets", user_id)
+    if created:
+        bump("sessions", user_id)
 
 
 async def orm_get_sets(session: AsyncSession, exercise_id: int):
@@ -591,6 +923,18 @@ async def orm_get_set(session: AsyncSession, set_id: int):
     return await _one(session, stmt)
 
 
+def _sets_of_session(training_session_id):
+    """
+    Условие "подходы тренировки" с нижней границей Set.created: подходы тренировки не раньше ее даты,
+    поэтому на секционированной по месяцам таблице set (Postgres) просматриваются только
+    секции начиная с месяца тренировки
+    :param training_session_id: uuid или скалярный подзапрос
+    :return:
+    """
+    started = select(TrainingSession.date).where(TrainingSession.id == training_session_id).scalar_subquery()
+    return and_(Set.training_session_id == training_session_id, Set.created >= started)
+
+
 async def orm_get_sets_by_session(session: AsyncSession, exercise_id: int, training_session_id: str):
     """
     Получаем отработанные подходы для определенной тренировки
@@ -602,35 +946,65 @@ async def orm_get_sets_by_session(session: AsyncSession, exercise_id: int, train
     result = await session.execute(
         select(Set)
         .where(Set.exercise_id == exercise_id)
-        .where(Set.training_session_id == training_session_id)
+        .where(_sets_of_session(training_session_id))
         .order_by(Set.id)
     )
     return result.scalars().all()
 
 
-async def orm_get_all_sets_by_user_id_grouped_by_date(session: AsyncSession, user_id: int):
+async def orm_get_session_sets(session: AsyncSession, training_session: TrainingSession):
     """
-    Получает все отработанные подходы для заданного user_id, сгруппированные по дате
+    Получаем все подходы тренировки; подходы архивированной тренировки читаются из архива пользователя
     :param session:
-    :param user_id: Telegram ID
-    :return:
+    :param training_session: объект TrainingSession
+    :return: Set или ArchivedSet (exercise_id, weight, repetitions)
+    """
+    if training_session.archived:
+        return await read_archived_sets(training_session.user_id, training_session.id)
+    result = await session.execute(select(Set).where(_sets_of_session(training_session.id)).order_by(Set.id))
+    return result.scalars().all()
+
+
+async def orm_get_daily_rollups(session: AsyncSession, user_id: int, start, end, category_id: int = 0):
     """
-    from sqlalchemy import func, cast, Date
+    Итоги тренировок пользователя по дням (см. database/rollups.py)
+    :param session:
+    :param user_id: Telegram ID
+    :param start: первый день (date)
+    :param end: день после последнего (date)
+    :param category_id: категория упражнений; 0 - все категории
+    :return: DailyRollup по возрастанию дня
+    """
+    track("sets", user_id)
+    await ensure_rollups(session, user_id)
+    return await _all(
+        session,
+        select(DailyRollup)
+        .where(DailyRollup.user_id == user_id, DailyRollup.category_id == category_id,
+               DailyRollup.day >= start, DailyRollup.day < end)
+        .order_by(DailyRollup.day)
+    )
 
-    result = await session.execute(
-        select(
-            cast(Set.created, Date).label("set_date"),
-            func.array_agg(Set.id).label("set_ids")
-        )
-        .join(Exercise, Set.exercise_id == Exercise.id)
-        .join(TrainingDay, Exercise.training_day_id == TrainingDay.id)
-        .join(TrainingProgram, TrainingDay.training_program_id == TrainingProgram.id)
-        .join(User, TrainingProgram.user_id == User.user_id)
-        .where(User.user_id == user_id)
-        .group_by(cast(Set.created, Date))
-        .order_by(cast(Set.created, Date))
+
+async def orm_get_weekly_rollups(session: AsyncSession, user_id: int, start, end, category_id: int = 0):
+    """
+    Итоги тренировок пользователя по неделям
+    :param session:
+    :param user_id: Telegram ID
+    :param start: первый понедельник (date)
+    :param end: понедельник после последней недели (date)
+    :param category_id: категория упражнений; 0 - все категории
+    :return: WeeklyRollup по возрастанию недели
+    """
+    track("sets", user_id)
+    await ensure_rollups(session, user_id)
+    return await _all(
+        session,
+        select(WeeklyRollup)
+        .where(WeeklyRollup.user_id == user_id, WeeklyRollup.category_id == category_id,
+               WeeklyRollup.week >= start, WeeklyRollup.week < end)
+        .order_by(WeeklyRollup.week)
     )
-    return result.all()
 
 
 async def orm_get_exercise_max_record(
@@ -651,7 +1025,7 @@ async def orm_get_exercise_max_record(
             Exercise.id == exercise_id
         )
     )
-    return await _one(session, stmt)
+    return max(await _one(session, stmt), await archived_max(user_id, exercise_id, volume=True))
 
 
 async def orm_get_exercise_max_weight(
@@ -672,7 +1046,7 @@ async def orm_get_exercise_max_weight(
             Exercise.id == exercise_id
         )
     )
-    return await _one(session, stmt)
+    return max(await _one(session, stmt), await archived_max(user_id, exercise_id))
 
 
 async def orm_get_sets_for_exercise_in_previous_session(
@@ -698,7 +1072,7 @@ async def orm_get_sets_for_exercise_in_previous_session(
     )
 
     query = select(Set).where(
-        Set.training_session_id == subquery,
+        _sets_of_session(subquery),
         Set.exercise_id == exercise_id
     )
 
@@ -706,6 +1080,76 @@ async def orm_get_sets_for_exercise_in_previous_session(
     return result.scalars().all()
 
 
+async def orm_copy_previous_sets(session: AsyncSession, exercise_ids: list[int], training_session_id: str,
+                                 user_id: int) -> int:
+    """
+    Повторяет прошлую тренировку: копирует в текущую тренировку подходы каждого упражнения из последней
+    тренировки, где оно выполнялось (как в orm_get_sets_for_exercise_in_previous_session).
+    Подходы, уже записанные в текущей тренировке, пропускаются. Выполняется одним INSERT ... SELECT
+    :param session:
+    :param exercise_ids: id упражнений
+    :param training_session_id: uuid текущей тренировки
+    :param user_id: Telegram ID
+    :return: кол-во добавленных подходов
+    """
+    if not exercise_ids:
+        return 0
+    current_id = uuid.UUID(str(training_session_id))
+    created = await _ensure_training_session(session, current_id, user_id)
+    previous_set = aliased(Set)
+    current_set = aliased(Set)
+
+    # Коррелированные подзапросы по Set.exercise_id внешнего запроса
+    last_session_id = (
+        select(TrainingSession.id)
+        .join(previous_set, TrainingSession.id == previous_set.training_session_id)
+        .where(previous_set.exercise_id == Set.exercise_id, TrainingSession.id != current_id)
+        .order_by(TrainingSession.date.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    current_started = select(TrainingSession.date).where(TrainingSession.id == current_id).scalar_subquery()
+    already_done = (
+        select(func.count(current_set.id))
+        .where(current_set.exercise_id == Set.exercise_id, current_set.training_session_id == current_id,
+               current_set.created >= current_started)
+        .scalar_subquery()
+    )
+    previous = (
+        select(
+            Set.exercise_id,
+            Set.weight,
+            Set.repetitions,
+            func.row_number().over(partition_by=Set.exercise_id, order_by=Set.id).label("number"),
+            already_done.label("done"),
+        )
+        .where(Set.exercise_id.in_(exercise_ids), _sets_of_session(last_session_id))
+        .subquery()
+    )
+    query = insert(Set).from_select(
+        ["exercise_id", "weight", "repetitions", "training_session_id"],
+        select(
+            previous.c.exercise_id,
+            previous.c.weight,
+            previous.c.repetitions,
+            literal(current_id, Set.training_session_id.type),
+        )
+        .where(previous.c.number > previous.c.done)
+        .order_by(previous.c.exercise_id, previous.c.number),
+    ).returning(Set.exercise_id, Set.weight, Set.repetitions, Set.created)
+    copied = (await session.execute(query)).tuples().all()
+    if not copied:
+        # Копировать нечего - тренировку без подходов не сохраняем
+        await session.rollback()
+        return 0
+    await rollup_sets(session, user_id, copied)
+    await session.commit()
+    bump("sets", user_id)
+    if created:
+        bump("sessions", user_id)
+    return len(copied)
+
+
 """
 Предустановленные упражнения
 """
@@ -725,6 +1169,7 @@ async def orm_add_admin_exercise(session: AsyncSession, data: dict):
     )
     session.add(obj)
     await session.commit()
+    bump("catalog")
 
 
 async def orm_get_admin_exercise(session: AsyncSession, admin_exercise_id: int):
@@ -734,8 +1179,8 @@ async def orm_get_admin_exercise(session: AsyncSession, admin_exercise_id: int):
     :param admin_exercise_id:
     :return:
     """
-    stmt = select(AdminExercises).where(AdminExercises.id == admin_exercise_id).limit(1)
-    return await _one(session, stmt)
+    catalog = await get_catalog(session)
+    return catalog.exercises_by_id.get(admin_exercise_id)
 
 
 async def orm_get_admin_exercises(session: AsyncSession):
@@ -744,9 +1189,8 @@ async def orm_get_admin_exercises(session: AsyncSession):
     :param session:
     :return:
     """
-    query = select(AdminExercises)
-    result = await session.execute(query)
-    return result.scalars().all()
+    catalog = await get_catalog(session)
+    return list(catalog.exercises)
 
 
 async def orm_get_admin_exercises_in_category(session: AsyncSession, category_id: int):
@@ -756,9 +1200,8 @@ async def orm_get_admin_exercises_in_category(session: AsyncSession, category_id
     :param category_id:
     :return:
     """
-    query = select(AdminExercises).where(AdminExercises.category_id == category_id)
-    result = await session.execute(query)
-    return result.scalars().all()
+    catalog = await get_catalog(session)
+    return list(catalog.exercises_by_category.get(category_id, ()))
 
 
 async def orm_update_admin_exercise(session: AsyncSession, admin_exercise_id: int, data: dict):
@@ -780,6 +1223,7 @@ async def orm_update_admin_exercise(session: AsyncSession, admin_exercise_id: in
     )
     await session.execute(query)
     await session.commit()
+    bump("catalog")
 
 
 async def orm_delete_admin_exercise(session: AsyncSession, admin_exercise_id):
@@ -791,12 +1235,25 @@ async def orm_delete_admin_exercise(session: AsyncSession, admin_exercise_id):
     """
     admin_exercise = await session.get(AdminExercises, admin_exercise_id)
     if admin_exercise:
+        day_ids = (await session.execute(
+            select(Exercise.training_day_id).where(Exercise.admin_exercise_id == admin_exercise_id).distinct()
+        )).scalars().all()
+        user_ids = (await session.execute(
+            _exercise_owners(Exercise.admin_exercise_id == admin_exercise_id)
+        )).scalars().all()
+        if user_ids:
+            await session.execute(stale_rollups(user_ids))
         await session.delete(admin_exercise)
         try:
             await session.commit()
         except Exception as e:
             await session.rollback()
             raise e
+        bump("catalog")
+        for day_id in day_ids:
+            bump("day", day_id)
+        for user_id in user_ids:
+            bump("sets", user_id)
 
 
 """
@@ -819,6 +1276,7 @@ async def orm_add_user_exercise(session: AsyncSession, data: dict):
     )
     session.add(obj)
     await session.commit()
+    bump("user", int(data["user_id"]))
 
 
 async def orm_get_user_exercise(session: AsyncSession, user_exercise_id: int):
@@ -828,6 +1286,7 @@ async def orm_get_user_exercise(session: AsyncSession, user_exercise_id: int):
     :param user_exercise_id:
     :return:
     """
+    track("user_exercise", user_exercise_id)
     stmt = select(UserExercises).where(UserExercises.id == user_exercise_id).limit(1)
     return await _one(session, stmt)
 
@@ -839,6 +1298,7 @@ async def orm_get_user_exercises(session: AsyncSession, user_id: int):
     :param user_id: Telegram ID
     :return:
     """
+    track("user", user_id)
     query = select(UserExercises).filter(UserExercises.user_id == user_id)
     result = await session.execute(query)
     return result.scalars().all()
@@ -852,6 +1312,7 @@ async def orm_get_user_exercises_in_category(session: AsyncSession, category_id:
     :param user_id: Telegram ID
     :return:
     """
+    track("user", user_id)
     query = (
         select(UserExercises)
         .where(and_(UserExercises.category_id == category_id, UserExercises.user_id == user_id))
@@ -876,9 +1337,12 @@ async def orm_update_user_exercise(session: AsyncSession, user_exercise_id: int,
             description=data['description'],
             category_id=int(data["category"])
         )
+        .returning(UserExercises.user_id)
     )
-    await session.execute(query)
+    user_id = (await session.execute(query)).scalar()
     await session.commit()
+    bump("user_exercise", user_exercise_id)
+    bump("user", user_id)
 
 
 async def orm_delete_user_exercise(session: AsyncSession, user_exercise_id: int):
@@ -888,9 +1352,19 @@ async def orm_delete_user_exercise(session: AsyncSession, user_exercise_id: int)
     :param user_exercise_id:
     :return:
     """
-    query = delete(UserExercises).where(UserExercises.id == user_exercise_id)
-    await session.execute(query)
+    day_ids = (await session.execute(
+        select(Exercise.training_day_id).where(Exercise.user_exercise_id == user_exercise_id).distinct()
+    )).scalars().all()
+    query = delete(UserExercises).where(UserExercises.id == user_exercise_id).returning(UserExercises.user_id)
+    user_id = (await session.execute(query)).scalar()
+    if user_id is not None:
+        await session.execute(stale_rollups([user_id]))
     await session.commit()
+    bump("user_exercise", user_exercise_id)
+    bump("user", user_id)
+    bump("sets", user_id)
+    for day_id in day_ids:
+        bump("day", day_id)
 
 
 """
@@ -900,38 +1374,18 @@ async def orm_delete_user_exercise(session: AsyncSession, user_exercise_id: int)
 
 async def orm_get_categories(session: AsyncSession, user_id: int):
     """
-    Получаем категории упражнений
+    Получаем категории упражнений с количеством упражнений в каждой
+    (предустановленные из снимка каталога + пользовательские)
     :param session:
     :param user_id: Telegram ID
-    :return:
+    :return: список пар (категория, кол-во упражнений)
     """
-    admin_select = select(
-        AdminExercises.category_id.label('category_id')
-    )
-
-    user_select = select(
-        UserExercises.category_id.label('category_id')
-    ).where(
-        UserExercises.user_id == user_id
-    )
-
-    combined_subquery = union_all(admin_select, user_select).subquery()
-
-    query = (
-        select(
-            ExerciseCategory,
-            func.count(combined_subquery.c.category_id).label("exercise_count")
-        )
-        .outerjoin(
-            combined_subquery,
-            ExerciseCategory.id == combined_subquery.c.category_id
-        )
-        .group_by(ExerciseCategory.id)
-        .order_by(ExerciseCategory.name)
-    )
-
-    result = await session.execute(query)
-    return result.all()
+    catalog = await get_catalog(session)
+    user_counts = await get_user_category_counts(session, user_id)
+    return [
+        (category, catalog.counts.get(category.id, 0) + user_counts.get(category.id, 0))
+        for category in catalog.categories
+    ]
 
 
 async def orm_get_category(session: AsyncSession, category_id: int):
@@ -941,8 +1395,8 @@ async def orm_get_category(session: AsyncSession, category_id: int):
     :param category_id:
     :return:
     """
-    stmt = select(ExerciseCategory).where(ExerciseCategory.id == category_id).limit(1)
-    return await _one(session, stmt)
+    catalog = await get_catalog(session)
+    return catalog.categories_by_id.get(category_id)
 
 async def orm_create_categories(session: AsyncSession, categories: list):
     """
@@ -957,6 +1411,7 @@ async def orm_create_categories(session: AsyncSession, categories: list):
         return
     session.add_all([ExerciseCategory(name=name) for name in categories])
     await session.commit()
+    bump("catalog")
 
 
 """
@@ -964,28 +1419,6 @@ async def orm_create_categories(session: AsyncSession, categories: list):
 """
 
 
-async def orm_add_training_session(session: AsyncSession, data: dict):
-    """
-    Добавляем новую запись о тренировке
-    :param session:
-    :param data: Telegram ID, Дата, Описание
-    :return:
-    """
-
-    new_session = TrainingSession(
-        user_id=data["user_id"],
-        date=data.get("date"),
-        note=data.get("note", "")
-    )
-    session.add(new_session)
-    try:
-        await session.commit()
-    except IntegrityError as e:
-        await session.rollback()
-        raise e
-    return new_session
-
-
 async def orm_get_training_session(session: AsyncSession, session_id: str):
     """
     Получаем тренировку по её UUID
@@ -999,6 +1432,7 @@ async def orm_get_training_sessions_by_user(session: AsyncSession, user_id: int)
     Получаем все тренировки пользователя отсортированные по дате
     """
     from database.models import TrainingSession
+    track("sessions", user_id)
     query = (
         select(TrainingSession)
         .where(TrainingSession.user_id == user_id)
@@ -1008,6 +1442,34 @@ async def orm_get_training_sessions_by_user(session: AsyncSession, user_id: int)
     return result.scalars().all()
 
 
+async def orm_delete_empty_training_sessions(session: AsyncSession, older_than, limit: int) -> int:
+    """
+    Удаляет пачку тренировок без единого подхода (прерванные тренировки, записанные до отложенного
+    создания тренировки в orm_add_set)
+    :param session:
+    :param older_than: удаляются только тренировки, начатые раньше этого момента
+    :param limit: размер пачки
+    :return: кол-во удаленных тренировок
+    """
+    batch = (
+        select(TrainingSession.id)
+        .where(TrainingSession.date < older_than, TrainingSession.archived.is_(False),
+               ~exists().where(Set.training_session_id == TrainingSession.id))
+        .limit(limit)
+    )
+    query = (
+        delete(TrainingSession)
+        .where(TrainingSession.id.in_(batch.scalar_subquery()))
+        .returning(TrainingSession.user_id)
+        .execution_options(synchronize_session=False)
+    )
+    user_ids = (await session.execute(query)).scalars().all()
+    await session.commit()
+    for user_id in set(user_ids):
+        bump("sessions", user_id)
+    return len(user_ids)
+
+
 async def orm_delete_training_session(session: AsyncSession, session_id: str):
     """
     Удаляем запись о тренировке
@@ -1016,13 +1478,19 @@ async def orm_delete_training_session(session: AsyncSession, session_id: str):
     :return:
     """
     from database.models import TrainingSession
-    query = delete(TrainingSession).where(TrainingSession.id == session_id)
-    await session.execute(query)
+    # На секционированных таблицах (Postgres) нет внешнего ключа set -> training_session с каскадным удалением
+    await session.execute(delete(Set).where(_sets_of_session(session_id)))
+    query = delete(TrainingSession).where(TrainingSession.id == session_id).returning(TrainingSession.user_id)
+    user_id = (await session.execute(query)).scalar()
+    if user_id is not None:
+        await session.execute(stale_rollups([user_id]))
     try:
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise e
+    bump("sessions", user_id)
+    bump("sets", user_id)
 
 
 async def orm_update_training_session(session: AsyncSession, session_id: str, data: dict):
@@ -1040,19 +1508,33 @@ async def orm_update_training_session(session: AsyncSession, session_id: str, da
         update(TrainingSession)
         .where(TrainingSession.id == session_id)
         .values(**update_data)
+        .returning(TrainingSession.user_id)
     )
-    await session.execute(query)
+    user_id = (await session.execute(query)).scalar()
     try:
         await session.commit()
     except IntegrityError as e:
         await session.rollback()
         raise e
+    bump("sessions", user_id)
 
 
 """
 Пользователь
 """
 
+_USER_COLUMNS = (User.id, User.user_id, User.name, User.weight, User.actual_program_id)
+
+
+def _cache_user_row(user_id: int, row) -> None:
+    """
+    Обновляет кэш пользователей строкой, возвращенной RETURNING
+    """
+    if row is None:
+        user_cache.invalidate(user_id)
+    else:
+        user_cache.put(CachedUser(*row))
+
 
 async def orm_add_user(session: AsyncSession, data: dict):
     """
@@ -1068,6 +1550,8 @@ async def orm_add_user(session: AsyncSession, data: dict):
     )
     session.add(user)
     await session.commit()
+    user_cache.put(CachedUser(user.id, user.user_id, user.name, user.weight, user.actual_program_id))
+    bump("user", data['user_id'])
 
 
 async def orm_update_user(session: AsyncSession, user_id: int, data: dict):
@@ -1085,9 +1569,12 @@ async def orm_update_user(session: AsyncSession, user_id: int, data: dict):
             name=data['name'],
             weight=data['weight'],
         )
+        .returning(*_USER_COLUMNS)
     )
-    await session.execute(query)
+    row = (await session.execute(query)).first()
     await session.commit()
+    _cache_user_row(user_id, row)
+    bump("user", user_id)
 
 
 async def orm_get_all_users(session: AsyncSession):
@@ -1108,8 +1595,20 @@ async def orm_get_user_by_id(session: AsyncSession, user_id: int):
     :param user_id: Telegram ID
     :return:
     """
-    stmt = select(User).where(User.user_id == user_id).limit(1)
-    return await _one(session, stmt)
+    track("user", user_id)
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    # Запись, завершившаяся во время SELECT, уже положила в кэш свежий профиль и увеличила версию:
+    # прочитанную до нее строку в кэш не кладем
+    version = get_version("user", user_id)
+    row = (await session.execute(select(*_USER_COLUMNS).where(User.user_id == user_id).limit(1))).first()
+    if row is None:
+        return None
+    user = CachedUser(*row)
+    if get_version("user", user_id) == version:
+        user_cache.put(user)
+    return user
 
 
 """
@@ -1131,9 +1630,12 @@ async def orm_turn_on_off_program(session: AsyncSession, user_id: int, program_i
         .values(
             actual_program_id=program_id,
         )
+        .returning(*_USER_COLUMNS)
     )
-    await session.execute(query)
+    row = (await session.execute(query)).first()
     await session.commit()
+    _cache_user_row(user_id, row)
+    bump("user", user_id)
 
 
 async def initialize_positions_for_training_day(session: AsyncSession, training_day_id: int):
@@ -1155,3 +1657,4 @@ async def initialize_positions_for_training_day(session: AsyncSession, training_
         session.add(exercise)
 
     await session.commit()
+    bump("day", training_day_id)
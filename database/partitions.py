@@ -0,0 +1,78 @@
+import logging
+import os
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Таблицы, секционируемые по месяцам на Postgres (см. миграцию c4f2a8d61e93): таблица -> ключ секционирования
+PARTITIONED_TABLES = {"set": "created", "training_session": "date"}
+# На сколько месяцев вперед создавать секции при запуске
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    Первое число месяца, отстоящего от month на months
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def create_partition_sql(table: str, month: date) -> str:
+    """
+    DDL секции таблицы за месяц
+    :param table: секционированная таблица
+    :param month: первое число месяца
+    :return:
+    """
+    return (
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(table, month)}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def create_default_partition_sql(table: str) -> str:
+    """
+    Секция для строк вне созданных месяцев (например, с датой из будущего)
+    """
+    return f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{table}" DEFAULT'
+
+
+async def ensure_future_partitions(engine: AsyncEngine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """
+    Создает секции текущего и следующих months_ahead месяцев. Вызывается при запуске бота.
+    На SQLite и на несекционированных таблицах ничего не делает
+    :param engine:
+    :param months_ahead:
+    :return:
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.connect() as connection:
+        result = await connection.execute(
+            text(
+                "SELECT c.relname FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = ANY(:names) AND pg_table_is_visible(c.oid)"
+            ),
+            {"names": list(PARTITIONED_TABLES)},
+        )
+        partitioned = set(result.scalars())
+
+    current = date.today().replace(day=1)
+    for table in PARTITIONED_TABLES:
+        if table not in partitioned:
+            continue
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            try:
+                async with engine.begin() as connection:
+                    await connection.execute(text(create_partition_sql(table, month)))
+            except Exception:
+                # Например, другой экземпляр создал секцию одновременно или в секции по умолчанию уже есть
+                # строки этого месяца
+                logging.exception(f"Не удалось создать секцию {partition_name(table, month)}")
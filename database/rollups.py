@@ -0,0 +1,278 @@
+import asyncio
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.archive import open_archive
+from database.models import (
+    AdminExercises, DailyRollup, Exercise, RollupState, Set, TrainingSession, User, UserExercises, WeeklyRollup
+)
+
+# category_id строк с итогами по всем категориям
+ROLLUP_TOTAL = 0
+# Строк в одном INSERT ... ON CONFLICT
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", 500))
+
+# Категория упражнения: из каталога или пользовательского упражнения
+_exercise_category = func.coalesce(AdminExercises.category_id, UserExercises.category_id)
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+class _Totals:
+    __slots__ = ("sets", "reps", "volume", "first", "last")
+
+    def __init__(self, first: datetime):
+        self.sets = 0
+        self.reps = 0
+        self.volume = 0.0
+        self.first = first
+        self.last = first
+
+    def add(self, created: datetime, weight: float, reps: int) -> None:
+        self.sets += 1
+        self.reps += reps
+        self.volume += weight * reps
+        self.first = min(self.first, created)
+        self.last = max(self.last, created)
+
+
+def _group(rows: Iterable[tuple[datetime, int | None, float, int]]) -> dict[tuple[date, int], _Totals]:
+    """
+    :param rows: (время подхода, категория, вес, повторения)
+    :return: (день, категория) -> итоги; ROLLUP_TOTAL - по всем категориям
+    """
+    totals: dict[tuple[date, int], _Totals] = {}
+    for created, category_id, weight, reps in rows:
+        day = created.date()
+        for key in ((day, ROLLUP_TOTAL), (day, category_id)):
+            if key[1] is None:
+                continue
+            item = totals.get(key)
+            if item is None:
+                item = totals[key] = _Totals(created)
+            item.add(created, weight, reps)
+            if not category_id:
+                break
+    return totals
+
+
+def _insert(session: AsyncSession, table):
+    """
+    INSERT с поддержкой upsert для диалекта базы
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+async def _upsert(session: AsyncSession, table, rows: list[dict], keys: tuple[str, ...], updates) -> None:
+    """
+    Многострочный INSERT; при конфликте по ключу строки объединяются
+    :param updates: функция (таблица, новые значения) -> {колонка: выражение}
+    """
+    for start in range(0, len(rows), ROLLUP_BATCH_SIZE):
+        stmt = _insert(session, table).values(rows[start:start + ROLLUP_BATCH_SIZE])
+        if hasattr(stmt, "on_duplicate_key_update"):
+            stmt = stmt.on_duplicate_key_update(updates(table, stmt.inserted))
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=updates(table, stmt.excluded))
+        await session.execute(stmt)
+
+
+def _daily_updates(table, new) -> dict:
+    return {
+        "sets": table.sets + new.sets,
+        "reps": table.reps + new.reps,
+        "volume": table.volume + new.volume,
+        "first_set": case((new.first_set < table.first_set, new.first_set), else_=table.first_set),
+        "last_set": case((new.last_set > table.last_set, new.last_set), else_=table.last_set),
+        "updated": func.now(),
+    }
+
+
+def _weekly_updates(table, new) -> dict:
+    return {
+        "sets": table.sets + new.sets,
+        "reps": table.reps + new.reps,
+        "volume": table.volume + new.volume,
+        "training_days": table.training_days + new.training_days,
+        "duration": table.duration + new.duration,
+        "updated": func.now(),
+    }
+
+
+def _replace_updates(columns: tuple[str, ...]):
+    """
+    Обновления при конфликте, заменяющие строку новыми значениями (для пересборки итогов)
+    """
+    def updates(table, new) -> dict:
+        return {**{column: getattr(new, column) for column in columns}, "updated": func.now()}
+    return updates
+
+
+_daily_replace = _replace_updates(("sets", "reps", "volume", "first_set", "last_set"))
+_weekly_replace = _replace_updates(("sets", "reps", "volume", "training_days", "duration"))
+
+
+async def _apply(session: AsyncSession, user_id: int, totals: dict[tuple[date, int], _Totals],
+                 replace: bool = False) -> None:
+    """
+    Прибавляет итоги к дневным и недельным строкам. Сначала читаются уже существующие дни:
+    новый день увеличивает training_days недели, а длительность недели меняется на разницу длительностей дня.
+    replace=True - итоги полные (пересборка): существующие строки заменяются, а не дополняются
+    """
+    if not totals:
+        return
+    existing = {
+        (day, category_id): (first_set, last_set)
+        for day, category_id, first_set, last_set in await session.execute(
+            select(DailyRollup.day, DailyRollup.category_id, DailyRollup.first_set, DailyRollup.last_set)
+            .where(DailyRollup.user_id == user_id, DailyRollup.day.in_({day for day, _ in totals}))
+        )
+    }
+
+    weekly: dict[tuple[date, int], dict] = {}
+    for (day, category_id), item in totals.items():
+        row = weekly.setdefault((week_start(day), category_id), {
+            "user_id": user_id, "week": week_start(day), "category_id": category_id,
+            "sets": 0, "reps": 0, "volume": 0.0, "training_days": 0, "duration": 0,
+        })
+        row["sets"] += item.sets
+        row["reps"] += item.reps
+        row["volume"] += item.volume
+        old = existing.get((day, category_id))
+        if old is None:
+            row["training_days"] += 1
+        if category_id == ROLLUP_TOTAL:
+            first, last = item.first, item.last
+            if old is None:
+                old = (first, first)
+            else:
+                first, last = min(first, old[0]), max(last, old[1])
+            row["duration"] += int((last - first).total_seconds() - (old[1] - old[0]).total_seconds())
+
+    await _upsert(
+        session, DailyRollup,
+        [{"user_id": user_id, "day": day, "category_id": category_id, "sets": item.sets, "reps": item.reps,
+          "volume": item.volume, "first_set": item.first, "last_set": item.last}
+         for (day, category_id), item in totals.items()],
+        ("user_id", "day", "category_id"), _daily_replace if replace else _daily_updates,
+    )
+    await _upsert(session, WeeklyRollup, list(weekly.values()), ("user_id", "week", "category_id"),
+                  _weekly_replace if replace else _weekly_updates)
+
+
+async def _exercise_categories(session: AsyncSession, exercise_ids: Iterable[int]) -> dict[int, int]:
+    exercise_ids = set(exercise_ids)
+    if not exercise_ids:
+        return {}
+    result = await session.execute(
+        select(Exercise.id, _exercise_category)
+        .outerjoin(AdminExercises, Exercise.admin_exercise_id == AdminExercises.id)
+        .outerjoin(UserExercises, Exercise.user_exercise_id == UserExercises.id)
+        .where(Exercise.id.in_(exercise_ids))
+    )
+    return dict(result.tuples().all())
+
+
+async def rollup_sets(session: AsyncSession, user_id: int, sets: list[tuple[int, float, int, datetime]]) -> None:
+    """
+    Добавляет новые подходы в итоги. Вызывается в транзакции, которая сохраняет подходы, до commit
+    :param session:
+    :param user_id: Telegram ID
+    :param sets: [(id упражнения, вес, повторения, время подхода), ...]
+    :return:
+    """
+    if not sets:
+        return
+    categories = await _exercise_categories(session, (exercise_id for exercise_id, _, _, _ in sets))
+    await _apply(session, user_id, _group(
+        (created, categories.get(exercise_id), weight, reps) for exercise_id, weight, reps, created in sets
+    ))
+
+
+def _archived_rows(user_id: int, sessions: list[tuple[uuid.UUID, datetime]]) -> list[tuple[int, float, int, datetime]]:
+    """
+    Подходы архивированных тренировок; время подхода в архиве не хранится, берется дата тренировки
+    """
+    archive = open_archive(user_id)
+    if archive is None:
+        return []
+    return [
+        (archived.exercise_id, archived.weight, archived.repetitions, session_date)
+        for training_session_id, session_date in sessions
+        for archived in archive.session_sets(training_session_id)
+    ]
+
+
+async def rebuild_user_rollups(session: AsyncSession, user_id: int) -> None:
+    """
+    Пересобирает итоги пользователя с нуля: из таблицы set и архива.
+    Параллельные пересборки одного пользователя (первые открытия календаря) выполняются по очереди
+    под блокировкой строки пользователя; дождавшаяся блокировки пересборка пропускается, если итоги уже собраны
+    :param session:
+    :param user_id: Telegram ID
+    :return:
+    """
+    await session.scalar(select(User.id).where(User.user_id == user_id).with_for_update())
+    if await session.scalar(select(RollupState.user_id).where(RollupState.user_id == user_id)) is not None:
+        await session.commit()
+        return
+
+    await session.execute(delete(DailyRollup).where(DailyRollup.user_id == user_id))
+    await session.execute(delete(WeeklyRollup).where(WeeklyRollup.user_id == user_id))
+
+    result = await session.execute(
+        select(Set.created, _exercise_category, Set.weight, Set.repetitions)
+        .join(TrainingSession, Set.training_session_id == TrainingSession.id)
+        .join(Exercise, Set.exercise_id == Exercise.id)
+        .outerjoin(AdminExercises, Exercise.admin_exercise_id == AdminExercises.id)
+        .outerjoin(UserExercises, Exercise.user_exercise_id == UserExercises.id)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(False))
+    )
+    rows = result.tuples().all()
+
+    archived_sessions = (await session.execute(
+        select(TrainingSession.id, TrainingSession.date)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(True))
+    )).all()
+    if archived_sessions:
+        archived = await asyncio.to_thread(_archived_rows, user_id, archived_sessions)
+        # Упражнения, удаленные после архивации, в итоги не попадают, как и их подходы в таблице set
+        categories = await _exercise_categories(session, (exercise_id for exercise_id, _, _, _ in archived))
+        rows.extend((created, categories[exercise_id], weight, reps)
+                    for exercise_id, weight, reps, created in archived if exercise_id in categories)
+
+    await _apply(session, user_id, _group(rows), replace=True)
+    await _upsert(session, RollupState, [{"user_id": user_id}], ("user_id",),
+                  lambda table, new: {"updated": func.now()})
+    await session.commit()
+
+
+async def ensure_rollups(session: AsyncSession, user_id: int) -> None:
+    """
+    Собирает итоги пользователя, если они еще не собраны или устарели после удаления подходов
+    """
+    built = await session.scalar(select(RollupState.user_id).where(RollupState.user_id == user_id))
+    if built is None:
+        await rebuild_user_rollups(session, user_id)
+
+
+def stale_rollups(user_ids: list[int]):
+    """
+    Запрос, помечающий итоги пользователей устаревшими. Выполняется в транзакции, которая удаляет подходы
+    (удаление тренировки, упражнения, программы)
+    """
+    return delete(RollupState).where(RollupState.user_id.in_(user_ids))
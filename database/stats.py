@@ -0,0 +1,334 @@
+import asyncio
+import html
+import os
+from collections import OrderedDict
+from datetime import date
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.archive import open_archive
+from database.models import (
+    AdminExercises, Exercise, Set, TrainingDay, TrainingProgram, TrainingSession, UserExercises
+)
+from utils.versions import track
+
+USER_STATS_CACHE_SIZE = int(os.getenv("USER_STATS_CACHE_SIZE", 1000))
+# За сколько последних недель считаются тренды
+STATS_TREND_WEEKS = int(os.getenv("STATS_TREND_WEEKS", 12))
+# Границы зон интенсивности: вес подхода относительно лучшего расчетного 1ПМ упражнения на тот момент
+INTENSITY_ZONES = (0.6, 0.7, 0.8, 0.9)
+INTENSITY_LABELS = ("<60%", "60-70%", "70-80%", "80-90%", "≥90%")
+
+_EPOCH = date(1970, 1, 1)
+
+# user_id -> ((id последнего подхода, кол-во подходов), статистика)
+_cache: OrderedDict[int, tuple[tuple, "UserStats"]] = OrderedDict()
+
+
+class SetHistory(NamedTuple):
+    """
+    История подходов в виде столбцов, отсортированных по дню.
+    Упражнение - запись каталога: id AdminExercises или минус id UserExercises, чтобы одно и то же
+    упражнение из разных программ считалось вместе
+    """
+    days: np.ndarray        # int64, дней от 1970-01-01
+    exercises: np.ndarray   # int64
+    categories: np.ndarray  # int64
+    weights: np.ndarray     # float64
+    reps: np.ndarray        # float64
+    names: dict[int, str]
+
+    def select(self, mask: np.ndarray) -> "SetHistory":
+        return SetHistory(self.days[mask], self.exercises[mask], self.categories[mask], self.weights[mask],
+                          self.reps[mask], self.names)
+
+    def exercise(self, key: int) -> "SetHistory":
+        return self.select(self.exercises == key)
+
+    def category(self, category_id: int) -> "SetHistory":
+        return self.select(self.categories == category_id)
+
+
+class Trend(NamedTuple):
+    days: np.ndarray    # дни с подходами упражнения
+    values: np.ndarray  # лучший расчетный 1ПМ за день
+    slope: float        # кг в неделю за последние STATS_TREND_WEEKS недель
+
+
+class ExerciseStats(NamedTuple):
+    key: int
+    name: str
+    sets: int
+    best_1rm: float
+    trend: Trend
+
+
+class Summary(NamedTuple):
+    sets: int
+    training_days: int
+    weeks: np.ndarray           # понедельники недель, дней от 1970-01-01
+    weekly_volume: np.ndarray   # сумма вес * повторения за неделю
+    recent_volume: float        # средний недельный объем за последние 4 недели
+    volume_slope: float         # изменение недельного объема, кг в неделю
+    intensity: np.ndarray       # доли подходов по зонам INTENSITY_LABELS
+
+
+class UserStats(NamedTuple):
+    history: SetHistory
+    summary: Summary
+    exercises: tuple[ExerciseStats, ...]  # по убыванию кол-ва подходов
+    version: tuple = ()                   # ключ кэша, см. get_user_stats
+
+
+def estimated_1rm(weights: np.ndarray, reps: np.ndarray) -> np.ndarray:
+    """
+    Расчетный одноповторный максимум по формуле Эпли
+    """
+    return np.where(reps > 1, weights * (1 + reps / 30), weights)
+
+
+def daily_max(days: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Максимум значений за каждый день; days отсортированы
+    """
+    if not days.size:
+        return days, values
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return days[starts], np.maximum.reduceat(values, starts)
+
+
+def weekly_sums(days: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Суммы по неделям (с понедельника) без пропусков пустых недель
+    :return: понедельники недель и суммы
+    """
+    if not days.size:
+        return days, values
+    # 1970-01-01 - четверг
+    weeks = (days + 3) // 7
+    first = weeks.min()
+    sums = np.bincount(weeks - first, weights=values)
+    return (np.arange(sums.size) + first) * 7 - 3, sums
+
+
+def slope_per_week(days: np.ndarray, values: np.ndarray, weeks: int = STATS_TREND_WEEKS) -> float:
+    """
+    Наклон прямой наименьших квадратов за последние weeks недель, в единицах values за неделю
+    """
+    if not days.size:
+        return 0.0
+    recent = days >= days[-1] - weeks * 7
+    x = days[recent].astype(np.float64)
+    y = values[recent]
+    if x.size < 3:
+        return 0.0
+    x = x - x.mean()
+    denominator = np.dot(x, x)
+    if not denominator:
+        return 0.0
+    return float(np.dot(x, y - y.mean()) / denominator * 7)
+
+
+def intensity_distribution(history: SetHistory) -> np.ndarray:
+    """
+    Доли подходов по зонам интенсивности. Интенсивность - вес подхода относительно лучшего
+    расчетного 1ПМ этого упражнения до этого подхода включительно
+    """
+    if not history.days.size:
+        return np.zeros(len(INTENSITY_LABELS))
+    order = np.lexsort((history.days, history.exercises))
+    exercises = history.exercises[order]
+    e1rm = estimated_1rm(history.weights[order], history.reps[order])
+    # Накопленный максимум отдельно по каждому упражнению: группы сдвигаются на непересекающиеся диапазоны
+    group = np.cumsum(np.r_[False, exercises[1:] != exercises[:-1]])
+    shift = group * (e1rm.max() + 1)
+    running_best = np.maximum.accumulate(e1rm + shift) - shift
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(running_best > 0, history.weights[order] / running_best, 0)
+    counts = np.bincount(np.digitize(ratio, INTENSITY_ZONES), minlength=len(INTENSITY_LABELS))
+    return counts / counts.sum()
+
+
+def exercise_trend(history: SetHistory) -> Trend:
+    days, values = daily_max(history.days, estimated_1rm(history.weights, history.reps))
+    return Trend(days, values, slope_per_week(days, values))
+
+
+def summarize(history: SetHistory, today: date | None = None) -> Summary:
+    """
+    Общие показатели по истории (всей, упражнения или категории)
+    """
+    today = ((today or date.today()) - _EPOCH).days
+    weeks, volume = weekly_sums(history.days, history.weights * history.reps)
+    # Текущая неделя еще не закончилась и занижает тренд
+    complete = weeks + 7 <= today
+    return Summary(
+        sets=int(history.days.size),
+        training_days=int(np.unique(history.days[history.days > today - 28]).size),
+        weeks=weeks,
+        weekly_volume=volume,
+        recent_volume=float(volume[weeks > today - 28].sum() / 4),
+        volume_slope=slope_per_week(weeks[complete], volume[complete]),
+        intensity=intensity_distribution(history),
+    )
+
+
+def compute_stats(history: SetHistory, top: int | None = None) -> UserStats:
+    """
+    :param history:
+    :param top: считать тренды только для стольких самых частых упражнений
+    """
+    if not history.days.size:
+        return UserStats(history, summarize(history), ())
+    # Одна сортировка по (упражнение, день), дальше у каждого упражнения свой непрерывный срез
+    order = np.lexsort((history.days, history.exercises))
+    days = history.days[order]
+    exercises = history.exercises[order]
+    e1rm = estimated_1rm(history.weights[order], history.reps[order])
+    starts = np.flatnonzero(np.r_[True, exercises[1:] != exercises[:-1]])
+    ends = np.r_[starts[1:], exercises.size]
+    counts = ends - starts
+    result = []
+    for group in np.argsort(-counts, kind="stable")[:top]:
+        start, end = starts[group], ends[group]
+        trend_days, values = daily_max(days[start:end], e1rm[start:end])
+        key = int(exercises[start])
+        result.append(ExerciseStats(key, history.names.get(key, ""), int(counts[group]), float(values.max()),
+                                    Trend(trend_days, values, slope_per_week(trend_days, values))))
+    return UserStats(history, summarize(history), tuple(result))
+
+
+def _archived_columns(user_id: int, session_days: dict[bytes, int]) -> tuple[np.ndarray, ...] | None:
+    """
+    Подходы из архива пользователя: (дни, id упражнений, веса, повторения)
+    """
+    archive = open_archive(user_id)
+    if archive is None or not archive.codes.size:
+        return None
+    lengths = np.diff(archive.offsets)
+    days = np.array([session_days.get(session_id.tobytes(), -1) for session_id in archive.session_ids],
+                    dtype=np.int64)
+    days = np.repeat(days, lengths)
+    exercise_ids = archive.exercise_ids[archive.codes]
+    return days, exercise_ids, archive.weights.astype(np.float64), archive.reps.astype(np.float64)
+
+
+async def load_history(session: AsyncSession, user_id: int) -> SetHistory:
+    """
+    Вся история подходов пользователя (таблица set одним запросом и архив) в массивах numpy
+    :param session:
+    :param user_id: Telegram ID
+    :return:
+    """
+    result = await session.execute(
+        select(Exercise.id, Exercise.admin_exercise_id, Exercise.user_exercise_id,
+               func.coalesce(AdminExercises.category_id, UserExercises.category_id),
+               func.coalesce(AdminExercises.name, UserExercises.name))
+        .join(TrainingDay, Exercise.training_day_id == TrainingDay.id)
+        .join(TrainingProgram, TrainingDay.training_program_id == TrainingProgram.id)
+        .outerjoin(AdminExercises, Exercise.admin_exercise_id == AdminExercises.id)
+        .outerjoin(UserExercises, Exercise.user_exercise_id == UserExercises.id)
+        .where(TrainingProgram.user_id == user_id)
+        .order_by(Exercise.id)
+    )
+    ids, keys, categories, names = [], [], [], {}
+    for exercise_id, admin_exercise_id, user_exercise_id, category_id, name in result:
+        key = admin_exercise_id if admin_exercise_id is not None else -user_exercise_id
+        ids.append(exercise_id)
+        keys.append(key)
+        categories.append(category_id or 0)
+        names[key] = name
+    exercise_index = np.array(ids, dtype=np.int64)
+
+    rows = (await session.execute(
+        select(TrainingSession.date, Set.exercise_id, Set.weight, Set.repetitions)
+        .join(Set, Set.training_session_id == TrainingSession.id)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(False))
+        .order_by(TrainingSession.date)
+    )).all()
+    columns = [
+        np.array([(row[0].date() - _EPOCH).days for row in rows], dtype=np.int64),
+        np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)),
+        np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+        np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows)),
+    ]
+
+    archived_sessions = (await session.execute(
+        select(TrainingSession.id, TrainingSession.date)
+        .where(TrainingSession.user_id == user_id, TrainingSession.archived.is_(True))
+    )).all()
+    if archived_sessions:
+        session_days = {training_session_id.bytes: (session_date.date() - _EPOCH).days
+                        for training_session_id, session_date in archived_sessions}
+        archived = await asyncio.to_thread(_archived_columns, user_id, session_days)
+        if archived is not None:
+            columns = [np.concatenate((archived_column, column)) for archived_column, column in zip(archived, columns)]
+
+    days, exercise_ids, weights, reps = columns
+    # Id упражнений программ -> запись каталога; подходы удаленных упражнений и тренировок отбрасываются
+    position = np.searchsorted(exercise_index, exercise_ids)
+    position[position >= exercise_index.size] = 0
+    known = (exercise_index.size > 0) & (exercise_index[position] == exercise_ids) & (days >= 0)
+    order = np.argsort(days[known], kind="stable")
+    position = position[known][order]
+    return SetHistory(
+        days=days[known][order],
+        exercises=np.array(keys, dtype=np.int64)[position],
+        categories=np.array(categories, dtype=np.int64)[position],
+        weights=weights[known][order],
+        reps=reps[known][order],
+        names=names,
+    )
+
+
+async def get_user_stats(session: AsyncSession, user_id: int) -> UserStats:
+    """
+    Статистика пользователя. Кэшируется до появления нового подхода: ключ кэша - id последнего
+    подхода и их количество (меняется и при удалении тренировки или переносе в архив).
+    Экраны с ней зависят от версий sets и sessions пользователя
+    :param session:
+    :param user_id: Telegram ID
+    :return:
+    """
+    track("sets", user_id)
+    track("sessions", user_id)
+    key = tuple((await session.execute(
+        select(func.max(Set.id), func.count(Set.id))
+        .join(TrainingSession, Set.training_session_id == TrainingSession.id)
+        .where(TrainingSession.user_id == user_id)
+    )).one())
+    cached = _cache.get(user_id)
+    if cached is not None and cached[0] == key:
+        _cache.move_to_end(user_id)
+        return cached[1]
+
+    stats = compute_stats(await load_history(session, user_id))._replace(version=key)
+    _cache[user_id] = (key, stats)
+    while len(_cache) > USER_STATS_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return stats
+
+
+def format_stats(stats: UserStats, top: int = 3) -> str:
+    """
+    Краткая сводка для профиля
+    """
+    summary = stats.summary
+    if not summary.sets:
+        return "Пока нет выполненных подходов"
+    lines = [f"Подходов: {summary.sets}, тренировок за 4 недели: {summary.training_days}"]
+    lines.append(f"Объем в неделю за 4 недели: {summary.recent_volume:.0f} кг "
+                 f"(тренд {summary.volume_slope:+.0f} кг/нед)")
+    lines.append("Интенсивность: " + ", ".join(
+        f"{label} {share:.0%}" for label, share in zip(INTENSITY_LABELS, summary.intensity) if share >= 0.005
+    ))
+    # Упражнения с собственным весом без отягощения не показываем
+    weighted = [exercise for exercise in stats.exercises if exercise.best_1rm > 0][:top]
+    if weighted:
+        lines.append(f"Расчетный 1ПМ (тренд за {STATS_TREND_WEEKS} нед):")
+        lines.extend(f"{html.escape(exercise.name)}: {exercise.best_1rm:.1f} кг "
+                     f"({exercise.trend.slope:+.1f} кг/нед)" for exercise in weighted)
+    return "\n".join(lines)
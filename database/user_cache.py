@@ -0,0 +1,92 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple
+
+from utils.versions import ALL, subscribe
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 600))
+USER_CACHE_LOG_EVERY = 1000
+
+
+class CachedUser(NamedTuple):
+    """
+    Профиль пользователя без привязки к сессии SQLAlchemy
+    """
+    id: int
+    user_id: int
+    name: str
+    weight: float
+    actual_program_id: int | None
+
+
+class UserCache:
+    """
+    Ограниченный LRU-кэш профилей с TTL. Заполняется при чтении и обновляется
+    функциями записи (write-through), поэтому TTL нужен лишь как страховка
+    от изменений, сделанных в обход orm_query.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[float, CachedUser]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> CachedUser | None:
+        entry = self._data.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            user = entry[1]
+        else:
+            if entry is not None:
+                del self._data[user_id]
+            self.misses += 1
+            user = None
+        if (self.hits + self.misses) % USER_CACHE_LOG_EVERY == 0:
+            logging.info(f"Кэш пользователей: {self.stats()}")
+        return user
+
+    def put(self, user: CachedUser) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[user.user_id] = (time.monotonic() + self.ttl, user)
+        self._data.move_to_end(user.user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def on_remote_change(self, scope: str, key: Hashable) -> None:
+        """
+        Профиль, измененный другим экземпляром бота, перечитывается из базы
+        """
+        if scope == ALL:
+            self.clear()
+        elif scope == "user":
+            self.invalidate(key)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+user_cache = UserCache()
+subscribe(user_cache.on_remote_change)
@@ -16,6 +16,7 @@ from database.orm_query import (
 from filters.chat_types import ChatTypeFilter, IsAdmin
 from kbds.inline import get_callback_btns
 from kbds.reply import get_keyboard
+from utils.media import set_file_id
 
 admin_router = Router()
 admin_router.message.filter(ChatTypeFilter(["private"]), IsAdmin())
@@ -39,8 +40,6 @@ class AddAdminExercise(StatesGroup):
     category_id = State()
     image = State()
 
-    exercise_for_change = None
-
     texts = {
         "AddAdminExercise:name": "Введите название упражнения:",
         "AddAdminExercise:description": "Введите описание упражнения:",
@@ -152,8 +151,7 @@ async def change_exercise_callback(callback: types.CallbackQuery, state: FSMCont
     :return:
     """
     exercise_id = callback.data.split("_")[-1]
-    exercise_for_change = await orm_get_admin_exercise(session, int(exercise_id))
-    AddAdminExercise.exercise_for_change = exercise_for_change
+    await state.update_data(exercise_for_change_id=int(exercise_id))
 
     await callback.answer()
     await callback.message.answer("Введите название упражнения:", reply_markup=types.ReplyKeyboardRemove())
@@ -240,8 +238,8 @@ async def category_choice(callback: types.CallbackQuery, state: FSMContext, sess
         await state.update_data(category=callback.data)
         data = await state.get_data()
         try:
-            if AddAdminExercise.exercise_for_change:
-                await orm_update_admin_exercise(session, AddAdminExercise.exercise_for_change.id, data)
+            if data.get("exercise_for_change_id"):
+                await orm_update_admin_exercise(session, data["exercise_for_change_id"], data)
             else:
                 await orm_add_admin_exercise(session, data)
 
@@ -250,7 +248,6 @@ async def category_choice(callback: types.CallbackQuery, state: FSMContext, sess
         except Exception as e:
             await callback.message.answer(f"Ошибка: \n{str(e)}\nОбратитесь к администратору.", reply_markup=ADMIN_KB)
             await state.clear()
-        AddAdminExercise.exercise_for_change = None
     else:
         await callback.message.answer('Выберите категорию из кнопок.')
         await callback.answer()
@@ -304,5 +301,6 @@ async def add_banner(message: types.Message, state: FSMContext, session: AsyncSe
         return
 
     await orm_change_banner_image(session, for_page, image_id)
+    set_file_id(image_id, image_id)
     await message.answer("Баннер добавлен/изменен.", reply_markup=ADMIN_KB)
     await state.clear()
@@ -1,14 +1,14 @@
 import asyncio
+import functools
+import html
 import logging
 import time
 from asyncio import gather
 from datetime import date
 
 from aiogram.types import InputMediaPhoto
-from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.models import Set
 from database.orm_query import (
     orm_get_program,
     orm_get_programs,
@@ -26,8 +26,11 @@ from database.orm_query import (
     orm_get_exercise_sets,
     orm_turn_on_off_program,
     orm_get_user_exercises_in_category, orm_get_user_exercises, orm_get_user_exercise,
-    orm_get_training_sessions_by_user, orm_get_training_session
+    orm_get_training_sessions_by_user, orm_get_training_session, orm_get_session_sets,
+    orm_get_planned_training_days
 )
+from database.activity import get_trained_days
+from database.stats import STATS_TREND_WEEKS, daily_max, format_stats, get_user_stats, weekly_sums
 from kbds.inline import (
     error_btns,
     get_user_programs_list,
@@ -45,10 +48,17 @@ from kbds.inline import (
     get_user_main_btns,
     get_custom_exercise_btns,
     get_sessions_results_btns,
-    get_exercises_result_btns, )
+    get_exercises_result_btns,
+    get_progress_btns,
+    get_progress_chart_btns, )
+from utils.action_registry import ActionRegistry
+from utils.charts import ChartQueueFull, get_progress_chart
+from utils.media import ERROR_IMAGE, banner_media, forget_media, local_media, media_source, resolve_media
 from utils.paginator import Paginator
+from utils.screen_cache import screen_cache
 from utils.separator import get_action_part
 from utils.temporary_storage import retrieve_data_temporarily
+from utils.versions import tracking
 
 WEEK_DAYS_RU = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
 
@@ -128,14 +138,14 @@ async def main_menu(session: AsyncSession):
     """
     try:
         banner = await orm_get_banner(session, "main")
-        banner_image = InputMediaPhoto(media=banner.image,
+        banner_image = InputMediaPhoto(media=banner_media(banner),
                                        caption=f"<strong>{banner.description}</strong>")
         kbds = get_user_main_btns()
         return banner_image, kbds
     except Exception as e:
         logging.exception(f"Ошибка в main_menu: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке main_menu"
         )
         kbds = error_btns()
@@ -160,21 +170,112 @@ async def profile(session: AsyncSession, level: int, action: str, user_id: int):
         banner  = await orm_get_banner(session, action)
             
         user = await orm_get_user_by_id(session, user_id)
-        banner_image = InputMediaPhoto(media=banner.image,
+        stats = await get_user_stats(session, user_id)
+        banner_image = InputMediaPhoto(media=banner_media(banner),
                                        caption=f"<strong>{banner.description}:\n {user.name} — вес:"
-                                               f" {user.weight}</strong>")
+                                               f" {user.weight}</strong>\n\n{format_stats(stats)}")
         kbds = get_profile_btns(level=level)
         return banner_image, kbds
     except Exception as e:
         logging.exception(f"Ошибка в profile: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке profile"
         )
         kbds = error_btns()
         return error_image, kbds
 
 
+async def progress(session: AsyncSession, level: int, user_id: int, page: int):
+    """
+    Список упражнений с графиками прогресса
+    :param session:
+    :param level: уровень меню(2)
+    :param user_id: Telegram ID
+    :param page: номер страницы
+    :return:
+    """
+    try:
+        banner = await orm_get_banner(session, "training_stats")
+        stats = await get_user_stats(session, user_id)
+        exercises = [exercise for exercise in stats.exercises if exercise.best_1rm > 0]
+        if not exercises:
+            caption = "<strong>Графики появятся после первых подходов с отягощением</strong>"
+            return (InputMediaPhoto(media=banner_media(banner), caption=caption),
+                    get_progress_btns(level=level, page=1, exercises=[], pagination_btns={}))
+
+        paginator = Paginator(array=exercises, page=page, per_page=8)
+        caption = (
+            f"<strong>Прогресс по упражнениям\n"
+            f"Страница {paginator.page}/{paginator.pages}\n\n"
+            f"Выберите упражнение, чтобы посмотреть график веса и объема</strong>"
+        )
+        kbds = get_progress_btns(level=level, page=page, exercises=paginator.get_page(),
+                                 pagination_btns=pages(paginator, "progress"))
+        return InputMediaPhoto(media=banner_media(banner), caption=caption), kbds
+    except Exception as e:
+        logging.exception(f"Ошибка в progress: {e}")
+        error_image = InputMediaPhoto(
+            media=resolve_media(ERROR_IMAGE),
+            caption="Ошибка при загрузке прогресса"
+        )
+        kbds = error_btns()
+        return error_image, kbds
+
+
+async def progress_chart(session: AsyncSession, level: int, user_id: int, exercise_key: int, page: int):
+    """
+    График прогресса упражнения. Рисуется в пуле процессов (utils/charts.py) один раз на версию данных,
+    после первой отправки используется file_id
+    :param session:
+    :param level: уровень меню(3)
+    :param user_id: Telegram ID
+    :param exercise_key: упражнение каталога (database.stats.SetHistory)
+    :param page: страница списка упражнений для возврата
+    :return:
+    """
+    try:
+        banner = await orm_get_banner(session, "training_stats")
+        kbds = get_progress_chart_btns(level=level, page=page)
+        stats = await get_user_stats(session, user_id)
+        exercise = next((exercise for exercise in stats.exercises if exercise.key == exercise_key), None)
+        if exercise is None:
+            return (InputMediaPhoto(media=banner_media(banner),
+                                    caption="<strong>По этому упражнению нет подходов</strong>"), kbds)
+
+        history = stats.history.exercise(exercise_key)
+        days, weights = daily_max(history.days, history.weights)
+        weeks, volume = weekly_sums(history.days, history.weights * history.reps)
+        try:
+            path, removed = await get_progress_chart(
+                user_id, exercise_key, stats.version,
+                exercise.name, days.tolist(), weights.tolist(), exercise.trend.values.tolist(),
+                weeks.tolist(), volume.tolist(),
+            )
+        except ChartQueueFull:
+            # Экран с ERROR_IMAGE не кэшируется, следующее нажатие снова попробует нарисовать график
+            return (InputMediaPhoto(media=resolve_media(ERROR_IMAGE),
+                                    caption="Сейчас рисуется много графиков, попробуйте через минуту"), kbds)
+        for old_path in removed:
+            forget_media(old_path)
+
+        caption = (
+            f"<strong>{html.escape(exercise.name)}\n\n"
+            f"Лучший расчетный 1ПМ: {exercise.best_1rm:.1f} кг\n"
+            f"Тренд за {STATS_TREND_WEEKS} нед: {exercise.trend.slope:+.1f} кг/нед\n"
+            f"Подходов: {exercise.sets}, тренировок: {days.size}</strong>"
+        )
+        return InputMediaPhoto(media=local_media(path), caption=caption), kbds
+    except Exception as e:
+        logging.exception(f"Ошибка в progress_chart: {e}")
+        error_image = InputMediaPhoto(
+            media=resolve_media(ERROR_IMAGE),
+            caption="Ошибка при построении графика"
+        )
+        kbds = error_btns()
+        return error_image, kbds
+
+
 async def training_results(session: AsyncSession, level: int, user_id: int, page: int):
     """
     Отображает список выполненных тренировок пользователем
@@ -194,7 +295,7 @@ async def training_results(session: AsyncSession, level: int, user_id: int, page
 
         if not all_sessions:
             banner_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption=f"<strong>{banner.description}\n\nНет ни одной тренировки</strong>"
             )
             kbds = get_sessions_results_btns(
@@ -211,7 +312,7 @@ async def training_results(session: AsyncSession, level: int, user_id: int, page
             f"{banner.description}</strong>"
         )
         banner_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption=caption
         )
 
@@ -227,7 +328,7 @@ async def training_results(session: AsyncSession, level: int, user_id: int, page
     except Exception as e:
         logging.exception(f"Ошибка в training_results_by_session: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке списка тренировочных сессий"
         )
         kbds = error_btns()
@@ -254,20 +355,20 @@ async def show_result(session: AsyncSession, level: int, page: int, session_page
             session_data = await orm_get_training_session(session, session_id)
             if not session_data:
                 banner_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption="<strong>Данные по тренировке не найдены</strong>"
                 )
                 kbds = error_btns()
                 return banner_image, kbds
 
-            all_sets_query = await session.execute(
-                select(Set).where(Set.training_session_id == session_data.id)
-            )
-            all_sets = all_sets_query.scalars().all()
+            all_sets = await orm_get_session_sets(session, session_data)
 
             exercises_map = {}
             for s_obj in all_sets:
                 ex_obj = await orm_get_exercise(session, s_obj.exercise_id)
+                if ex_obj is None:
+                    # Упражнение удалено после переноса тренировки в архив
+                    continue
 
                 if ex_obj.id not in exercises_map:
                     exercises_map[ex_obj.id] = {
@@ -306,7 +407,7 @@ async def show_result(session: AsyncSession, level: int, page: int, session_page
                         result_message += "\n   Нет данных о подходах."
 
             banner_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption=result_message
             )
 
@@ -322,7 +423,7 @@ async def show_result(session: AsyncSession, level: int, page: int, session_page
         else:
 
             banner_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption="<strong>Тренировка не обнаружена</strong>"
             )
             kbds = error_btns()
@@ -332,7 +433,7 @@ async def show_result(session: AsyncSession, level: int, page: int, session_page
     except Exception as e:
         logging.exception(f"Ошибка в show_result: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке результатов тренировки"
         )
         kbds = error_btns()
@@ -344,11 +445,13 @@ async def show_result(session: AsyncSession, level: int, page: int, session_page
 """
 
 
-async def schedule(session: AsyncSession, level: int, action: str, training_day_id: int, user_id: int):
+async def schedule(session: AsyncSession, level: int, action: str, training_day_id: int, user_id: int,
+                   year: int | None = None, month: int | None = None):
     """
     Показывает расписание пользователя
     Изначально этот блок меню показывает текущую неделю
-    Также можно её развернуть в полный календарь месяца
+    Также можно её развернуть в полный календарь месяца и листать месяцы
+    В календаре отмечены дни с тренировками и запланированные дни
     На каждый день можно нажать и настроить его
     Здесь идет запуск тренировки
     :param session:
@@ -356,6 +459,8 @@ async def schedule(session: AsyncSession, level: int, action: str, training_day_
     :param action: название действия
     :param training_day_id:
     :param user_id: Telegram ID
+    :param year: год развернутого календаря (по умолчанию текущий)
+    :param month: месяц развернутого календаря (по умолчанию текущий)
     :return:
     """
     try:
@@ -373,22 +478,31 @@ async def schedule(session: AsyncSession, level: int, action: str, training_day_
             user_training_day_id = day_of_week_to_id.get(day_of_week_rus)
             if training_day_id is None:
                 training_day_id = user_training_day_id
+            if year is None or month is None or action != "month_schedule":
+                year, month = today.year, today.month
+            calendar_marks = {}
+            if not action.startswith("t_day"):
+                calendar_marks = dict(
+                    trained_days=await get_trained_days(session, user_id, year, month),
+                    planned_day_ids=await orm_get_planned_training_days(session, user_program),
+                )
             user_trd = await orm_get_training_day(session, training_day_id)
 
             if user_trd is None:
                 banner_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption="Тренировочный день не найден."
                 )
                 kbds = get_schedule_btns(
                     level=level,
-                    year=today.year,
-                    month=today.month,
+                    year=year,
+                    month=month,
                     action=action,
                     training_day_id=training_day_id,
                     first_exercise_id=None,
                     active_program=user_program,
                     day_of_week_to_id=day_of_week_to_id,
+                    **calendar_marks,
                 )
                 return banner_image, kbds
 
@@ -399,7 +513,7 @@ async def schedule(session: AsyncSession, level: int, action: str, training_day_
                 exercises_caption = exercises_in_program(user_exercises)
 
             banner_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption=f"{user_trd.day_of_week}\n\n{exercises_caption}"
             )
 
@@ -407,19 +521,20 @@ async def schedule(session: AsyncSession, level: int, action: str, training_day_
 
             kbds = get_schedule_btns(
                 level=level,
-                year=today.year,
-                month=today.month,
+                year=year,
+                month=month,
                 action=action,
                 training_day_id=training_day_id,
                 first_exercise_id=first_exercise_id,
                 active_program=user_program,
-                day_of_week_to_id=day_of_week_to_id
+                day_of_week_to_id=day_of_week_to_id,
+                **calendar_marks,
             )
 
             return banner_image, kbds
         else:
             banner_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption=f"{banner.description}\n\nНе обнаружена программа тренировок\nСоздайте её прямо сейчас!"
             )
             kbds = get_schedule_btns(
@@ -436,7 +551,7 @@ async def schedule(session: AsyncSession, level: int, action: str, training_day_
     except Exception as e:
         logging.exception(f"Ошибка в schedule: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке schedule"
         )
         kbds = error_btns()
@@ -456,13 +571,13 @@ async def training_process(session: AsyncSession, level: int, training_day_id: i
         banner = await orm_get_banner(session, "training_process")
         user_exercises = await orm_get_exercises(session, training_day_id)
         exercises_list = exercises_in_program(user_exercises)
-        banner_image = InputMediaPhoto(media=banner.image, caption=banner.description + "\n\n" + exercises_list)
+        banner_image = InputMediaPhoto(media=banner_media(banner), caption=banner.description + "\n\n" + exercises_list)
         kbds = get_training_process_btns(level=level, training_day_id=training_day_id)
         return banner_image, kbds
     except Exception as e:
         logging.exception(f"Ошибка в training_process: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке training_process"
         )
         kbds = error_btns()
@@ -488,14 +603,14 @@ async def programs_catalog(session: AsyncSession, level: int, action: str, user_
             
         programs = await    orm_get_programs(session, user_id=user_id)
         user_data = await orm_get_user_by_id(session, user_id)
-        banner_image = InputMediaPhoto(media=banner.image, caption=banner.description)
+        banner_image = InputMediaPhoto(media=banner_media(banner), caption=banner.description)
 
         kbbs = get_user_programs_list(level=level, programs=programs, active_program_id=user_data.actual_program_id)
         return banner_image, kbbs
     except Exception as e:
         logging.exception(f"Ошибка в programs_catalog: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке programs_catalog"
         )
         kbds = error_btns()
@@ -518,7 +633,7 @@ async def program(session: AsyncSession, level: int, training_program_id: int, u
         banner = await orm_get_banner(session, "user_program")
         user_data = await orm_get_user_by_id(session, user_id)
         indicator = "🟢" if user_data.actual_program_id == user_program.id else "🔴"
-        banner_image = InputMediaPhoto(media=banner.image,
+        banner_image = InputMediaPhoto(media=banner_media(banner),
                                        caption=f"<strong>{banner.description + user_program.name + ' ' + indicator}"
                                                f"</strong>")
         kbds = get_program_btns(level=level, user_program_id=training_program_id)
@@ -526,7 +641,7 @@ async def program(session: AsyncSession, level: int, training_program_id: int, u
     except Exception as e:
         logging.exception(f"Ошибка в program: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке program"
         )
         kbds = error_btns()
@@ -558,7 +673,7 @@ async def program_settings(session: AsyncSession, level: int, training_program_i
         banner = await orm_get_banner(session, "user_program")
         indicator = "🟢" if user_data.actual_program_id == user_program.id else "🔴"
         banner_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption=f"<strong>{banner.description + user_program.name + ' ' + indicator}</strong>"
         )
         kbds = get_program_stgs_btns(level=level, user_program_id=training_program_id, action=action,
@@ -567,7 +682,7 @@ async def program_settings(session: AsyncSession, level: int, training_program_i
     except Exception as e:
         logging.exception(f"Ошибка в program_settings: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке programs_settings"
         )
         kbds = error_btns()
@@ -598,7 +713,7 @@ async def training_days(session, level: int, training_program_id: int, page: int
         user_exercises = await orm_get_exercises(session, training_day.id)
         caption_text = exercises_in_program(user_exercises)
         image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption=(
                 f"<strong>{banner.description + user_program.name}\n\n"
                 f" День {paginator.page} из {paginator.pages} ({training_day.day_of_week})\n\n"
@@ -620,7 +735,7 @@ async def training_days(session, level: int, training_program_id: int, page: int
     except Exception as e:
         logging.exception(f"Ошибка в training_days: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке training_days"
         )
         kbds = error_btns()
@@ -647,7 +762,7 @@ async def edit_training_day(session: AsyncSession, level: int, training_program_
         empty_list = not user_exercises
 
         user_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption=f"<strong>{training_day.day_of_week}\n\n{caption_text}</strong>",
         )
 
@@ -659,7 +774,7 @@ async def edit_training_day(session: AsyncSession, level: int, training_program_
     except Exception as e:
         logging.exception(f"Ошибка в edit_training_day: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке edit_training_day"
         )
         kbds = error_btns()
@@ -697,7 +812,7 @@ async def show_categories(session: AsyncSession, level: int, training_program_id
         caption_text = exercises_in_program(user_exercises, circle_training)
 
         user_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption=f"<strong>{banner.description + user_program.name}\n\n{caption_text}\n\n"
                     f"Выберите категорию упражнений</strong>",
         )
@@ -718,7 +833,7 @@ async def show_categories(session: AsyncSession, level: int, training_program_id
     except Exception as e:
         logging.exception(f"Ошибка в show_categories: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке show_categories"
         )
         kbds = error_btns()
@@ -761,9 +876,8 @@ async def show_exercises_in_category(session: AsyncSession, level: int, exercise
 
                 if exercise:
                     # Подготовка данных для добавления упражнения
+                    # Название и описание не копируются: они берутся из каталога при чтении
                     add_data = {
-                        "name": exercise.name,
-                        "description": exercise.description,
                         "circle_training": circle_training,
                     }
 
@@ -780,7 +894,7 @@ async def show_exercises_in_category(session: AsyncSession, level: int, exercise
             caption_text = exercises_in_program(user_exercises, circle_training)
 
             user_image = InputMediaPhoto(
-                media=banner.image,
+                media=banner_media(banner),
                 caption=f"<strong>{banner.description + user_program.name}\n\n{caption_text}\n\n"
                         f"Упражнения в категории: {category.name}</strong>",
             )
@@ -798,13 +912,13 @@ async def show_exercises_in_category(session: AsyncSession, level: int, exercise
             caption_text = exercises_in_program(user_exercises, circle_training)
             if user_custom_exercises:
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>{banner.description + user_program.name}\n\n{caption_text}\n\n"
                             f"Пользовательские упражнения:</strong>",
                 )
             else:
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>{banner.description + user_program.name}\n\n{caption_text}\n\n"
                             f"Пользовательские упражнения:\n\n"
                             f"{exercises_in_program(user_custom_exercises)}</strong>",
@@ -822,7 +936,7 @@ async def show_exercises_in_category(session: AsyncSession, level: int, exercise
     except Exception as e:
         logging.exception(f"Ошибка в show_exercises_in_category: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке show_exercises_in_category"
         )
         kbds = error_btns()
@@ -846,7 +960,7 @@ async def edit_exercises(session: AsyncSession, level: int, exercise_id: int, tr
         user_exercises = await orm_get_exercises(session, training_day_id)
         banner = await orm_get_banner(session, "user_program")
         user_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption="<strong>Чтобы изменить упражнение, выберите его из списка:</strong>",
         )
 
@@ -859,7 +973,7 @@ async def edit_exercises(session: AsyncSession, level: int, exercise_id: int, tr
     except Exception as e:
         logging.exception(f"Ошибка в edit_exercises: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке edit_exercises"
         )
         kbds = error_btns()
@@ -884,7 +998,7 @@ async def exercise_settings(session: AsyncSession, level: int, exercise_id: int,
         banner = await orm_get_banner(session, "user_program")
         base_ex_sets = user_exercise.base_sets
         user_image = InputMediaPhoto(
-            media=banner.image,
+            media=banner_media(banner),
             caption="<strong>Добавьте нужное вам количество подходов и повторений</strong>",
         )
 
@@ -897,7 +1011,7 @@ async def exercise_settings(session: AsyncSession, level: int, exercise_id: int,
     except Exception as e:
         logging.exception(f"Ошибка в exercise_settings: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке exercise_settings"
         )
         kbds = error_btns()
@@ -930,13 +1044,13 @@ async def custom_exercises(session: AsyncSession, level: int, training_day_id: i
             if custom_user_exercises:
 
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>Пользовательские упражнения ({user_category.name})</strong>\n\n"
                             f"<strong>Чтобы изменить упражнение, выберите его из списка:</strong>"
                 )
             else:
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>Пользовательские упражнения ({user_category.name})</strong>\n\n"
                             f"<strong>{exercises_in_program(custom_user_exercises)}</strong>"
                 )
@@ -951,12 +1065,12 @@ async def custom_exercises(session: AsyncSession, level: int, training_day_id: i
             if custom_user_exercises:
 
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>Пользовательские упражнения: </strong>\n\n"
                             f"<strong>Чтобы изменить упражнение, выберите его из списка:</strong>")
             else:
                 user_image = InputMediaPhoto(
-                    media=banner.image,
+                    media=banner_media(banner),
                     caption=f"<strong>Пользовательские упражнения: </strong>\n\n"
                             f"<strong>{exercises_in_program(custom_user_exercises)}</strong>")
 
@@ -970,13 +1084,163 @@ async def custom_exercises(session: AsyncSession, level: int, training_day_id: i
     except Exception as e:
         logging.exception(f"Ошибка в custom_exercises: {e}")
         error_image = InputMediaPhoto(
-            media='https://postimg.cc/Ty7d15kq',
+            media=resolve_media(ERROR_IMAGE),
             caption="Ошибка при загрузке custom_exercises"
         )
         kbds = error_btns()
         return error_image, kbds
 
 
+"""
+Маршрутизация меню
+"""
+
+MENU_ROUTES = ActionRegistry()
+
+
+def cached_screen(route):
+    """
+    Кэширует отрисованный экран (InputMediaPhoto, клавиатура) по параметрам маршрута.
+    Зависимости собираются из orm-функций чтения (utils.versions.track), функции записи
+    поднимают версии, и устаревшая запись просто не проходит проверку версий.
+    Экраны с ошибкой и действия добавления ("add_...") не кэшируются.
+    :param route: адаптер маршрута
+    :return:
+    """
+
+    @functools.wraps(route)
+    async def wrapper(session: AsyncSession, level: int, action: str, params: dict):
+        if get_action_part(action).startswith("add_"):
+            return await route(session, level, action, params)
+        key = (level, action, date.today(), *params.values())
+        cached = screen_cache.get(key)
+        if cached is not None:
+            return cached
+        with tracking() as deps:
+            result = await route(session, level, action, params)
+        if media_source(result[0].media) != ERROR_IMAGE:
+            screen_cache.set(key, deps, result)
+        return result
+
+    return wrapper
+
+
+@MENU_ROUTES.register(0, default=True)
+@cached_screen
+async def _route_main_menu(session: AsyncSession, level: int, action: str, params: dict):
+    return await main_menu(session)
+
+
+@MENU_ROUTES.register(1, "program")
+@cached_screen
+async def _route_programs_catalog(session: AsyncSession, level: int, action: str, params: dict):
+    return await programs_catalog(session, level, action, params["user_id"])
+
+
+@MENU_ROUTES.register(1, "profile")
+@cached_screen
+async def _route_profile(session: AsyncSession, level: int, action: str, params: dict):
+    return await profile(session, level, action, params["user_id"])
+
+
+@MENU_ROUTES.register(1, "schedule", "month_schedule", "t_day")
+@cached_screen
+async def _route_schedule(session: AsyncSession, level: int, action: str, params: dict):
+    return await schedule(session, level, action, params["training_day_id"], params["user_id"],
+                          params["year"], params["month"])
+
+
+@MENU_ROUTES.register(2, "training_process")
+@cached_screen
+async def _route_training_process(session: AsyncSession, level: int, action: str, params: dict):
+    return await training_process(session, level, params["training_day_id"])
+
+
+@MENU_ROUTES.register(2, "trd_sts", "n_t", "p_t")
+@cached_screen
+async def _route_training_results(session: AsyncSession, level: int, action: str, params: dict):
+    return await training_results(session, level, params["user_id"], params["page"])
+
+
+@MENU_ROUTES.register(2, "progress")
+@cached_screen
+async def _route_progress(session: AsyncSession, level: int, action: str, params: dict):
+    return await progress(session, level, params["user_id"], params["page"])
+
+
+@MENU_ROUTES.register(2, default=True)
+@cached_screen
+async def _route_program(session: AsyncSession, level: int, action: str, params: dict):
+    return await program(session, level, params["training_program_id"], params["user_id"])
+
+
+@MENU_ROUTES.register(3, "prg_stg", "turn_on_prgm", "turn_off_prgm", prefixes=("to_del_prgm", "prgm_del"))
+async def _route_program_settings(session: AsyncSession, level: int, action: str, params: dict):
+    return await program_settings(session, level, params["training_program_id"], action, params["user_id"])
+
+
+@MENU_ROUTES.register(3, "t_d", "n_d", "p_d")
+async def _route_show_result(session: AsyncSession, level: int, action: str, params: dict):
+    return await show_result(session, level, params["exercises_page"], params["page"], params["session_number"])
+
+
+@MENU_ROUTES.register(3, "progress_ex")
+@cached_screen
+async def _route_progress_chart(session: AsyncSession, level: int, action: str, params: dict):
+    return await progress_chart(session, level, params["user_id"], params["exercise_id"], params["page"])
+
+
+@MENU_ROUTES.register(3, default=True)
+@cached_screen
+async def _route_training_days(session: AsyncSession, level: int, action: str, params: dict):
+    return await training_days(session, level, params["training_program_id"], params["page"])
+
+
+@MENU_ROUTES.register(4, default=True)
+@cached_screen
+async def _route_edit_training_day(session: AsyncSession, level: int, action: str, params: dict):
+    return await edit_training_day(session, level, params["training_program_id"], params["page"],
+                                   params["training_day_id"], action)
+
+
+@MENU_ROUTES.register(5, "edit_excs", "to_edit", "del", "mv")
+@cached_screen
+async def _route_edit_exercises(session: AsyncSession, level: int, action: str, params: dict):
+    return await edit_exercises(session, level, params["exercise_id"], params["training_day_id"], params["page"],
+                                action, params["training_program_id"])
+
+
+@MENU_ROUTES.register(5, default=True)
+@cached_screen
+async def _route_show_categories(session: AsyncSession, level: int, action: str, params: dict):
+    return await show_categories(session, level, params["training_program_id"], params["training_day_id"],
+                                 params["page"], action, params["user_id"], params["circle_training"])
+
+
+@MENU_ROUTES.register(6, "ex_stg", prefixes=("➕", "➖"))
+@cached_screen
+async def _route_exercise_settings(session: AsyncSession, level: int, action: str, params: dict):
+    return await exercise_settings(session, level, params["exercise_id"], params["training_day_id"], params["page"],
+                                   action, params["training_program_id"])
+
+
+@MENU_ROUTES.register(6, default=True)
+@cached_screen
+async def _route_exercises_in_category(session: AsyncSession, level: int, action: str, params: dict):
+    return await show_exercises_in_category(session, level, params["exercise_id"], params["training_day_id"],
+                                            params["page"], action, params["training_program_id"],
+                                            params["category_id"], params["user_id"], params["empty"],
+                                            params["circle_training"])
+
+
+@MENU_ROUTES.register(7, default=True)
+@cached_screen
+async def _route_custom_exercises(session: AsyncSession, level: int, action: str, params: dict):
+    return await custom_exercises(session, level, params["training_day_id"], params["page"], action,
+                                  params["training_program_id"], params["category_id"], params["user_id"],
+                                  params["empty"], params["exercise_id"], params["circle_training"])
+
+
 """
 Мета-функция (Получает данные со всех функций и организовывает навигацию)
 """
@@ -989,67 +1253,23 @@ async def get_menu_content(session: AsyncSession, level: int, action: str, train
                            exercises_page: int = None):
     start_time = time.monotonic()
     try:
-
-        if level == 0:
-            return await main_menu(session)
-
-        elif level == 1:
-            if action == "program":
-                return await programs_catalog(session, level, action, user_id)
-            elif action == "profile":
-                return await profile(session, level, action, user_id)
-            elif action in ["schedule", "month_schedule", "t_day"]:
-                return await schedule(session, level, action, training_day_id, user_id)
-
-        elif level == 2:
-            if action == "training_process":
-                return await training_process(session, level, training_day_id)
-            if action == "trd_sts" or action.startswith("n_t") or action.startswith("p_t"):
-                return await training_results(session, level, user_id, page)
-            return await program(session, level, training_program_id, user_id)
-
-        elif level == 3:
-            if action in ["prg_stg", "turn_on_prgm", "turn_off_prgm"] or action.startswith(
-                    "to_del_prgm") or action.startswith("prgm_del"):
-                return await program_settings(session, level, training_program_id, action, user_id)
-            if action == "t_d" or action.startswith("n_d") or action.startswith("p_d"):
-                return await show_result(session, level, exercises_page, page, session_number)
-            return await training_days(session, level, training_program_id, page)
-
-        elif level == 4:
-            # Редактирование тренировочного дня
-            return await edit_training_day(session, level, training_program_id, page, training_day_id, action)
-
-        elif level == 5:
-            if action in ["edit_excs", "shd/edit_excs", "to_edit", "shd/to_edit",
-                          "del", "shd/del", "mv", "shd/mv"]:
-                return await edit_exercises(session, level, exercise_id, training_day_id, page, action,
-                                            training_program_id)
-            else:
-                return await show_categories(session, level, training_program_id, training_day_id, page, action,
-                                             user_id, circle_training)
-
-        elif level == 6:
-            if action in ["ex_stg", "shd/ex_stg"] or action.startswith("➕") or action.startswith(
-                    "➖") or action.startswith("shd/➕") or action.startswith("shd/➖"):
-                return await exercise_settings(session, level, exercise_id, training_day_id, page, action,
-                                               training_program_id)
-            return await show_exercises_in_category(session, level, exercise_id, training_day_id, page, action,
-                                                    training_program_id, category_id, user_id, empty, circle_training)
-
-        elif level == 7:
-            return await custom_exercises(session, level, training_day_id, page, action,
-                                          training_program_id, category_id, user_id, empty, exercise_id,
-                                          circle_training)
-
-        else:
+        route = MENU_ROUTES.resolve(level, action)
+        if route is None:
             logging.warning(f"Неизвестный уровень меню: {level}")
-            return (InputMediaPhoto(media='https://postimg.cc/Ty7d15kq',
+            return (InputMediaPhoto(media=resolve_media(ERROR_IMAGE),
                                     caption="Ошибка: неизвестный уровень меню"),
                     error_btns())
+
+        params = dict(
+            training_program_id=training_program_id, exercise_id=exercise_id, page=page,
+            training_day_id=training_day_id, user_id=user_id, category_id=category_id, month=month, year=year,
+            set_id=set_id, empty=empty, circle_training=circle_training, session_number=session_number,
+            exercises_page=exercises_page,
+        )
+        return await route(session, level, action, params)
     except Exception as e:
         logging.exception(f"Ошибка в get_menu_content: {e}")
-        return (InputMediaPhoto(media='https://postimg.cc/Ty7d15kq',
+        return (InputMediaPhoto(media=resolve_media(ERROR_IMAGE),
                                 caption="Ошибка при загрузке меню"),
                 error_btns())
     finally:
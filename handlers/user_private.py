@@ -1,16 +1,22 @@
 import asyncio
 import logging
+import os
+import tempfile
 import time
 from typing import List
 
 from aiogram import F, Router, types
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command, StateFilter, CommandStart, or_f
+from aiogram.filters import Command, CommandObject, StateFilter, CommandStart, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardRemove
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from database.engine import session_maker
+from database.export import EXPORT_FORMATS, start_export
+from database.history_import import IMPORT_MAX_BYTES, import_running, start_import
+from database.models import uuid7
 from database.orm_query import (
     orm_add_user,
     orm_update_user,
@@ -22,7 +28,6 @@ from database.orm_query import (
     orm_get_exercises,
     orm_add_user_exercise,
     orm_update_user_exercise,
-    orm_get_user_exercise,
     orm_delete_exercise,
     move_exercise_up,
     move_exercise_down,
@@ -34,18 +39,44 @@ from database.orm_query import (
     orm_get_exercise_set,
     orm_get_exercise_sets,
     orm_add_set,
+    orm_add_sets,
+    orm_copy_previous_sets,
+    orm_clone_program,
     orm_get_sets_by_session,
     orm_update_program,
     orm_update_exercise,
     orm_get_categories,
     orm_delete_user_exercise,
-    orm_add_training_session,
     orm_get_program, orm_get_exercise_max_weight,
     orm_get_sets_for_exercise_in_previous_session, )
 from handlers.menu_processing import get_menu_content
-from kbds.inline import MenuCallBack, get_url_btns, error_btns, get_callback_btns
+from kbds.inline import (
+    REPEAT_LAST_BLOCK,
+    REPEAT_LAST_EXERCISE,
+    MenuCallBack,
+    error_btns,
+    get_callback_btns,
+    get_repeat_last_btns,
+    get_url_btns,
+)
 from kbds.reply import get_keyboard
+from middlewares.fsm import flush_state, refresh_state
+from utils.action_registry import ActionRegistry
+from utils.debounce import menu_debouncer
+from utils.quick_log import QuickLog, parse_quick_log
+from utils.media import remember_sent_media
+from utils.message_edits import (
+    EDIT_CAPTION,
+    EDIT_MARKUP,
+    EDIT_MEDIA,
+    content_hashes,
+    forget,
+    plan_edit,
+    remember,
+    shown_state,
+)
 from utils.separator import get_action_part
+from utils.share_codes import PROGRAM_SHARE_PREFIX, decode_share_code, program_share_link
 
 user_private_router = Router()
 user_private_router.message.filter(F.chat.type == "private")
@@ -56,15 +87,11 @@ class AddUser(StatesGroup):
     name = State()
     weight = State()
 
-    user_for_change = None
-
 
 class AddTrainingProgram(StatesGroup):
     name = State()
     user_id = State()
 
-    trp_for_change = None
-
 
 class TrainingProcess(StatesGroup):
     rest = State()
@@ -83,6 +110,10 @@ class TrainingProcess(StatesGroup):
     current_circular_exercise_id = State()
 
 
+class ImportHistory(StatesGroup):
+    file = State()
+
+
 class AddExercise(StatesGroup):
     name = State()
     description = State()
@@ -92,8 +123,6 @@ class AddExercise(StatesGroup):
     image = State()
     user_id = State()
 
-    exercise_for_change = None
-
 
 async def send_error_message(message: types.Message, error: Exception):
     logging.exception(f"Произошла ошибка: {error}")
@@ -109,6 +138,40 @@ async def send_error_message(message: types.Message, error: Exception):
 """
 
 
+@user_private_router.message(StateFilter(None), CommandStart(deep_link=True,
+                                                               magic=F.args.startswith(PROGRAM_SHARE_PREFIX)))
+async def start_shared_program(message: types.Message, command: CommandObject, state: FSMContext,
+                               session: AsyncSession):
+    """
+    Вызывается по ссылке t.me/<бот>?start=prog_<код>
+    Копирует чужую программу пользователю целиком на стороне базы
+    :param message:
+    :param command: аргументы /start
+    :param state:
+    :param session:
+    :return:
+    """
+    user_id = message.from_user.id
+    try:
+        if not await orm_get_user_by_id(session, user_id):
+            await send_welcome(message, state, session)
+            await message.answer("После регистрации откройте ссылку на программу еще раз.")
+            return
+
+        program_id = decode_share_code(command.args[len(PROGRAM_SHARE_PREFIX):])
+        program = await orm_get_program(session, program_id) if program_id else None
+        if program is None:
+            await message.answer("Ссылка на программу недействительна.")
+            return
+
+        await orm_clone_program(session, program.id, user_id)
+        await message.answer(f"Программа <strong>{program.name}</strong> добавлена в ваши программы.")
+        media, reply_markup = await get_menu_content(session, level=1, action="program", user_id=user_id)
+        await send_menu(message, media, reply_markup)
+    except Exception as e:
+        await send_error_message(message, e)
+
+
 @user_private_router.message(StateFilter(None), CommandStart())
 async def send_welcome(message: types.Message, state: FSMContext, session: AsyncSession):
     """
@@ -127,7 +190,7 @@ async def send_welcome(message: types.Message, state: FSMContext, session: Async
         if user:
             await message.answer(f"Вы уже зарегистрированы как {user.name}.")
             media, reply_markup = await get_menu_content(session, level=0, action="main")
-            await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+            await send_menu(message, media, reply_markup)
         else:
             await message.answer("Привет, я твой виртуальный тренер. Давай тебя зарегистрируем. Напиши свое имя:")
             await state.set_state(AddUser.name)
@@ -142,6 +205,92 @@ async def send_welcome(message: types.Message, state: FSMContext, session: Async
         logging.info(f"Обработка send_welcome заняла {duration:.2f} секунд")
 
 
+@user_private_router.message(StateFilter(None), Command("export"))
+async def export_history(message: types.Message, command: CommandObject, session: AsyncSession):
+    """
+    /export [csv|jsonl] - выгрузка всех выполненных подходов файлом.
+    Файл готовится в фоне, обработчик отвечает сразу
+    :param message:
+    :param command: аргументы команды (формат)
+    :param session:
+    :return:
+    """
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(f"Формат выгрузки: {' или '.join(EXPORT_FORMATS)}, например /export csv")
+        return
+    if not await orm_get_user_by_id(session, message.from_user.id):
+        await message.answer("Сначала зарегистрируйтесь: /start")
+        return
+    if start_export(session_maker, message.bot, message.chat.id, message.from_user.id, fmt):
+        await message.answer("Готовлю файл с историей тренировок, пришлю его, как только он будет готов.")
+    else:
+        await message.answer("Выгрузка уже готовится, дождитесь файла.")
+
+
+@user_private_router.message(StateFilter(None), Command("import"))
+async def import_history(message: types.Message, state: FSMContext, session: AsyncSession):
+    """
+    /import - загрузка истории тренировок из CSV-файла (формат как у /export csv)
+    :param message:
+    :param state:
+    :param session:
+    :return:
+    """
+    if not await orm_get_user_by_id(session, message.from_user.id):
+        await message.answer("Сначала зарегистрируйтесь: /start")
+        return
+    if import_running(message.from_user.id):
+        await message.answer("Импорт уже идет, дождитесь его окончания.")
+        return
+    await state.set_state(ImportHistory.file)
+    await message.answer(
+        "Пришлите CSV-файл (можно сжатый .gz, до 20 МБ) с колонками date, exercise, weight, repetitions "
+        "и, при необходимости, session_id. Разделитель - запятая или точка с запятой, "
+        "дата - 2024-05-31 или 31.05.2024.\n"
+        "Подходы одной даты без session_id считаются одной тренировкой.\n\n"
+        "Для отмены отправьте /cancel"
+    )
+
+
+@user_private_router.message(ImportHistory.file, or_f(Command("cancel"), F.text.casefold() == "отмена"))
+async def cancel_import_history(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Импорт отменен")
+
+
+@user_private_router.message(ImportHistory.file, F.document)
+async def import_history_file(message: types.Message, state: FSMContext):
+    """
+    Скачиваем присланный файл во временный и запускаем импорт в фоне
+    :param message:
+    :param state:
+    :return:
+    """
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.answer("Файл больше 20 МБ, разделите его на несколько частей.")
+        return
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        await message.bot.download(document, destination=path)
+    except Exception:
+        logging.exception("Не удалось скачать файл для импорта")
+        os.remove(path)
+        await message.answer("Не удалось получить файл, попробуйте отправить его еще раз.")
+        return
+    await state.clear()
+    if not start_import(session_maker, message.bot, message.chat.id, message.from_user.id, path):
+        os.remove(path)
+        await message.answer("Импорт уже идет, дождитесь его окончания.")
+
+
+@user_private_router.message(ImportHistory.file)
+async def import_history_wrong_input(message: types.Message):
+    await message.answer("Пришлите CSV-файл документом или отправьте /cancel")
+
+
 @user_private_router.message(StateFilter(AddUser.name.state, AddUser.weight.state), Command("cancel"))
 @user_private_router.message(StateFilter(AddUser.name.state, AddUser.weight.state), F.text.casefold() == "отмена")
 async def cancel_registration(message: types.Message, state: FSMContext):
@@ -180,16 +329,16 @@ async def add_weight(message: types.Message, state: FSMContext, session: AsyncSe
 
     data = await state.get_data()
     try:
-        user_for_change = data.get('user_for_change')
-        if user_for_change:
-            await orm_update_user(session, user_for_change.id, data)
+        user_for_change_id = data.get('user_for_change_id')
+        if user_for_change_id:
+            await orm_update_user(session, user_for_change_id, data)
         else:
             await orm_add_user(session, data)
 
         await message.answer("Прекрасно, вы зарегистрированы в системе!\nДля навигации используйте интерактивное меню.")
         await state.clear()
         media, reply_markup = await get_menu_content(session, level=0, action="main")
-        await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+        await send_menu(message, media, reply_markup)
 
     except Exception as e:
         logging.exception(f"Ошибка при добавлении пользователя: {e}")
@@ -223,7 +372,7 @@ async def cancel_training_program(message: types.Message, state: FSMContext, ses
     await state.clear()
     await message.answer("Действия отменены")
     media, reply_markup = await get_menu_content(session, level=1, action="program", user_id=message.from_user.id)
-    await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+    await send_menu(message, media, reply_markup)
 
 
 @user_private_router.message(AddTrainingProgram.name, F.text)
@@ -245,11 +394,11 @@ async def add_training_program_name(message: types.Message, state: FSMContext, s
     await state.update_data(user_id=user_id, name=message.text)
     data = await state.get_data()
     try:
-        training_program_for_change = data.get('training_program_for_change')
+        program_for_change_id = data.get('program_for_change_id')
         user_programs = await orm_get_programs(session, user_id)
 
-        if training_program_for_change:
-            await orm_update_program(session, training_program_for_change.id, data)
+        if program_for_change_id:
+            await orm_update_program(session, program_for_change_id, data)
         else:
             await orm_add_program(session, data)
             user_programs = await orm_get_programs(session, user_id)
@@ -267,7 +416,7 @@ async def add_training_program_name(message: types.Message, state: FSMContext, s
 
     await message.answer("Готово!")
     media, reply_markup = await get_menu_content(session, level=1, action="program", user_id=user_id)
-    await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+    await send_menu(message, media, reply_markup)
     await state.clear()
 
     duration = time.monotonic() - start_time
@@ -346,10 +495,8 @@ async def change_exercise_callback(callback: types.CallbackQuery, callback_data:
     category_id = callback_data.category_id
     empty = callback_data.empty
 
-    exercise_for_change = await orm_get_user_exercise(session, exercise_id)
-    AddExercise.exercise_for_change = exercise_for_change
-
-    await state.update_data(training_day_id=training_day_id, program_id=program_id, category_id=category_id)
+    await state.update_data(training_day_id=training_day_id, program_id=program_id, category_id=category_id,
+                            exercise_for_change_id=exercise_id)
     await callback.answer()
     await callback.message.answer("Введите название упражнения:", reply_markup=types.ReplyKeyboardRemove())
     await state.set_state(AddExercise.name)
@@ -386,7 +533,7 @@ async def get_origin(message: types.Message, state: FSMContext, data, session: A
         empty=data.get("empty"),
         circle_training=data.get("circle_training")
     )
-    await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+    await send_menu(message, media, reply_markup)
     await state.clear()
 
 
@@ -433,8 +580,8 @@ async def add_exercise_description(
     data = await state.get_data()
     try:
         if data.get("category_id"):
-            if AddExercise.exercise_for_change:
-                await orm_update_user_exercise(session, AddExercise.exercise_for_change.id, data)
+            if data.get("exercise_for_change_id"):
+                await orm_update_user_exercise(session, data["exercise_for_change_id"], data)
             else:
                 await orm_add_user_exercise(session, data)
 
@@ -472,8 +619,8 @@ async def category_choice(callback: types.CallbackQuery, state: FSMContext,
         await callback.answer()
         await state.update_data(category_id=int(callback.data))
         data = await state.get_data()
-        if AddExercise.exercise_for_change:
-            await orm_update_user_exercise(session, AddExercise.exercise_for_change.id, data)
+        if data.get("exercise_for_change_id"):
+            await orm_update_user_exercise(session, data["exercise_for_change_id"], data)
         else:
             await orm_add_user_exercise(session, data)
 
@@ -490,411 +637,336 @@ async def category_choice2(message: types.Message):
     await message.answer("'Выберите категорию из кнопок.'")
 
 
-async def clicked_btn(callback_data: MenuCallBack, state: FSMContext, selected_id, clicked_id,
-                      callback: types.CallbackQuery,
-                      session: AsyncSession):
+async def edit_menu(callback: types.CallbackQuery, media, reply_markup):
     """
-    Определяет: нажал ли пользователь на кнопку или нет
-    :param callback_data:
-    :param state:
-    :param selected_id:
-    :param clicked_id:
+    Редактирует сообщение меню минимальным запросом: если изображение то же, меняется только подпись
+    или только клавиатура, а если не изменилось ничего - запрос не отправляется вовсе
     :param callback:
-    :param session:
+    :param media:
+    :param reply_markup:
     :return:
     """
-    new_selected_id = None if selected_id == clicked_id else clicked_id
+    message = callback.message
+    chat_id, message_id = message.chat.id, message.message_id
+    hashes = content_hashes(media, reply_markup)
+    # Решение принимается по тому, что сообщение показывает сейчас, а не только по памяти процесса:
+    # при нескольких экземплярах бота его мог отредактировать другой
+    shown = shown_state(message)
+    edit = plan_edit(chat_id, message_id, hashes, shown)
+    try:
+        edited = message
+        if edit == EDIT_MEDIA:
+            edited = await message.edit_media(media=media, reply_markup=reply_markup)
+            remember_sent_media(media.media, edited)
+        elif edit == EDIT_CAPTION:
+            edited = await message.edit_caption(caption=media.caption, reply_markup=reply_markup)
+        elif edit == EDIT_MARKUP:
+            edited = await message.edit_reply_markup(reply_markup=reply_markup)
+        remember(chat_id, message_id, hashes, shown_state(edited))
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            remember(chat_id, message_id, hashes, shown)
+        else:
+            forget(chat_id, message_id)
+            logging.warning(f"Ошибка при редактировании меню ({edit}): {e}")
 
-    if get_action_part(callback_data.action) == "to_edit":
-        await state.update_data(selected_exercise_id=new_selected_id)
-    elif get_action_part(callback_data.action) == "to_del_prgm":
-        await state.update_data(selected_program_id=new_selected_id)
 
-    media, reply_markup = await get_menu_content(
-        session,
+async def send_menu(message: types.Message, media, reply_markup):
+    """
+    Отправляет новое сообщение меню и запоминает его содержимое для edit_menu
+    :param message:
+    :param media:
+    :param reply_markup:
+    :return:
+    """
+    sent = await message.answer_photo(photo=media.media, caption=media.caption, reply_markup=reply_markup)
+    remember_sent_media(media.media, sent)
+    remember(sent.chat.id, sent.message_id, content_hashes(media, reply_markup), shown_state(sent))
+    return sent
+
+
+async def render_menu(session: AsyncSession, callback: types.CallbackQuery, callback_data: MenuCallBack,
+                      **overrides):
+    """
+    Собирает содержимое меню по данным callback; overrides заменяют отдельные поля
+    :param session:
+    :param callback:
+    :param callback_data:
+    :param overrides: например action, exercise_id, training_program_id
+    :return: (media, reply_markup)
+    """
+    params = dict(
         level=callback_data.level,
         action=callback_data.action,
         training_program_id=callback_data.program_id,
-        exercise_id=new_selected_id,
+        exercise_id=callback_data.exercise_id,
         page=callback_data.page,
         training_day_id=callback_data.training_day_id,
         user_id=callback.from_user.id,
         category_id=callback_data.category_id,
+        year=callback_data.year,
+        month=callback_data.month,
+        set_id=callback_data.set_id,
         empty=callback_data.empty,
         circle_training=callback_data.circle_training,
+        session_number=callback_data.session_number,
+        exercises_page=callback_data.exercises_page,
     )
+    params.update(overrides)
+    return await get_menu_content(session, **params)
 
-    try:
-        await callback.message.edit_media(media=media, reply_markup=reply_markup)
-    except TelegramBadRequest as e:
-        if "message is not modified" in str(e):
-            pass
-        else:
-            logging.warning(f"Ошибка при edit_media: {e}")
 
-    await callback.answer()
+def shd_prefix(action: str) -> str:
+    """
+    Возвращает префикс "shd/", если действие пришло из расписания
+    """
+    return "shd/" if action.startswith("shd/") else ""
 
 
-@user_private_router.callback_query(MenuCallBack.filter())
-async def user_menu(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
-                    state: FSMContext):
+async def clicked_btn(callback_data: MenuCallBack, state: FSMContext, selected_id, clicked_id,
+                      callback: types.CallbackQuery,
+                      session: AsyncSession):
     """
-    Функция получает на вход данные и выводит информацию пользователю
-    :param callback:
+    Определяет: нажал ли пользователь на кнопку или нет
     :param callback_data:
-    :param session:
     :param state:
+    :param selected_id:
+    :param clicked_id:
+    :param callback:
+    :param session:
     :return:
     """
-    start_time = time.monotonic()
-    try:
-        action = callback_data.action
-        logging.info(f"Получен callback от пользователя {callback.from_user.id}: {callback_data}")
+    new_selected_id = None if selected_id == clicked_id else clicked_id
 
-        user_data = await state.get_data()
-        selected_exercise_id = user_data.get("selected_exercise_id")
-        selected_program_id = user_data.get("selected_program_id")
+    if get_action_part(callback_data.action) == "to_edit":
+        await state.update_data(selected_exercise_id=new_selected_id)
+    elif get_action_part(callback_data.action) == "to_del_prgm":
+        await state.update_data(selected_program_id=new_selected_id)
 
-        if get_action_part(action) == "to_edit":
-            await clicked_btn(session=session, callback_data=callback_data, state=state,
-                              selected_id=selected_exercise_id, callback=callback,
-                              clicked_id=callback_data.exercise_id)
+    media, reply_markup = await render_menu(session, callback, callback_data, exercise_id=new_selected_id)
+    await edit_menu(callback, media, reply_markup)
+    await callback.answer()
 
-        elif get_action_part(action).startswith("del"):
-            if get_action_part(action).__contains__("custom"):
-                await orm_delete_user_exercise(session, callback_data.exercise_id)
-            else:
-                await orm_delete_exercise(session, callback_data.exercise_id)
-            await state.update_data(selected_exercise_id=None)
-
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action="to_edit",
-                training_program_id=callback_data.program_id,
-                exercise_id=None,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                circle_training=callback_data.circle_training,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
 
-            if action.startswith("shd/"):
-                media, reply_markup = await get_menu_content(
-                    session,
-                    level=callback_data.level,
-                    action="shd/to_edit",
-                    training_program_id=callback_data.program_id,
-                    exercise_id=None,
-                    page=callback_data.page,
-                    training_day_id=callback_data.training_day_id,
-                    user_id=callback.from_user.id,
-                    category_id=callback_data.category_id,
-                    year=callback_data.year,
-                    month=callback_data.month,
-                    set_id=callback_data.set_id,
-                    empty=callback_data.empty,
-                    circle_training=callback_data.circle_training,
-                    session_number=callback_data.session_number,
-                    exercises_page=callback_data.exercises_page,
-                )
+"""
+Действия меню
+"""
 
-            try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
-
-            await callback.answer("Упражнение удалено.")
-
-        elif get_action_part(action).startswith("mv"):
-            if get_action_part(action) == "mv_up":
-                await callback.answer(await move_exercise_up(session, callback_data.exercise_id))
-            elif get_action_part(action) == "mv_down":
-                await callback.answer(await move_exercise_down(session, callback_data.exercise_id))
-
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action="to_edit",
-                training_program_id=callback_data.program_id,
-                exercise_id=callback_data.exercise_id,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                circle_training=callback_data.circle_training,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
+USER_MENU_ACTIONS = ActionRegistry()
 
-            if action.startswith("shd/"):
-                media, reply_markup = await get_menu_content(
-                    session,
-                    level=callback_data.level,
-                    action="shd/to_edit",
-                    training_program_id=callback_data.program_id,
-                    exercise_id=callback_data.exercise_id,
-                    page=callback_data.page,
-                    training_day_id=callback_data.training_day_id,
-                    user_id=callback.from_user.id,
-                    category_id=callback_data.category_id,
-                    year=callback_data.year,
-                    month=callback_data.month,
-                    set_id=callback_data.set_id,
-                    empty=callback_data.empty,
-                    circle_training=callback_data.circle_training,
-                    session_number=callback_data.session_number,
-                    exercises_page=callback_data.exercises_page,
-                )
-            try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
-
-        elif get_action_part(action) == "to_del_prgm":
-            await clicked_btn(session=session, callback_data=callback_data, state=state,
-                              selected_id=selected_program_id, callback=callback, clicked_id=callback_data.program_id)
-
-        elif get_action_part(action) == "prgm_del":
-            await orm_delete_program(session, callback_data.program_id)
-            await state.update_data(selected_program_id=None)
-
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action="program",
-                training_program_id=None,
-                exercise_id=None,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                circle_training=callback_data.circle_training,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
-            try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
 
-            await callback.answer("Программа удалена.")
+@USER_MENU_ACTIONS.register(None, "to_edit")
+async def _menu_select_exercise(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                                state: FSMContext, user_data: dict):
+    await clicked_btn(session=session, callback_data=callback_data, state=state,
+                      selected_id=user_data.get("selected_exercise_id"), callback=callback,
+                      clicked_id=callback_data.exercise_id)
+
+
+@USER_MENU_ACTIONS.register(None, "to_del_prgm")
+async def _menu_select_program(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                               state: FSMContext, user_data: dict):
+    await clicked_btn(session=session, callback_data=callback_data, state=state,
+                      selected_id=user_data.get("selected_program_id"), callback=callback,
+                      clicked_id=callback_data.program_id)
+
+
+@USER_MENU_ACTIONS.register(None, prefixes=("del",))
+async def _menu_delete_exercise(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                                state: FSMContext, user_data: dict):
+    action = callback_data.action
+    if "custom" in get_action_part(action):
+        await orm_delete_user_exercise(session, callback_data.exercise_id)
+    else:
+        await orm_delete_exercise(session, callback_data.exercise_id)
+    await state.update_data(selected_exercise_id=None)
+
+    media, reply_markup = await render_menu(session, callback, callback_data,
+                                            action=f"{shd_prefix(action)}to_edit", exercise_id=None)
+    await edit_menu(callback, media, reply_markup)
+    await callback.answer("Упражнение удалено.")
+
+
+@USER_MENU_ACTIONS.register(None, prefixes=("mv",))
+async def _menu_move_exercise(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                              state: FSMContext, user_data: dict):
+    action = callback_data.action
+    if get_action_part(action) == "mv_up":
+        await callback.answer(await move_exercise_up(session, callback_data.exercise_id))
+    elif get_action_part(action) == "mv_down":
+        await callback.answer(await move_exercise_down(session, callback_data.exercise_id))
+
+    media, reply_markup = await render_menu(session, callback, callback_data,
+                                            action=f"{shd_prefix(action)}to_edit")
+    await edit_menu(callback, media, reply_markup)
+
+
+@USER_MENU_ACTIONS.register(None, "prgm_del")
+async def _menu_delete_program(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                               state: FSMContext, user_data: dict):
+    await orm_delete_program(session, callback_data.program_id)
+    await state.update_data(selected_program_id=None)
+
+    media, reply_markup = await render_menu(session, callback, callback_data, action="program",
+                                            training_program_id=None, exercise_id=None)
+    await edit_menu(callback, media, reply_markup)
+    await callback.answer("Программа удалена.")
+
+
+@USER_MENU_ACTIONS.register(None, "prgm_clone")
+async def _menu_clone_program(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                              state: FSMContext, user_data: dict):
+    program = await orm_get_program(session, callback_data.program_id)
+    if program is None or program.user_id != callback.from_user.id:
+        await callback.answer("Программа не найдена.")
+        return
+    await orm_clone_program(session, program.id, callback.from_user.id, name=f"{program.name[:40]} (копия)")
+
+    media, reply_markup = await render_menu(session, callback, callback_data, action="program",
+                                            training_program_id=None, exercise_id=None)
+    await edit_menu(callback, media, reply_markup)
+    await callback.answer("Программа скопирована.")
+
 
-        elif get_action_part(action).startswith("➕") or get_action_part(action).startswith("➖"):
-            parts = get_action_part(action).split("_")
-            operation = parts[0]  # "➕" или "➖"
-            increment = int(parts[1])
-            field = parts[2]
-            set_id = callback_data.set_id
+@USER_MENU_ACTIONS.register(None, "prgm_share")
+async def _menu_share_program(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                              state: FSMContext, user_data: dict):
+    program = await orm_get_program(session, callback_data.program_id)
+    if program is None or program.user_id != callback.from_user.id:
+        await callback.answer("Программа не найдена.")
+        return
+    me = await callback.bot.me()
+    await callback.message.answer(
+        f"Ссылка на программу <strong>{program.name}</strong>:\n{program_share_link(me.username, program.id)}\n\n"
+        f"Перешедший по ней получит собственную копию программы."
+    )
+    await callback.answer()
 
-            user_exercise = await orm_get_exercise(session, callback_data.exercise_id)
-            user_exercise_set = await orm_get_exercise_set(session, set_id)
 
+@USER_MENU_ACTIONS.register(None, prefixes=("➕", "➖"))
+async def _menu_change_sets_reps(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                                 state: FSMContext, user_data: dict):
+    # Серия нажатий копится в menu_debouncer: в базу уходит одно UPDATE, сообщение редактируется один раз.
+    # Промежуточное значение пользователь видит во всплывающем ответе: правка клавиатуры на каждое нажатие
+    # вернула бы по запросу к Telegram на нажатие, от которых окно и избавляет
+    action = callback_data.action
+    parts = get_action_part(action).split("_")
+    operation = parts[0]  # "➕" или "➖"
+    increment = int(parts[1])
+    field = parts[2]
+    set_id = callback_data.set_id
+    exercise_id = callback_data.exercise_id
+
+    if field == "reps":
+        key = (callback.from_user.id, field, set_id)
+        current = menu_debouncer.current(key)
+        if current is None:
+            current = (await orm_get_exercise_set(session, set_id)).reps
+        hint = "Повторений"
+    elif field == "sets":
+        key = (callback.from_user.id, field, exercise_id)
+        current = menu_debouncer.current(key)
+        if current is None:
+            current = (await orm_get_exercise(session, exercise_id)).base_sets
+        hint = "Подходов"
+    else:
+        await callback.answer()
+        return
+    new_value = current + increment if operation == "➕" else max(1, current - increment)
+
+    async def apply(value: int, flushed: bool):
+        async with session_maker() as apply_session:
             if field == "reps":
-                new_reps = (
-                    user_exercise_set.reps + increment
-                    if operation == "➕"
-                    else max(1, user_exercise_set.reps - increment)
-                )
-                await orm_update_exercise_set(session, set_id, new_reps)
+                await orm_update_exercise_set(apply_session, set_id, value)
+            else:
+                await orm_update_exercise(apply_session, exercise_id, {"sets": value})
+            if flushed:
+                # Пользователь уже уходит с экрана: его перерисует следующее действие
+                return
+            media, reply_markup = await render_menu(apply_session, callback, callback_data,
+                                                    action=f"{shd_prefix(action)}{operation}_{field}")
+        await edit_menu(callback, media, reply_markup)
 
-            elif field == "sets":
-                new_sets = (
-                    user_exercise.base_sets + increment
-                    if operation == "➕"
-                    else max(1, user_exercise.base_sets - increment)
-                )
-                await orm_update_exercise(session, callback_data.exercise_id, {"sets": new_sets})
-
-                # if operation == "➕":
-                #     await orm_add_exercise_set(session, callback_data.exercise_id, user_exercise.base_reps)
-                # elif operation == "➖":
-                #     exercise_sets = await orm_get_exercise_sets(session, callback_data.exercise_id)
-                #     if len(exercise_sets) > 1:
-                #         last_set_id = exercise_sets[-1].id
-                #         await orm_delete_exercise_set(session, last_set_id)
-
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action=f"{operation}_{field}",
-                training_program_id=callback_data.program_id,
-                exercise_id=callback_data.exercise_id,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                circle_training=callback_data.circle_training,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
-            if action.startswith("shd/"):
-                media, reply_markup = await get_menu_content(
-                    session,
-                    level=callback_data.level,
-                    action=f"shd/{operation}_{field}",
-                    training_program_id=callback_data.program_id,
-                    exercise_id=callback_data.exercise_id,
-                    page=callback_data.page,
-                    training_day_id=callback_data.training_day_id,
-                    user_id=callback.from_user.id,
-                    category_id=callback_data.category_id,
-                    year=callback_data.year,
-                    month=callback_data.month,
-                    set_id=callback_data.set_id,
-                    circle_training=callback_data.circle_training,
-                    session_number=callback_data.session_number,
-                    exercises_page=callback_data.exercises_page,
-                )
+    menu_debouncer.schedule(key, new_value, apply)
+    await callback.answer(f"{hint}: {new_value}")
+
+
+@USER_MENU_ACTIONS.register(None, "training_process")
+async def _menu_training_process(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                                 state: FSMContext, user_data: dict):
+    media, reply_markup = await render_menu(session, callback, callback_data, circle_training=False)
+    await edit_menu(callback, media, reply_markup)
+
+    await callback.answer()
+    await handle_start_training_process(callback, callback_data, state, session)
+
+
+@USER_MENU_ACTIONS.register(None, "finish_training")
+async def _menu_finish_training(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                                state: FSMContext, user_data: dict):
+    try:
+        await callback.answer()
+        media, reply_markup = await render_menu(session, callback, callback_data)
+        await edit_menu(callback, media, reply_markup)
+
+        user_data = await state.get_data()
+        bot_message_id = user_data.get('bot_message_id')
+        if bot_message_id:
             try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
+                await callback.message.bot.delete_message(chat_id=callback.message.chat.id,
+                                                          message_id=bot_message_id)
             except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
+                if "message to delete not found" in str(e):
                     pass
                 else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
-
-            await callback.answer()
-
-        elif get_action_part(action) == "training_process":
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action=action,
-                training_program_id=callback_data.program_id,
-                exercise_id=callback_data.exercise_id,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
+                    logging.warning(f"Не удалось удалить сообщение бота: {e}")
+        rest_message_id = user_data.get("rest_message_id")
+        if rest_message_id:
             try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
+                await callback.message.bot.delete_message(chat_id=callback.message.chat.id,
+                                                          message_id=rest_message_id)
             except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
+                if "message to delete not found" not in str(e):
+                    logging.warning(f"Не удалось удалить сообщение об отдыхе: {e}")
+        await state.clear()
+        await state.update_data(rest_ended=True)
+    except Exception as e:
+        logging.warning(f"Не удалось удалить сообщение бота: {e}")
 
-            await callback.answer()
-            await handle_start_training_process(callback, callback_data, state, session)
 
-        elif get_action_part(action) == "finish_training":
-            try:
-                await callback.answer()
-                media, reply_markup = await get_menu_content(
-                    session,
-                    level=callback_data.level,
-                    action=action,
-                    training_program_id=callback_data.program_id,
-                    exercise_id=callback_data.exercise_id,
-                    page=callback_data.page,
-                    training_day_id=callback_data.training_day_id,
-                    user_id=callback.from_user.id,
-                    category_id=callback_data.category_id,
-                    year=callback_data.year,
-                    month=callback_data.month,
-                    set_id=callback_data.set_id,
-                    empty=callback_data.empty,
-                    circle_training=callback_data.circle_training,
-                    session_number=callback_data.session_number,
-                    exercises_page=callback_data.exercises_page,
-                )
-                try:
-                    await callback.message.edit_media(media=media, reply_markup=reply_markup)
-                except TelegramBadRequest as e:
-                    if "message is not modified" in str(e):
-                        pass
-                    else:
-                        logging.warning(f"Ошибка при edit_media: {e}")
-
-                user_data = await state.get_data()
-                bot_message_id = user_data.get('bot_message_id')
-                if bot_message_id:
-                    try:
-                        await callback.message.bot.delete_message(chat_id=callback.message.chat.id,
-                                                                  message_id=bot_message_id)
-                    except TelegramBadRequest as e:
-                        if "message to delete not found" in str(e):
-                            pass
-                        else:
-                            logging.warning(f"Не удалось удалить сообщение бота: {e}")
-                rest_message_id = user_data.get("rest_message_id")
-                if rest_message_id:
-                    try:
-                        await callback.message.bot.delete_message(chat_id=callback.message.chat.id,
-                                                                  message_id=rest_message_id)
-                    except TelegramBadRequest as e:
-                        if "message to delete not found" not in str(e):
-                            logging.warning(f"Не удалось удалить сообщение об отдыхе: {e}")
-                await state.clear()
-                await state.update_data(rest_ended=True)
-            except Exception as e:
-                logging.warning(f"Не удалось удалить сообщение бота: {e}")
+@USER_MENU_ACTIONS.register(None, default=True)
+async def _menu_navigate(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                         state: FSMContext, user_data: dict):
+    # Все остальные действия — просто обновляем меню
+    media, reply_markup = await render_menu(session, callback, callback_data)
+    await state.update_data(selected_exercise_id=None, selected_program_id=None)
+    await edit_menu(callback, media, reply_markup)
+    await callback.answer()
 
-        else:
-            # Все остальные действия — просто обновляем меню
-            media, reply_markup = await get_menu_content(
-                session,
-                level=callback_data.level,
-                action=action,
-                training_program_id=callback_data.program_id,
-                exercise_id=callback_data.exercise_id,
-                page=callback_data.page,
-                training_day_id=callback_data.training_day_id,
-                user_id=callback.from_user.id,
-                category_id=callback_data.category_id,
-                year=callback_data.year,
-                month=callback_data.month,
-                set_id=callback_data.set_id,
-                empty=callback_data.empty,
-                circle_training=callback_data.circle_training,
-                session_number=callback_data.session_number,
-                exercises_page=callback_data.exercises_page,
-            )
-            await state.update_data(selected_exercise_id=None, selected_program_id=None)
-            try:
-                await callback.message.edit_media(media=media, reply_markup=reply_markup)
-            except TelegramBadRequest as e:
-                if "message is not modified" in str(e):
-                    pass
-                else:
-                    logging.warning(f"Ошибка при edit_media: {e}")
-            await callback.answer()
+
+@user_private_router.callback_query(MenuCallBack.filter())
+async def user_menu(callback: types.CallbackQuery, callback_data: MenuCallBack, session: AsyncSession,
+                    state: FSMContext):
+    """
+    Функция получает на вход данные и выводит информацию пользователю
+    :param callback:
+    :param callback_data:
+    :param session:
+    :param state:
+    :return:
+    """
+    start_time = time.monotonic()
+    try:
+        action = callback_data.action
+        logging.info(f"Получен callback от пользователя {callback.from_user.id}: {callback_data}")
+
+        if not get_action_part(action).startswith(("➕", "➖")):
+            # Несохраненные ➕/➖ применяются до перехода, чтобы новый экран их учитывал
+            await menu_debouncer.flush(callback.from_user.id)
+
+        user_data = await state.get_data()
+        handler = USER_MENU_ACTIONS.resolve(None, action)
+        await handler(callback, callback_data, session, state, user_data)
 
     except Exception as e:
         if "message is not modified" in str(e):
@@ -930,14 +1002,6 @@ async def handle_start_training_process(
     user_id = callback.from_user.id
 
     try:
-        new_session = await orm_add_training_session(
-            session,
-            {
-                "user_id": user_id,
-                "note": "Запуск тренировки",
-            },
-        )
-
         user = await orm_get_user_by_id(session, user_id)
         if not user:
             await callback.message.answer("Пользователь не найден.")
@@ -956,7 +1020,8 @@ async def handle_start_training_process(
         circular_rest_between_exercise = training_program.circular_rest_between_exercise
         rest_between_set = training_program.rest_between_set
 
-        training_session_id = str(new_session.id)
+        # Запись о тренировке создается вместе с первым подходом (orm_add_set), до этого есть только ее uuid
+        training_session_id = str(uuid7())
         await state.set_state(TrainingProcess.exercise_index)
         await state.update_data(
             training_session_id=training_session_id,
@@ -1106,6 +1171,7 @@ async def first_result_message(session: AsyncSession, user_id, next_ex):
         f"Результаты прошлой тренировки:\n{prev_sets}"
         f"----------------------------------------\n\n"
         f"Подход <strong>1 из {next_ex.base_sets}</strong> \nВведите вес снаряда:"
+        f"\n<i>или сразу вес x повторения x подходы, например 80x10x3</i>"
     )
     logging.info(f"frm ex id: {next_ex.name}")
     return text
@@ -1167,6 +1233,7 @@ async def result_message_after_set(session: AsyncSession, user_id, next_ex, set_
         f"Результаты прошлой тренировки:\n{prev_sets}"
         f"----------------------------------------\n"
         f"Подход <strong>{set_index} из {next_ex.base_sets}</strong> \nВведите вес снаряда:"
+        f"\n<i>или сразу вес x повторения x подходы, например 80x10x3</i>"
     )
     logging.info(f"rmas ex id: {next_ex.name}, session_id: {session_id}")
     return text
@@ -1194,6 +1261,7 @@ async def start_standard_block(
             chat_id=message.chat.id,
             message_id=bot_msg_id,
             text=text,
+            reply_markup=get_repeat_last_btns(with_exercise=True),
         )
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
@@ -1201,8 +1269,7 @@ async def start_standard_block(
         else:
             logging.warning(f"Ошибка при edit_message_text: {e}")
 
-    current_sets = {"weight": [], "repetitions": []}
-    await state.update_data(current_exercise_id=current_ex.id, current_sets=current_sets)
+    await state.update_data(current_exercise_id=current_ex.id)
     await state.set_state(TrainingProcess.weight)
 
 
@@ -1254,6 +1321,7 @@ async def process_standard_after_set(
                 chat_id=message.chat.id,
                 message_id=bot_msg_id,
                 text=text,
+                reply_markup=get_repeat_last_btns(with_exercise=True),
             )
         except TelegramBadRequest as e:
             if "message is not modified" in str(e):
@@ -1279,6 +1347,7 @@ async def process_standard_after_set(
                     chat_id=message.chat.id,
                     message_id=bot_msg_id,
                     text=text,
+                    reply_markup=get_repeat_last_btns(with_exercise=True),
                 )
             except TelegramBadRequest as e:
                 if "message is not modified" in str(e):
@@ -1313,6 +1382,7 @@ async def start_circuit_block(
             chat_id=message.chat.id,
             message_id=bot_msg_id,
             text=text,
+            reply_markup=get_repeat_last_btns(with_exercise=False),
         )
     except TelegramBadRequest as e:
         if "message is not modified" in str(e):
@@ -1380,6 +1450,7 @@ async def process_circuit_after_set(
                 chat_id=message.chat.id,
                 message_id=bot_msg_id,
                 text=text,
+                reply_markup=get_repeat_last_btns(with_exercise=False),
             )
         except TelegramBadRequest as e:
             if "message is not modified" in str(e):
@@ -1428,6 +1499,7 @@ async def process_circuit_after_set(
                     chat_id=message.chat.id,
                     message_id=bot_msg_id,
                     text=text,
+                    reply_markup=get_repeat_last_btns(with_exercise=False),
                 )
             except TelegramBadRequest as e:
                 if "message is not modified" in str(e):
@@ -1451,7 +1523,9 @@ async def handle_rest_period(
     :param rest_duration:
     :return:
     """
-    data = await state.get_data()
+    # Отдых ждет изменений от других обновлений ("Закончить отдых"), поэтому
+    # свои данные записываем сразу, а флаг rest_ended перечитываем из хранилища
+    data = await refresh_state(state)
     if "rest_ended" not in data:
         await state.update_data(rest_ended=False)
 
@@ -1459,7 +1533,7 @@ async def handle_rest_period(
     sleep_step = 1
 
     while time_left > 0:
-        data = await state.get_data()
+        data = await refresh_state(state)
         if data.get("rest_ended", False):
             break
 
@@ -1489,7 +1563,7 @@ async def handle_rest_period(
         while slept < chunk:
             await asyncio.sleep(sleep_step)
             slept += sleep_step
-            data = await state.get_data()
+            data = await refresh_state(state)
             if data.get("rest_ended", False):
                 break
 
@@ -1498,8 +1572,9 @@ async def handle_rest_period(
 
         time_left -= chunk
 
-    data = await state.get_data()
+    data = await refresh_state(state)
     await state.update_data(rest_ended=False)
+    await flush_state(state)
     rest_message_id = data.get("rest_message_id")
     if rest_message_id:
         try:
@@ -1531,6 +1606,8 @@ async def handle_rest_messages(message: types.Message, state: FSMContext):
     """
     if message.text == "🏄‍♂️ Закончить отдых":
         await state.update_data(rest_ended=True)
+        # Флаг должен сразу увидеть handle_rest_period, ожидающий в другом обновлении
+        await flush_state(state)
         data = await state.get_data()
         rest_message_id = data.get("rest_message_id")
         if rest_message_id:
@@ -1612,6 +1689,102 @@ async def finish_training(
 """
 
 
+@user_private_router.message(TrainingProcess.weight, F.text.func(parse_quick_log).as_("quick_log"))
+async def process_quick_log(
+        message: types.Message, state: FSMContext, session: AsyncSession, quick_log: QuickLog):
+    """
+    Быстрая запись подхода одним сообщением: "80x10" или "80x10x3" (вес x повторения x подходы).
+    Подходы записываются сразу, без шагов ввода повторений и подтверждения
+    :param message:
+    :param state:
+    :param session:
+    :param quick_log: разобранная запись
+    :return:
+    """
+    data = await state.get_data()
+    ex_id = data.get("current_exercise_id")
+    training_session_id = data.get("training_session_id")
+    sets_count = quick_log.sets
+
+    if data.get("standard_ex_ids"):
+        ex_obj = await orm_get_exercise(session, ex_id)
+        total_sets = ex_obj.base_sets if ex_obj else 3
+        set_index = data.get("set_index", 1)
+        sets_count = min(sets_count, max(1, total_sets - set_index + 1))
+    elif data.get("circuit_ex_ids"):
+        # В круговой тренировке упражнение выполняется по одному подходу за круг
+        sets_count = 1
+    else:
+        await message.answer("Ошибка: не найдено ни standard_ex_ids, ни circuit_ex_ids.")
+        await state.clear()
+        return
+
+    try:
+        await orm_add_sets(session, ex_id, training_session_id, message.from_user.id,
+                           [(quick_log.weight, quick_log.reps)] * sets_count)
+        await message.delete()
+    except Exception as e:
+        await send_error_message(message, e)
+        await state.clear()
+        return
+
+    await state.update_data(weight=quick_log.weight, reps=quick_log.reps)
+    if data.get("standard_ex_ids"):
+        # Последний из записанных подходов обрабатывается как обычно (отдых или следующее упражнение)
+        await state.update_data(set_index=data.get("set_index", 1) + sets_count - 1)
+        await process_standard_after_set(message, state, session)
+    else:
+        await process_circuit_after_set(message, state, session)
+
+
+@user_private_router.callback_query(TrainingProcess.weight, F.data.in_({REPEAT_LAST_EXERCISE, REPEAT_LAST_BLOCK}))
+async def repeat_last_session(callback: types.CallbackQuery, state: FSMContext, session: AsyncSession):
+    """
+    Повтор прошлой тренировки одним нажатием: подходы текущего упражнения или всех оставшихся упражнений блока
+    копируются из последней тренировки одним запросом, после чего тренировка переходит
+    к следующему упражнению или блоку
+    :param callback:
+    :param state:
+    :param session:
+    :return:
+    """
+    data = await state.get_data()
+    standard_ex_ids = data.get("standard_ex_ids")
+    circuit_ex_ids = data.get("circuit_ex_ids")
+    repeat_exercise = callback.data == REPEAT_LAST_EXERCISE and bool(standard_ex_ids)
+
+    if repeat_exercise:
+        exercise_ids = [data.get("current_exercise_id")]
+    elif standard_ex_ids:
+        exercise_ids = standard_ex_ids[data.get("standard_ex_idx") or 0:]
+    elif circuit_ex_ids:
+        exercise_ids = circuit_ex_ids
+    else:
+        await callback.answer("Нет активного блока упражнений.")
+        return
+
+    try:
+        copied = await orm_copy_previous_sets(session, exercise_ids, data.get("training_session_id"),
+                                              callback.from_user.id)
+    except Exception as e:
+        await callback.answer()
+        await send_error_message(callback.message, e)
+        await state.clear()
+        return
+
+    if not copied:
+        await callback.answer("Нет результатов прошлой тренировки для повтора.", show_alert=True)
+        return
+    await callback.answer(f"Записано подходов: {copied}")
+
+    if repeat_exercise:
+        ex_obj = await orm_get_exercise(session, exercise_ids[0])
+        await state.update_data(set_index=ex_obj.base_sets if ex_obj else 3)
+        await process_standard_after_set(callback.message, state, session)
+    else:
+        await move_to_next_block_in_day(callback.message, state, session)
+
+
 @user_private_router.message(TrainingProcess.weight)
 async def process_weight_input(
         message: types.Message, state: FSMContext):
@@ -1725,6 +1898,7 @@ async def accept_results(message: types.Message, state: FSMContext, session: Asy
                 "weight": data["weight"],
                 "repetitions": reps,
                 "training_session_id": training_session_id,
+                "user_id": message.from_user.id,
             }
             await orm_add_set(session, set_data)
             await message.bot.delete_message(message.chat.id, data["accept_message_id"])
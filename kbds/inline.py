@@ -5,6 +5,7 @@ from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from utils.callback_codec import CallbackTemplate, CompactCallbackCodec
 from utils.separator import get_action_part
 from utils.temporary_storage import store_data_temporarily
 
@@ -38,6 +39,39 @@ class MenuCallBack(CallbackData, prefix="menu"):
     session_number: str | None = None
     exercises_page: int = 1
 
+    def pack(self) -> str:
+        return MENU_CODEC.pack(self)
+
+    @classmethod
+    def unpack(cls, value: str) -> "MenuCallBack":
+        # Старые кнопки в уже отправленных сообщениях имеют формат "menu:..."
+        if value.startswith(MENU_CODEC.marker):
+            return MENU_CODEC.unpack(value)
+        return super().unpack(value)
+
+    @classmethod
+    def template(cls, **fixed) -> CallbackTemplate:
+        """
+        Шаблон для однотипных кнопок: постоянные поля упаковываются один раз,
+        в цикле подставляются только меняющиеся (exercise_id, category_id ...)
+        """
+        return MENU_CODEC.template(**fixed)
+
+
+# Таблица известных действий кодека: новые значения добавлять только в конец,
+# иначе разъедутся кнопки в уже отправленных сообщениях
+MENU_ACTIONS = (
+    "main", "program", "profile", "schedule", "month_schedule", "t_day", "training_process",
+    "trd_sts", "n_t", "p_t", "t_d", "n_d", "p_d", "show_program", "training_day", "prg_stg",
+    "turn_on_prgm", "turn_off_prgm", "to_del_prgm", "prgm_del", "edit_trd", "edit_excs", "to_edit",
+    "del", "del_custom", "mv_up", "mv_down", "ex_stg", "ctgs", "ctg", "start_circle", "end_circle",
+    "add_ex", "add_ex_custom", "custom_excs", "add_u_excs", "change_u_excs", "finish_training",
+    "➕_1_sets", "➖_1_sets", "➕_1_reps", "➖_1_reps", "settings", "prgm_clone", "prgm_share",
+    "progress", "progress_ex",
+)
+
+MENU_CODEC = CompactCallbackCodec(MenuCallBack, marker="m:", known_strings=MENU_ACTIONS)
+
 
 def error_btns() -> InlineKeyboardMarkup:
     """
@@ -128,15 +162,75 @@ def get_profile_btns(
 
     stats_button = InlineKeyboardButton(text="📊 Результаты", callback_data=stats_callback)
 
+    progress_button = InlineKeyboardButton(
+        text="📈 Прогресс", callback_data=MenuCallBack(level=level + 1, action='progress').pack()
+    )
+
     # settings_button = InlineKeyboardButton(text="⚙️ Настройки профиля", callback_data=settings_callback)
 
     back_button = InlineKeyboardButton(text="⬅️ Назад", callback_data=back_callback)
 
-    keyboard.row(stats_button)
+    keyboard.row(stats_button, progress_button)
     keyboard.row(back_button)
     return keyboard.as_markup()
 
 
+def get_progress_btns(
+        *,
+        level: int,
+        page: int,
+        exercises: list,
+        pagination_btns: dict,
+) -> InlineKeyboardMarkup:
+    """
+    Список упражнений для графиков прогресса
+    :param exercises: database.stats.ExerciseStats текущей страницы
+    """
+    keyboard = InlineKeyboardBuilder()
+    exercise_template = MenuCallBack.template(level=level + 1, action='progress_ex', page=page)
+    for exercise in exercises:
+        keyboard.row(
+            InlineKeyboardButton(
+                text=f"{exercise.name} — {exercise.best_1rm:.0f} кг",
+                callback_data=exercise_template.pack(exercise_id=exercise.key)
+            )
+        )
+
+    row = []
+    for text, act in pagination_btns.items():
+        new_page = page + 1 if act.startswith("n") else page - 1
+        row.append(
+            InlineKeyboardButton(
+                text=text,
+                callback_data=MenuCallBack(level=level, action='progress', page=new_page).pack()
+            )
+        )
+    if row:
+        keyboard.row(*row)
+
+    keyboard.row(
+        InlineKeyboardButton(
+            text="⬅️ Назад (Профиль)",
+            callback_data=MenuCallBack(level=level - 1, action='profile').pack()
+        )
+    )
+    return keyboard.as_markup()
+
+
+def get_progress_chart_btns(*, level: int, page: int) -> InlineKeyboardMarkup:
+    """
+    Кнопка возврата из графика к списку упражнений
+    """
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(
+        InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=MenuCallBack(level=level - 1, action='progress', page=page).pack()
+        )
+    )
+    return keyboard.as_markup()
+
+
 def get_sessions_results_btns(
         *,
         level: int,
@@ -154,6 +248,7 @@ def get_sessions_results_btns(
     keyboard = InlineKeyboardBuilder()
 
     # Для каждой TrainingSession создаём кнопку
+    session_template = MenuCallBack.template(level=level + 1, page=page, action='t_d')
     for sess in sessions:
         storage_key = store_data_temporarily(str(sess.id))
         # Отображаем только дату (без времени):
@@ -163,12 +258,7 @@ def get_sessions_results_btns(
         keyboard.row(
             InlineKeyboardButton(
                 text=btn_text,
-                callback_data=MenuCallBack(
-                    level=level + 1,
-                    page=page,
-                    action='t_d',
-                    session_number=storage_key
-                ).pack()
+                callback_data=session_template.pack(session_number=storage_key)
             )
         )
 
@@ -253,12 +343,17 @@ def get_schedule_btns(
         training_day_id: int | None = None,
         first_exercise_id: int | None = None,
         active_program: int | None = None,
-        day_of_week_to_id: dict[str, int] | None = None
+        day_of_week_to_id: dict[str, int] | None = None,
+        trained_days: frozenset[int] = frozenset(),
+        planned_day_ids: set[int] | None = None,
 ) -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру для отображения расписания.
     В зависимости от action, может быть свернутый или развернутый вид.
     При наличии active_program формируется календарь, иначе – кнопка добавить программу.
+    В календаре отмечаются дни с тренировками (trained_days - номера дней месяца) и
+    предстоящие дни, в которых по программе есть упражнения (planned_day_ids - id тренировочных дней).
+    Развернутый календарь листается по месяцам.
     """
     keyboard = InlineKeyboardBuilder()
     if active_program:
@@ -304,11 +399,26 @@ def get_schedule_btns(
             weeks_to_process = None
         else:
             # month_schedule или другой режим
-            keyboard.row(month_header)
+            prev_year, prev_month = divmod(year * 12 + month - 2, 12)
+            next_year, next_month = divmod(year * 12 + month, 12)
+            keyboard.row(
+                InlineKeyboardButton(
+                    text="◀️",
+                    callback_data=MenuCallBack(level=level, action='month_schedule',
+                                               year=prev_year, month=prev_month + 1).pack()
+                ),
+                month_header,
+                InlineKeyboardButton(
+                    text="▶️",
+                    callback_data=MenuCallBack(level=level, action='month_schedule',
+                                               year=next_year, month=next_month + 1).pack()
+                ),
+            )
             keyboard.row(*weekday_buttons)
             weeks_to_process = calendar_days
 
         if weeks_to_process:
+            day_template = MenuCallBack.template(level=level, action='t_day')
             for week in weeks_to_process:
                 week_buttons = []
                 for day in week:
@@ -319,19 +429,22 @@ def get_schedule_btns(
                         continue
 
                     day_date = date(year, month, day)
-                    day_name = '🔘' if day_date == today else str(day)
                     day_of_week_index = day_date.weekday()
                     day_of_week_ru = WEEK_DAYS_RU_FULL[day_of_week_index].strip().lower()
 
                     day_training_day_id = day_of_week_to_id.get(day_of_week_ru)
+                    if day in trained_days:
+                        day_name = '✅'
+                    elif day_date == today:
+                        day_name = '🔘'
+                    elif day_date > today and planned_day_ids and day_training_day_id in planned_day_ids:
+                        day_name = f'•{day}'
+                    else:
+                        day_name = str(day)
                     if day_training_day_id is None:
                         callback_data = NO_TRAINING_DAY
                     else:
-                        callback_data = MenuCallBack(
-                            level=level,
-                            action='t_day',
-                            training_day_id=day_training_day_id
-                        ).pack()
+                        callback_data = day_template.pack(training_day_id=day_training_day_id)
 
                     week_buttons.append(
                         InlineKeyboardButton(
@@ -434,6 +547,22 @@ def get_training_process_btns(*, level: int, training_day_id: int) -> InlineKeyb
     return keyboard.as_markup()
 
 
+REPEAT_LAST_EXERCISE = "repeat_last_ex"
+REPEAT_LAST_BLOCK = "repeat_last_block"
+
+
+def get_repeat_last_btns(*, with_exercise: bool = True) -> InlineKeyboardMarkup:
+    """
+    Кнопки повтора результатов прошлой тренировки под сообщением ввода подхода.
+    В круговом блоке доступен только повтор всего блока
+    """
+    keyboard = InlineKeyboardBuilder()
+    if with_exercise:
+        keyboard.row(InlineKeyboardButton(text="🔁 Как в прошлый раз: упражнение", callback_data=REPEAT_LAST_EXERCISE))
+    keyboard.row(InlineKeyboardButton(text="⏩ Как в прошлый раз: весь блок", callback_data=REPEAT_LAST_BLOCK))
+    return keyboard.as_markup()
+
+
 def get_program_btns(*, level: int, sizes: tuple[int] = (2, 1), user_program_id: int) -> InlineKeyboardMarkup:
     """
     Возвращает клавиатуру настроек программы.
@@ -472,6 +601,7 @@ def get_program_stgs_btns(
     Возвращает клавиатуру настроек конкретной программы:
     - Подтверждение удаления программы
     - Включение/отключение программы
+    - Копирование программы и ссылка, чтобы поделиться ею
     """
     keyboard = InlineKeyboardBuilder()
     if action.startswith("to_del_prgm"):
@@ -516,6 +646,18 @@ def get_program_stgs_btns(
                     callback_data=MenuCallBack(level=level, action="turn_on_prgm", program_id=user_program_id).pack()
                 )
             )
+        keyboard.add(
+            InlineKeyboardButton(
+                text="📄 Копировать программу",
+                callback_data=MenuCallBack(level=level - 2, action="prgm_clone", program_id=user_program_id).pack()
+            )
+        )
+        keyboard.add(
+            InlineKeyboardButton(
+                text="🔗 Поделиться программой",
+                callback_data=MenuCallBack(level=level, action="prgm_share", program_id=user_program_id).pack()
+            )
+        )
     return keyboard.adjust(*sizes).as_markup()
 
 
@@ -726,26 +868,16 @@ def get_category_btns(
         ).pack()
     button = InlineKeyboardButton(text=f"{user_name} ({len_custom})", callback_data=custom_exercise)
     keyboard.add(button)
+    category_template = MenuCallBack.template(
+        action="shd/ctg" if action.startswith("shd/") else "ctg",
+        level=level + 1,
+        training_day_id=training_day_id,
+        program_id=program_id,
+        page=page,
+        circle_training=circle_training,
+    )
     for category, count in categories:
-        callback = MenuCallBack(
-            action=f"ctg",
-            level=level + 1,
-            category_id=category.id,
-            training_day_id=training_day_id,
-            program_id=program_id,
-            page=page,
-            circle_training=circle_training,
-        ).pack()
-        if action.startswith("shd/"):
-            callback = MenuCallBack(
-                action=f"shd/ctg",
-                level=level + 1,
-                category_id=category.id,
-                training_day_id=training_day_id,
-                program_id=program_id,
-                page=page,
-                circle_training=circle_training,
-            ).pack()
+        callback = category_template.pack(category_id=category.id)
         button_text = f"{category.name} ({count})"
         button = InlineKeyboardButton(text=button_text, callback_data=callback)
         keyboard.add(button)
@@ -846,116 +978,39 @@ def get_category_exercise_btns(
         ).pack()
     start_button = InlineKeyboardButton(text="🔴 Круговая тренировка", callback_data=start_callback)
     end_button = InlineKeyboardButton(text="🟢 Круговая тренировка", callback_data=end_callback)
-    if not empty:
-        if action.startswith("add_"):
-            action = action.split("_", 1)[-1]
-        if user_exercises:
-            for exercise in user_exercises:
-                callback = MenuCallBack(
-                    action="add_ex_custom",
-                    level=level,
-                    exercise_id=exercise.id,
-                    category_id=exercise.category_id,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                    page=page,
-                    circle_training=circle_training,
-                ).pack()
-                if action.startswith("shd/"):
-                    callback = MenuCallBack(
-                        action=f"shd/add_ex_custom",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=exercise.category_id,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        page=page,
-                        circle_training=circle_training,
-                    ).pack()
-                button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
-                keyboard.add(button)
-        if template_exercises:
-            for exercise in template_exercises:
-                callback = MenuCallBack(
-                    action="add_ex",
-                    level=level,
-                    exercise_id=exercise.id,
-                    category_id=exercise.category_id,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                    page=page,
-                    circle_training=circle_training,
-                ).pack()
-                if action.startswith("shd/"):
-                    callback = MenuCallBack(
-                        action=f"shd/add_ex",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=exercise.category_id,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        page=page,
-                        circle_training=circle_training,
-                    ).pack()
-                button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
-                keyboard.row(button)
-    else:
-        if action.startswith("add_"):
-            action = action.split("_", 1)[-1]
-        if user_exercises:
-            for exercise in user_exercises:
-                callback = MenuCallBack(
-                    action="add_ex_custom",
-                    level=level,
-                    exercise_id=exercise.id,
-                    category_id=exercise.category_id,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                    page=page,
-                    empty=True,
-                    circle_training=circle_training,
-                ).pack()
-                if action.startswith("shd/"):
-                    callback = MenuCallBack(
-                        action=f"shd/add_ex_custom",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=exercise.category_id,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        page=page,
-                        empty=True,
-                        circle_training=circle_training,
-                    ).pack()
-                button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
-                keyboard.row(button)
-        if template_exercises:
-            for exercise in template_exercises:
-                callback = MenuCallBack(
-                    action="add_ex",
-                    level=level,
-                    exercise_id=exercise.id,
-                    category_id=exercise.category_id,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                    page=page,
-                    empty=True,
-                    circle_training=circle_training,
-                ).pack()
-                if action.startswith("shd/"):
-                    callback = MenuCallBack(
-                        action=f"shd/add_ex",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=exercise.category_id,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        page=page,
-                        empty=True,
-                        circle_training=circle_training,
-                    ).pack()
-                button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
-                keyboard.row(button)
+    if action.startswith("add_"):
+        action = action.split("_", 1)[-1]
+    prefix = "shd/" if action.startswith("shd/") else ""
+    # В пустой категории (свои упражнения) все кнопки идут по одной в ряд
+    custom_template = MenuCallBack.template(
+        action=f"{prefix}add_ex_custom",
+        level=level,
+        training_day_id=training_day_id,
+        program_id=program_id,
+        page=page,
+        empty=empty,
+        circle_training=circle_training,
+    )
+    admin_template = MenuCallBack.template(
+        action=f"{prefix}add_ex",
+        level=level,
+        training_day_id=training_day_id,
+        program_id=program_id,
+        page=page,
+        empty=empty,
+        circle_training=circle_training,
+    )
+    for exercise in user_exercises or ():
+        callback = custom_template.pack(exercise_id=exercise.id, category_id=exercise.category_id)
+        button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
+        if empty:
+            keyboard.row(button)
+        else:
+            keyboard.add(button)
+    for exercise in template_exercises or ():
+        callback = admin_template.pack(exercise_id=exercise.id, category_id=exercise.category_id)
+        button = InlineKeyboardButton(text=f"➕ {exercise.name}", callback_data=callback)
+        keyboard.row(button)
 
     delete_callback = MenuCallBack(
         action="del",
@@ -1058,6 +1113,16 @@ def get_custom_exercise_btns(
     keyboard = InlineKeyboardBuilder()
 
     if get_action_part(action) == "to_edit":
+        to_edit_template = MenuCallBack.template(
+            action="shd/to_edit" if action.startswith("shd/") else "to_edit",
+            level=level,
+            page=page,
+            training_day_id=training_day_id,
+            program_id=program_id,
+            category_id=category_id,
+            empty=empty,
+            circle_training=circle_training,
+        )
         for exercise in user_exercises:
             if exercise.circle_training:
                 marker = "🔄"
@@ -1066,33 +1131,8 @@ def get_custom_exercise_btns(
             button_text = f"👉 {marker + exercise.name}" if exercise_id == exercise.id else f"{marker + exercise.name}"
             exercise_button = InlineKeyboardButton(
                 text=button_text,
-                callback_data=MenuCallBack(
-                    action="to_edit",
-                    level=level,
-                    exercise_id=exercise.id,
-                    page=page,
-                    training_day_id=training_day_id,
-                    category_id=category_id,
-                    program_id=program_id,
-                    empty=empty,
-                    circle_training=circle_training,
-                ).pack()
+                callback_data=to_edit_template.pack(exercise_id=exercise.id)
             )
-            if action.startswith("shd/"):
-                exercise_button = InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=MenuCallBack(
-                        action="shd/to_edit",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=category_id,
-                        page=page,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        empty=empty,
-                        circle_training=circle_training,
-                    ).pack()
-                )
             keyboard.row(exercise_button)
 
         if exercise_id is not None:
@@ -1213,40 +1253,26 @@ def get_custom_exercise_btns(
             add_button = InlineKeyboardButton(text="➕ Добавить упражнение", callback_data=custom_exercises)
             keyboard.row(back_button, add_button)
     else:
+        to_edit_template = MenuCallBack.template(
+            action="shd/to_edit" if action.startswith("shd/") else "to_edit",
+            level=level,
+            page=page,
+            training_day_id=training_day_id,
+            program_id=program_id,
+            category_id=category_id,
+            empty=empty,
+            circle_training=circle_training,
+        )
         for exercise in user_exercises:
             if exercise.circle_training:
                 marker = "🔄"
             else:
                 marker = "🔘"
+            button_text = f"{marker + exercise.name}"
             exercise_button = InlineKeyboardButton(
-                text=f"{marker + exercise.name}",
-                callback_data=MenuCallBack(
-                    action="to_edit",
-                    level=level,
-                    exercise_id=exercise.id,
-                    category_id=category_id,
-                    page=page,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                    empty=empty,
-                    circle_training=circle_training,
-                ).pack()
+                text=button_text,
+                callback_data=to_edit_template.pack(exercise_id=exercise.id)
             )
-            if action.startswith("shd/"):
-                exercise_button = InlineKeyboardButton(
-                    text=f"{marker + exercise.name}",
-                    callback_data=MenuCallBack(
-                        action="shd/to_edit",
-                        level=level,
-                        exercise_id=exercise.id,
-                        category_id=category_id,
-                        page=page,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                        empty=empty,
-                        circle_training=circle_training,
-                    ).pack()
-                )
             keyboard.row(exercise_button)
 
         back_callback = MenuCallBack(
@@ -1315,6 +1341,13 @@ def get_edit_exercise_btns(
     keyboard = InlineKeyboardBuilder()
 
     if get_action_part(action) == "to_edit":
+        to_edit_template = MenuCallBack.template(
+            action="shd/to_edit" if action.startswith("shd/") else "to_edit",
+            level=level,
+            page=page,
+            training_day_id=training_day_id,
+            program_id=program_id,
+        )
         for exercise in user_exercises:
             if exercise.circle_training:
                 marker = "🔄"
@@ -1323,27 +1356,8 @@ def get_edit_exercise_btns(
             button_text = f"👉 {marker + exercise.name}" if exercise_id == exercise.id else f"{marker + exercise.name}"
             exercise_button = InlineKeyboardButton(
                 text=button_text,
-                callback_data=MenuCallBack(
-                    action="to_edit",
-                    level=level,
-                    exercise_id=exercise.id,
-                    page=page,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                ).pack()
+                callback_data=to_edit_template.pack(exercise_id=exercise.id)
             )
-            if action.startswith("shd/"):
-                exercise_button = InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=MenuCallBack(
-                        action="shd/to_edit",
-                        level=level,
-                        exercise_id=exercise.id,
-                        page=page,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                    ).pack()
-                )
             keyboard.row(exercise_button)
 
         if exercise_id is not None:
@@ -1463,34 +1477,23 @@ def get_edit_exercise_btns(
             back_button = InlineKeyboardButton(text="⬅️ Назад", callback_data=back_callback)
             keyboard.row(back_button)
     else:
+        to_edit_template = MenuCallBack.template(
+            action="shd/to_edit" if action.startswith("shd/") else "to_edit",
+            level=level,
+            page=page,
+            training_day_id=training_day_id,
+            program_id=program_id,
+        )
         for exercise in user_exercises:
             if exercise.circle_training:
                 marker = "🔄"
             else:
                 marker = "🔘"
+            button_text = f"{marker + exercise.name}"
             exercise_button = InlineKeyboardButton(
-                text=f"{marker + exercise.name}",
-                callback_data=MenuCallBack(
-                    action="to_edit",
-                    level=level,
-                    exercise_id=exercise.id,
-                    page=page,
-                    training_day_id=training_day_id,
-                    program_id=program_id,
-                ).pack()
+                text=button_text,
+                callback_data=to_edit_template.pack(exercise_id=exercise.id)
             )
-            if action.startswith("shd/"):
-                exercise_button = InlineKeyboardButton(
-                    text=f"{marker + exercise.name}",
-                    callback_data=MenuCallBack(
-                        action="shd/to_edit",
-                        level=level,
-                        exercise_id=exercise.id,
-                        page=page,
-                        training_day_id=training_day_id,
-                        program_id=program_id,
-                    ).pack()
-                )
             keyboard.row(exercise_button)
 
         # Определяем путь (origin) на основе action
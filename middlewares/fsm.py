@@ -0,0 +1,108 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import TelegramObject
+
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSMContext с единицей работы на одно обновление: данные читаются из хранилища один раз,
+    get_data/update_data работают с копией в памяти, а изменения записываются одной операцией
+    в flush() (автоматически в конце обновления, см. FSMUnitOfWork).
+    Состояние (set_state/get_state) не буферизуется
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey) -> None:
+        super().__init__(storage=storage, key=key)
+        self._data: Optional[Dict[str, Any]] = None
+        self._changed: set[str] = set()
+        self._replaced = False
+
+    async def _load(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = dict(await self.storage.get_data(key=self.key))
+        return self._data
+
+    async def get_data(self) -> Dict[str, Any]:
+        return dict(await self._load())
+
+    async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        return (await self._load()).get(key, default)
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        current = await self._load()
+        current.update(kwargs)
+        self._changed.update(kwargs)
+        return dict(current)
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = dict(data)
+        self._changed.clear()
+        self._replaced = True
+
+    async def flush(self) -> None:
+        """
+        Записывает накопленные изменения. Если данные заменялись целиком (set_data/clear) -
+        записывается весь словарь, иначе только измененные ключи поверх актуальных данных хранилища,
+        чтобы не затереть то, что за это время записали другие обновления
+        """
+        if self._replaced:
+            await self.storage.set_data(key=self.key, data=self._data)
+        elif self._changed:
+            await self.storage.update_data(key=self.key, data={name: self._data[name] for name in self._changed})
+        self._changed.clear()
+        self._replaced = False
+
+    async def refresh(self) -> Dict[str, Any]:
+        """
+        Записывает свои изменения и перечитывает данные, измененные другими обновлениями
+        (нужно при длительном ожидании внутри обработчика)
+        :return: актуальные данные
+        """
+        await self.flush()
+        self._data = None
+        return await self.get_data()
+
+
+async def flush_state(state: FSMContext) -> None:
+    """
+    Принудительно записывает данные FSM (перед долгим ожиданием или когда их должно увидеть
+    параллельное обновление)
+    """
+    if isinstance(state, BufferedFSMContext):
+        await state.flush()
+
+
+async def refresh_state(state: FSMContext) -> Dict[str, Any]:
+    """
+    Возвращает свежие данные FSM с учетом записей других обновлений
+    """
+    if isinstance(state, BufferedFSMContext):
+        return await state.refresh()
+    return await state.get_data()
+
+
+class FSMUnitOfWork(BaseMiddleware):
+    """
+    Подменяет state на BufferedFSMContext и записывает изменения данных в конце обновления
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        state = data.get("state")
+        if state is None:
+            return await handler(event, data)
+        buffered = BufferedFSMContext(storage=state.storage, key=state.key)
+        data["state"] = buffered
+        try:
+            return await handler(event, data)
+        finally:
+            await buffered.flush()
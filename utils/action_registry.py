@@ -0,0 +1,104 @@
+import os
+from typing import Callable, Hashable
+
+from utils.callback_codec import ROUTE_PREFIX
+
+# Сколько разрешенных пар (уровень, действие) помнить; действия - это тексты кнопок, их набор почти постоянен
+RESOLVE_CACHE_SIZE = int(os.getenv("RESOLVE_CACHE_SIZE", 4096))
+
+_MISSING = object()
+
+
+class ActionRegistry:
+    """
+    Таблица маршрутов (уровень, действие) -> обработчик.
+
+    Точные действия ищутся одним обращением к словарю, префиксные (например "➕_1_sets",
+    "to_del_prgm") - по срезам известных длин префиксов этого уровня, самый длинный префикс
+    побеждает. Префикс пути "shd/" снимается автоматически, поэтому варианты из расписания
+    регистрировать отдельно не нужно. Результаты поиска запоминаются, так что повторное действие
+    обходится одним обращением к словарю.
+    """
+
+    def __init__(self):
+        self._exact: dict[tuple[Hashable, str], Callable] = {}
+        self._prefix: dict[tuple[Hashable, str], Callable] = {}
+        self._prefix_lengths: dict[Hashable, tuple[int, ...]] = {}
+        self._default: dict[Hashable, Callable] = {}
+        self._resolved: dict[tuple[Hashable, str], Callable | None] = {}
+
+    def add(self, level: Hashable, handler: Callable, *, actions: tuple[str, ...] = (),
+            prefixes: tuple[str, ...] = (), default: bool = False) -> Callable:
+        """
+        Регистрирует обработчик
+        :param level: уровень меню (или любой другой ключ группы)
+        :param handler: обработчик
+        :param actions: точные названия действий
+        :param prefixes: префиксы действий
+        :param default: обработчик уровня по умолчанию
+        :return: handler
+        """
+        for action in actions:
+            self._exact[(level, action)] = handler
+        for prefix in prefixes:
+            self._prefix[(level, prefix)] = handler
+        if prefixes:
+            lengths = set(self._prefix_lengths.get(level, ())) | {len(p) for p in prefixes}
+            self._prefix_lengths[level] = tuple(sorted(lengths, reverse=True))
+        if default:
+            self._default[level] = handler
+        self._resolved.clear()
+        return handler
+
+    def register(self, level: Hashable, *actions: str, prefixes: tuple[str, ...] = (),
+                 default: bool = False) -> Callable[[Callable], Callable]:
+        """
+        Декоратор-обертка над add()
+        """
+
+        def decorator(handler: Callable) -> Callable:
+            return self.add(level, handler, actions=actions, prefixes=prefixes, default=default)
+
+        return decorator
+
+    def resolve(self, level: Hashable, action: str) -> Callable | None:
+        """
+        Находит обработчик для действия. Возвращает None, если ничего не подошло
+        :param level:
+        :param action: название действия (с префиксом "shd/" или без)
+        :return:
+        """
+        handler = self._resolved.get((level, action), _MISSING)
+        if handler is not _MISSING:
+            return handler
+        handler = self._lookup(level, action)
+        if len(self._resolved) >= RESOLVE_CACHE_SIZE:
+            self._resolved.clear()
+        self._resolved[(level, action)] = handler
+        return handler
+
+    def _lookup(self, level: Hashable, action: str) -> Callable | None:
+        # Самый частый случай - точное действие без "shd/": одно обращение к словарю без разбора строки
+        handler = self._exact.get((level, action))
+        if handler is not None:
+            return handler
+        if action.startswith(ROUTE_PREFIX):
+            action = action[len(ROUTE_PREFIX):]
+            handler = self._exact.get((level, action))
+            if handler is not None:
+                return handler
+        lengths = self._prefix_lengths.get(level)
+        if lengths:
+            prefixes = self._prefix
+            for length in lengths:
+                handler = prefixes.get((level, action[:length]))
+                if handler is not None:
+                    return handler
+        return self._default.get(level)
+
+    def routes(self) -> list[tuple[Hashable, str, str]]:
+        """
+        Все зарегистрированные точные действия и префиксы (для отладки и бенчмарков)
+        """
+        return [(level, action, "exact") for level, action in self._exact] + \
+            [(level, prefix, "prefix") for level, prefix in self._prefix]
@@ -0,0 +1,219 @@
+import base64
+import binascii
+import types
+import typing
+
+from pydantic_core import PydanticUndefined
+
+MAX_CALLBACK_LENGTH = 64
+ROUTE_PREFIX = "shd/"
+
+_INT, _BOOL, _STR = 0, 1, 2
+
+
+def _write_varint(buf: bytearray, value: int) -> None:
+    while value > 0x7F:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _field_kind(annotation) -> int:
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    if annotation is bool:
+        return _BOOL
+    if annotation is int:
+        return _INT
+    if annotation is str:
+        return _STR
+    raise TypeError(f"Неподдерживаемый тип поля: {annotation}")
+
+
+class CompactCallbackCodec:
+    """
+    Компактная позиционная упаковка CallbackData.
+
+    Формат: маркер + base64url(битовая маска непустых полей + значения).
+    Поля со значением по умолчанию не передаются вовсе, bool хранится только битом маски,
+    int - zigzag varint, строки - индексом в таблице известных действий
+    (с флагом префикса "shd/") либо длиной и UTF-8 байтами.
+    """
+
+    def __init__(self, model, marker: str, known_strings: tuple[str, ...] = ()):
+        self.model = model
+        self.marker = marker
+        self.known_strings = known_strings
+        self._string_codes = {value: index for index, value in enumerate(known_strings)}
+        self.fields = []
+        for name, field in model.model_fields.items():
+            default = field.default
+            required = default is PydanticUndefined
+            self.fields.append((name, _field_kind(field.annotation), None if required else default, required))
+        # Значения по умолчанию всех необязательных полей: unpack() лишь копирует их и дополняет
+        # переданными полями, не вызывая model_construct() с его разбором полей на каждое нажатие
+        self._defaults = {name: default for name, _, default, required in self.fields if not required}
+        self._required_mask = sum(1 << index for index, (*_, required) in enumerate(self.fields) if required)
+        self._direct_construct = not model.__private_attributes__
+
+    def _encode_str(self, buf: bytearray, value: str) -> None:
+        routed = value.startswith(ROUTE_PREFIX)
+        if routed:
+            value = value[len(ROUTE_PREFIX):]
+        code = self._string_codes.get(value)
+        if code is not None:
+            _write_varint(buf, (code << 2) | (routed << 1))
+        else:
+            raw = value.encode()
+            _write_varint(buf, (len(raw) << 2) | (routed << 1) | 1)
+            buf += raw
+
+    def _decode_str(self, data: bytes, pos: int) -> tuple[str, int]:
+        tag = data[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _read_varint(data, pos)
+        prefix = ROUTE_PREFIX if tag & 2 else ""
+        if tag & 1:
+            length = tag >> 2
+            raw = data[pos:pos + length]
+            if len(raw) != length:
+                raise ValueError("Обрезанная строка в callback_data")
+            return prefix + raw.decode(), pos + length
+        return prefix + self.known_strings[tag >> 2], pos
+
+    def _encode_field(self, kind: int, value) -> bytes:
+        buf = bytearray()
+        if kind == _INT:
+            _write_varint(buf, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif kind == _STR:
+            self._encode_str(buf, value)
+        return bytes(buf)
+
+    def _finish(self, mask: int, body: bytes) -> str:
+        head = bytearray()
+        _write_varint(head, mask)
+        packed = self.marker + base64.urlsafe_b64encode(bytes(head) + body).rstrip(b"=").decode()
+        if len(packed) > MAX_CALLBACK_LENGTH:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_LENGTH} байт: {packed!r}")
+        return packed
+
+    def pack(self, obj) -> str:
+        """
+        Упаковывает экземпляр модели в строку
+        """
+        mask = 0
+        body = bytearray()
+        for index, (name, kind, default, required) in enumerate(self.fields):
+            value = getattr(obj, name)
+            if value is None or (not required and value == default):
+                continue
+            mask |= 1 << index
+            if kind != _BOOL:
+                body += self._encode_field(kind, value)
+        return self._finish(mask, bytes(body))
+
+    def unpack(self, value: str):
+        """
+        Распаковывает строку обратно в модель без повторной валидации pydantic
+        """
+        if not value.startswith(self.marker):
+            raise ValueError("Чужой формат callback_data")
+        encoded = value[len(self.marker):]
+        try:
+            data = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+            mask, pos = _read_varint(data, 0)
+            if mask & self._required_mask != self._required_mask:
+                missing = next(name for index, (name, *_) in enumerate(self.fields)
+                               if self._required_mask & ~mask & (1 << index))
+                raise ValueError(f"Нет обязательного поля {missing}")
+            fields = self.fields
+            payload = {}
+            # Обходим только переданные поля: младший установленный бит маски за шаг
+            rest = mask
+            while rest:
+                low = rest & -rest
+                rest ^= low
+                name, kind, default, _ = fields[low.bit_length() - 1]
+                if kind == _BOOL:
+                    payload[name] = not default
+                elif kind == _INT:
+                    raw = data[pos]
+                    if raw < 0x80:
+                        pos += 1
+                    else:
+                        raw, pos = _read_varint(data, pos)
+                    payload[name] = (raw >> 1) ^ -(raw & 1)
+                else:
+                    payload[name], pos = self._decode_str(data, pos)
+        except (binascii.Error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Повреждённые callback_data: {e}") from e
+        if pos != len(data):
+            raise ValueError("Лишние байты в callback_data")
+        if not self._direct_construct:
+            return self.model.model_construct(**payload)
+        # То же, что делает model_construct(), но с заранее собранными значениями по умолчанию
+        obj = self.model.__new__(self.model)
+        values = self._defaults.copy()
+        values.update(payload)
+        object.__setattr__(obj, "__dict__", values)
+        object.__setattr__(obj, "__pydantic_fields_set__", set(payload))
+        object.__setattr__(obj, "__pydantic_extra__", None)
+        object.__setattr__(obj, "__pydantic_private__", None)
+        return obj
+
+    def template(self, **fixed) -> "CallbackTemplate":
+        """
+        Заготовка для однотипных кнопок: постоянные поля кодируются один раз
+        """
+        return CallbackTemplate(self, fixed)
+
+
+class CallbackTemplate:
+    """
+    Предупакованный шаблон callback_data. pack() подставляет только меняющиеся поля
+    (например exercise_id), минуя создание и валидацию модели.
+    """
+
+    def __init__(self, codec: CompactCallbackCodec, fixed: dict):
+        unknown = set(fixed) - {name for name, *_ in codec.fields}
+        if unknown:
+            raise TypeError(f"Неизвестные поля шаблона: {', '.join(sorted(unknown))}")
+        self.codec = codec
+        self._slots = []
+        for index, (name, kind, default, required) in enumerate(codec.fields):
+            segment = None
+            if name in fixed:
+                value = fixed[name]
+                if value is not None and (required or value != default):
+                    segment = codec._encode_field(kind, value)
+            self._slots.append((index, name, kind, default, required, name in fixed, segment))
+
+    def pack(self, **values) -> str:
+        mask = 0
+        body = bytearray()
+        for index, name, kind, default, required, is_fixed, segment in self._slots:
+            if name in values:
+                value = values[name]
+                if value is None or (not required and value == default):
+                    continue
+                segment = self.codec._encode_field(kind, value)
+            elif segment is None:
+                if required and not is_fixed:
+                    raise ValueError(f"Не задано обязательное поле {name}")
+                continue
+            mask |= 1 << index
+            body += segment
+        return self.codec._finish(mask, bytes(body))
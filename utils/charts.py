@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+
+from utils.media import MEDIA_DIR
+
+# Процессов отрисовки графиков и сколько графиков может ждать отрисовки одновременно
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", 16))
+CHARTS_DIR = os.path.join(MEDIA_DIR, "charts")
+# TrueType-шрифт с кириллицей; без него - DejaVuSans из системы или встроенный шрифт Pillow
+CHART_FONT = os.getenv("CHART_FONT", "DejaVuSans.ttf")
+
+WIDTH, HEIGHT = 1000, 760
+MARGIN_LEFT, MARGIN_RIGHT = 90, 30
+BACKGROUND = (255, 255, 255)
+GRID = (228, 228, 232)
+AXIS = (120, 120, 130)
+TEXT = (40, 40, 48)
+WEIGHT_COLOR = (52, 120, 246)
+E1RM_COLOR = (255, 149, 0)
+VOLUME_COLOR = (52, 199, 89)
+
+_EPOCH = date(1970, 1, 1)
+
+
+class ChartQueueFull(Exception):
+    """
+    Очередь отрисовки заполнена, график нужно запросить позже
+    """
+
+
+@lru_cache(maxsize=8)
+def _font(size: int):
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(CHART_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def _nice_step(span: float, ticks: int = 5) -> float:
+    """
+    «Круглый» шаг сетки (1, 2, 2.5, 5 * 10^n), чтобы на оси было около ticks делений
+    """
+    raw = max(span, 1e-6) / ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 2.5, 5):
+        if raw <= factor * magnitude:
+            return factor * magnitude
+    return 10 * magnitude
+
+
+def _format_value(value: float) -> str:
+    return f"{value / 1000:.1f}т" if value >= 10_000 else f"{value:g}"
+
+
+class _Panel:
+    """
+    Область графика: пересчет (день, значение) в пиксели, сетка и подписи осей
+    """
+
+    def __init__(self, draw, top: int, bottom: int, days: tuple[int, int], values: tuple[float, float]):
+        self.draw = draw
+        self.top, self.bottom = top, bottom
+        self.left, self.right = MARGIN_LEFT, WIDTH - MARGIN_RIGHT
+        self.first_day, last_day = days
+        self.day_span = max(last_day - self.first_day, 1)
+        low, high = values
+        self.step = _nice_step(high - low)
+        self.low = max(0.0, (low // self.step) * self.step)
+        self.high = max(self.low + self.step, -(-high // self.step) * self.step)
+
+    def x(self, day: float) -> float:
+        return self.left + (day - self.first_day) / self.day_span * (self.right - self.left)
+
+    def y(self, value: float) -> float:
+        return self.bottom - (value - self.low) / (self.high - self.low) * (self.bottom - self.top)
+
+    def grid(self) -> None:
+        font = _font(16)
+        value = self.low
+        while value <= self.high + self.step / 2:
+            y = self.y(value)
+            self.draw.line((self.left, y, self.right, y), fill=GRID, width=1)
+            label = _format_value(round(value, 2))
+            width = self.draw.textlength(label, font=font)
+            self.draw.text((self.left - 10 - width, y - 9), label, fill=AXIS, font=font)
+            value += self.step
+        self.draw.line((self.left, self.bottom, self.right, self.bottom), fill=AXIS, width=2)
+
+    def date_labels(self, count: int = 5) -> None:
+        font = _font(16)
+        for i in range(count):
+            day = self.first_day + self.day_span * i / (count - 1)
+            label = (_EPOCH + timedelta(days=int(day))).strftime("%d.%m.%y")
+            width = self.draw.textlength(label, font=font)
+            x = min(max(self.x(day) - width / 2, self.left - width / 2), self.right - width)
+            self.draw.text((x, self.bottom + 8), label, fill=AXIS, font=font)
+
+    def polyline(self, days: list[int], values: list[float], color: tuple, width: int = 3) -> None:
+        points = [(self.x(day), self.y(value)) for day, value in zip(days, values)]
+        if len(points) > 1:
+            self.draw.line(points, fill=color, width=width, joint="curve")
+        if len(points) <= 60:
+            for x, y in points:
+                self.draw.ellipse((x - 4, y - 4, x + 4, y + 4), fill=color)
+
+
+def render_progress_chart(title: str, days: list[int], weights: list[float], e1rm: list[float],
+                          weeks: list[int], volume: list[float]) -> bytes:
+    """
+    Рисует график прогресса упражнения. Выполняется в процессе пула ChartRenderer
+    :param title: название упражнения
+    :param days: дни с подходами (дней от 1970-01-01)
+    :param weights: максимальный вес за день
+    :param e1rm: расчетный 1ПМ за день
+    :param weeks: понедельники недель
+    :param volume: объем (вес * повторения) за неделю
+    :return: PNG
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (WIDTH, HEIGHT), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    title = title if len(title) <= 48 else title[:47] + "…"
+    draw.text((MARGIN_LEFT, 18), title, fill=TEXT, font=_font(30))
+
+    span = (min(days[0], weeks[0]), max(days[-1], weeks[-1] + 6))
+    top = _Panel(draw, 110, 430, span, (min(weights), max(max(weights), max(e1rm))))
+    top.grid()
+    top.polyline(days, e1rm, E1RM_COLOR, width=2)
+    top.polyline(days, weights, WEIGHT_COLOR)
+    legend = _font(18)
+    x = MARGIN_LEFT
+    for label, color in (("Макс. вес, кг", WEIGHT_COLOR), ("Расчетный 1ПМ, кг", E1RM_COLOR)):
+        draw.rectangle((x, 72, x + 18, 90), fill=color)
+        draw.text((x + 26, 70), label, fill=TEXT, font=legend)
+        x += 52 + draw.textlength(label, font=legend)
+
+    bottom = _Panel(draw, 520, HEIGHT - 50, span, (0, max(volume)))
+    draw.rectangle((MARGIN_LEFT, 478, MARGIN_LEFT + 18, 496), fill=VOLUME_COLOR)
+    draw.text((MARGIN_LEFT + 26, 476), "Объем за неделю, кг", fill=TEXT, font=legend)
+    bottom.grid()
+    bar = max(2.0, (bottom.x(7) - bottom.x(0)) * 0.8)
+    for week, value in zip(weeks, volume):
+        if value > 0:
+            x = bottom.x(week + 3.5)
+            draw.rectangle((x - bar / 2, bottom.y(value), x + bar / 2, bottom.bottom), fill=VOLUME_COLOR)
+    bottom.date_labels()
+
+    out = io.BytesIO()
+    image.save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+class ChartRenderer:
+    """
+    Отрисовка графиков в пуле процессов, чтобы не занимать цикл asyncio.
+    Очередь ограничена: при CHART_QUEUE_SIZE ожидающих графиках новые запросы отклоняются
+    """
+
+    def __init__(self, workers: int = CHART_WORKERS, queue_size: int = CHART_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+        # Одинаковые графики, запрошенные одновременно, рисуются один раз
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def render(self, key: str, *args) -> bytes:
+        """
+        :param key: ключ графика (одинаковые ключи - одинаковые данные)
+        :param args: аргументы render_progress_chart
+        :return: PNG
+        :raises ChartQueueFull:
+        """
+        running = self._inflight.get(key)
+        if running is not None:
+            return await asyncio.shield(running)
+        if self._pending >= self.queue_size:
+            raise ChartQueueFull()
+        if self._executor is None:
+            # fork копировал бы процесс бота с потоками asyncio.to_thread и состоянием драйвера базы:
+            # блокировка, занятая другим потоком в момент fork, навсегда останется занятой в дочернем процессе
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(method))
+        self._pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, render_progress_chart, *args)
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._pending -= 1
+            self._inflight.pop(key, None)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logging.info("Пул отрисовки графиков остановлен")
+
+
+chart_renderer = ChartRenderer()
+
+
+def chart_path(user_id: int, exercise_key: int, version) -> str:
+    """
+    Файл графика: один на (пользователь, упражнение, версия данных)
+    """
+    digest = hashlib.sha1(f"{user_id}:{exercise_key}:{version}".encode()).hexdigest()[:16]
+    return os.path.join(CHARTS_DIR, f"{user_id}_{exercise_key}_{digest}.png")
+
+
+def _save_chart(path: str, data: bytes) -> list[str]:
+    """
+    Сохраняет график и удаляет графики этого упражнения с устаревшими данными
+    :return: пути удаленных файлов
+    """
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    prefix = os.path.basename(path).rsplit("_", 1)[0] + "_"
+    removed = []
+    for name in os.listdir(CHARTS_DIR):
+        old = os.path.join(CHARTS_DIR, name)
+        if name.startswith(prefix) and name.endswith(".png") and old != path:
+            try:
+                os.remove(old)
+                removed.append(old)
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+async def get_progress_chart(user_id: int, exercise_key: int, version, *args) -> tuple[str, list[str]]:
+    """
+    Файл графика прогресса; рисуется, только если для этой версии данных его еще нет
+    :param user_id: Telegram ID
+    :param exercise_key: упражнение (см. database.stats.SetHistory)
+    :param version: версия данных пользователя
+    :param args: аргументы render_progress_chart
+    :return: путь к PNG и пути удаленных устаревших графиков
+    :raises ChartQueueFull:
+    """
+    path = chart_path(user_id, exercise_key, version)
+    if os.path.exists(path):
+        return path, []
+    data = await chart_renderer.render(path, *args)
+    return path, await asyncio.to_thread(_save_chart, path, data)
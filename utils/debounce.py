@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Hashable
+
+DEBOUNCE_DELAY = float(os.getenv("DEBOUNCE_DELAY", 0.8))
+
+
+class _Pending:
+    __slots__ = ("value", "apply", "task")
+
+    def __init__(self, value: Any, apply: Callable[[Any, bool], Awaitable[None]]):
+        self.value = value
+        self.apply = apply
+        self.task: asyncio.Task | None = None
+
+
+class Debouncer:
+    """
+    Объединяет частые изменения одного значения: первое изменение открывает окно DEBOUNCE_DELAY,
+    последующие лишь обновляют итоговое значение, а по окончании окна вызывается одна запись apply(value, False).
+    При досрочном применении (flush) вызывается apply(value, True): нужна только запись, экран сменится следом.
+    Ключ - (user_id, ...), чтобы можно было досрочно применить все изменения пользователя
+    """
+
+    def __init__(self, delay: float = DEBOUNCE_DELAY):
+        self.delay = delay
+        self._pending: dict[tuple, _Pending] = {}
+        # Изменения, которые сейчас записываются: новые нажатия должны отталкиваться от них, а не от базы,
+        # а flush - дожидаться их завершения
+        self._inflight: dict[tuple, _Pending] = {}
+
+    def current(self, key: tuple) -> Any | None:
+        """
+        Значение, которое будет (или сейчас будет) записано по ключу, либо None
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending.value
+        inflight = self._inflight.get(key)
+        return inflight.value if inflight is not None else None
+
+    def schedule(self, key: tuple, value: Any, apply: Callable[[Any, bool], Awaitable[None]]) -> None:
+        """
+        Запоминает новое итоговое значение и, если окно еще не открыто, открывает его
+        :param key: (user_id, ...)
+        :param value: итоговое значение
+        :param apply: корутина записи, вызывается с последним значением и признаком досрочного применения;
+            берется последняя переданная
+        :return:
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.value = value
+            pending.apply = apply
+            return
+        pending = _Pending(value, apply)
+        self._pending[key] = pending
+        pending.task = asyncio.create_task(self._run_later(key, pending))
+
+    async def _run_later(self, key: tuple, pending: _Pending) -> None:
+        await asyncio.sleep(self.delay)
+        await self._apply(key, pending, flushed=False)
+
+    async def _apply(self, key: tuple, pending: _Pending, flushed: bool) -> None:
+        if self._pending.get(key) is not pending:
+            return
+        del self._pending[key]
+        self._inflight[key] = pending
+        try:
+            await pending.apply(pending.value, flushed)
+        except Exception:
+            logging.exception(f"Ошибка отложенного изменения {key}")
+        finally:
+            if self._inflight.get(key) is pending:
+                del self._inflight[key]
+
+    async def flush(self, user_id: Hashable) -> None:
+        """
+        Досрочно применяет все отложенные изменения пользователя (перед переходом на другой экран)
+        и дожидается уже начатых по таймеру записей
+        :param user_id: первый элемент ключа
+        :return:
+        """
+        current_task = asyncio.current_task()
+        own = [(key, pending) for key, pending in list(self._pending.items()) if key[0] == user_id]
+        # Таймеры отменяются сразу, чтобы ни одна запись не стартовала, пока ждем уже начатые
+        for key, pending in own:
+            if pending.task is not None and pending.task is not current_task:
+                pending.task.cancel()
+        # Начатые записи - раньше отложенных: отложенное значение по тому же ключу новее и должно лечь поверх
+        running = [
+            pending.task for key, pending in list(self._inflight.items())
+            if key[0] == user_id and pending.task is not None and pending.task is not current_task
+        ]
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        for key, pending in own:
+            await self._apply(key, pending, flushed=True)
+
+
+menu_debouncer = Debouncer()
@@ -0,0 +1,284 @@
+import logging
+import os
+import types
+import typing
+from dataclasses import dataclass, fields
+from typing import Any, ClassVar, Dict, Optional
+
+import msgpack
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+FSM_SIZE_LOG_EVERY = int(os.getenv("FSM_SIZE_LOG_EVERY", 1000))
+
+# Ключ, под которым в хранилище лежит закодированный payload
+PAYLOAD_KEY = "_p"
+
+
+class FSMPayloadError(ValueError):
+    """
+    Данные FSM не соответствуют схеме
+    """
+
+
+class _Unset:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "UNSET"
+
+
+# Отличает "ключа нет" от "ключ равен None" (например, "rest_ended" not in data)
+UNSET: Any = _Unset()
+
+
+def _checker(annotation) -> typing.Callable[[Any], bool]:
+    """
+    Проверка значения по аннотации. Поддерживаются int, float, bool, str, list[...] и X | None
+    """
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        checks = [_checker(arg) for arg in typing.get_args(annotation)]
+        return lambda value: any(check(value) for check in checks)
+    if origin is list:
+        (item,) = typing.get_args(annotation)
+        check_item = _checker(item)
+        return lambda value: isinstance(value, list) and all(check_item(v) for v in value)
+    if annotation is type(None):
+        return lambda value: value is None
+    if annotation is bool:
+        return lambda value: isinstance(value, bool)
+    if annotation is int:
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+    if annotation is float:
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    if annotation is str:
+        return lambda value: isinstance(value, str)
+    raise TypeError(f"Неподдерживаемый тип поля FSM: {annotation!r}")
+
+
+@dataclass(slots=True)
+class FSMPayload:
+    """
+    Базовая схема данных FSM. Общие поля меню доступны в любом состоянии
+    """
+    tag: ClassVar[int] = 0
+    field_names: ClassVar[tuple[str, ...]] = ()
+    _checks: ClassVar[tuple] = ()
+
+    selected_exercise_id: int | None = UNSET
+    selected_program_id: int | None = UNSET
+    rest_ended: bool = UNSET
+
+    def __post_init__(self) -> None:
+        for name, check in zip(self.field_names, self._checks):
+            value = getattr(self, name)
+            if value is not UNSET and not check(value):
+                raise FSMPayloadError(f"{type(self).__name__}.{name}: недопустимое значение {value!r}")
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "FSMPayload":
+        unknown = data.keys() - set(cls.field_names)
+        if unknown:
+            raise FSMPayloadError(f"{cls.__name__}: неизвестные поля {sorted(unknown)}")
+        return cls(**data)
+
+    def to_data(self) -> Dict[str, Any]:
+        return {name: value for name in self.field_names if (value := getattr(self, name)) is not UNSET}
+
+    def pack(self) -> bytes:
+        """
+        [tag, битовая маска заданных полей, значения заданных полей по порядку]
+        """
+        mask, values = 0, []
+        for bit, name in enumerate(self.field_names):
+            value = getattr(self, name)
+            if value is not UNSET:
+                mask |= 1 << bit
+                values.append(value)
+        return msgpack.packb([self.tag, mask, *values], use_bin_type=True)
+
+
+# tag -> схема. Номера не переиспользуются: они записаны в хранилище
+_SCHEMAS: dict[int, type[FSMPayload]] = {}
+
+
+def fsm_schema(tag: int):
+    """
+    Регистрирует схему данных для группы состояний
+    :param tag: постоянный номер схемы
+    :return:
+    """
+
+    def decorator(cls: type[FSMPayload]) -> type[FSMPayload]:
+        if tag in _SCHEMAS:
+            raise ValueError(f"Номер схемы FSM {tag} уже занят {_SCHEMAS[tag].__name__}")
+        hints = typing.get_type_hints(cls)
+        cls.tag = tag
+        cls.field_names = tuple(field.name for field in fields(cls))
+        cls._checks = tuple(_checker(hints[name]) for name in cls.field_names)
+        _SCHEMAS[tag] = cls
+        return cls
+
+    return decorator
+
+
+@fsm_schema(1)
+@dataclass(slots=True)
+class AddUserData(FSMPayload):
+    user_id: int = UNSET
+    name: str = UNSET
+    weight: float = UNSET
+    user_for_change_id: int | None = UNSET
+
+
+@fsm_schema(2)
+@dataclass(slots=True)
+class AddTrainingProgramData(FSMPayload):
+    user_id: int = UNSET
+    name: str = UNSET
+    program_for_change_id: int | None = UNSET
+
+
+@fsm_schema(3)
+@dataclass(slots=True)
+class AddExerciseData(FSMPayload):
+    training_day_id: int | None = UNSET
+    program_id: int | None = UNSET
+    category_id: int | None = UNSET
+    user_id: int = UNSET
+    origin: str = UNSET
+    empty: bool = UNSET
+    circle_training: bool = UNSET
+    name: str = UNSET
+    description: str = UNSET
+    exercise_for_change_id: int | None = UNSET
+
+
+@fsm_schema(4)
+@dataclass(slots=True)
+class TrainingProcessData(FSMPayload):
+    training_session_id: str = UNSET
+    training_day_id: int | None = UNSET
+    user_id: int = UNSET
+    exercise_index: int = UNSET
+    circular_rounds: int = UNSET
+    rest_between_exercise: int = UNSET
+    rest_between_set: int = UNSET
+    circular_rest_between_rounds: int = UNSET
+    circular_rest_between_exercise: int = UNSET
+    blocks: list[list[int]] = UNSET
+    block_index: int = UNSET
+    # Поля неактивного типа блока обнуляются (None) в process_current_block
+    standard_ex_ids: list[int] | None = UNSET
+    standard_ex_idx: int | None = UNSET
+    circuit_ex_ids: list[int] | None = UNSET
+    circuit_ex_idx: int | None = UNSET
+    circuit_round: int | None = UNSET
+    set_index: int | None = UNSET
+    current_exercise_id: int = UNSET
+    weight: float = UNSET
+    reps: int = UNSET
+    bot_message_id: int = UNSET
+    rest_message_id: int = UNSET
+    accept_message_id: int = UNSET
+    choose_message_id: int = UNSET
+    enter_message_id: int = UNSET
+
+
+@fsm_schema(5)
+@dataclass(slots=True)
+class AddAdminExerciseData(FSMPayload):
+    name: str = UNSET
+    description: str = UNSET
+    category: str = UNSET
+    exercise_for_change_id: int | None = UNSET
+
+
+def encode_payload(data: Dict[str, Any]) -> bytes:
+    """
+    Кодирует данные FSM первой схемой, в которую укладываются все ключи
+    :param data: данные FSM
+    :return: msgpack
+    """
+    keys = data.keys()
+    for schema in _SCHEMAS.values():
+        if keys <= set(schema.field_names):
+            return schema.from_data(data).pack()
+    raise FSMPayloadError(f"Нет схемы FSM для полей {sorted(keys)}")
+
+
+def decode_payload(raw: bytes) -> Dict[str, Any]:
+    """
+    Декодирует и проверяет данные FSM
+    :param raw: результат encode_payload()
+    :return: данные FSM
+    """
+    try:
+        tag, mask, *values = msgpack.unpackb(raw, raw=False)
+    except Exception as e:
+        raise FSMPayloadError(f"Поврежденные данные FSM: {e}") from e
+    schema = _SCHEMAS.get(tag)
+    if schema is None:
+        raise FSMPayloadError(f"Неизвестная схема FSM {tag}")
+    present = [name for bit, name in enumerate(schema.field_names) if mask >> bit & 1]
+    if len(present) != len(values):
+        raise FSMPayloadError(f"{schema.__name__}: ожидалось {len(present)} значений, получено {len(values)}")
+    return schema(**dict(zip(present, values))).to_data()
+
+
+class PayloadStorage(BaseStorage):
+    """
+    Обертка над хранилищем FSM: данные хранятся одной компактной записью {"_p": msgpack},
+    проверяются по схеме при чтении и записи; ведется размер данных каждого пользователя
+    """
+
+    def __init__(self, storage: BaseStorage):
+        self.storage = storage
+        self.sizes: dict[int, int] = {}
+        self._writes = 0
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.storage.set_state(key=key, state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.storage.get_state(key=key)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if not data:
+            self.sizes.pop(key.user_id, None)
+            await self.storage.set_data(key=key, data={})
+            return
+        try:
+            raw = encode_payload(data)
+            stored = {PAYLOAD_KEY: raw}
+            self.sizes[key.user_id] = len(raw)
+        except FSMPayloadError:
+            # Данные без схемы сохраняем как есть, чтобы не потерять состояние пользователя
+            logging.exception(f"Данные FSM пользователя {key.user_id} сохранены без схемы")
+            stored = dict(data)
+        await self.storage.set_data(key=key, data=stored)
+        self._writes += 1
+        if self._writes % FSM_SIZE_LOG_EVERY == 0:
+            logging.info(f"Размер данных FSM: {self.stats()}")
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        stored = await self.storage.get_data(key=key)
+        raw = stored.get(PAYLOAD_KEY)
+        if raw is None:
+            return dict(stored)
+        try:
+            return decode_payload(raw)
+        except FSMPayloadError:
+            logging.exception(f"Данные FSM пользователя {key.user_id} отброшены")
+            return {}
+
+    def stats(self) -> dict:
+        sizes = self.sizes.values()
+        return {
+            "users": len(self.sizes),
+            "total_bytes": sum(sizes),
+            "max_bytes": max(sizes, default=0),
+        }
+
+    async def close(self) -> None:
+        await self.storage.close()
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+
+from aiogram.types import FSInputFile, Message
+
+from utils.versions import bump, track
+
+ERROR_IMAGE = 'https://postimg.cc/Ty7d15kq'
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media_cache")
+MEDIA_MAX_SIDE = int(os.getenv("MEDIA_MAX_SIDE", 1280))
+MEDIA_JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", 82))
+
+# источник (URL, путь или file_id) -> file_id, который Telegram выдал после первой отправки
+_file_ids: dict[str, str] = {}
+# file_id или путь к локальному варианту -> исходный источник
+_sources: dict[str, str] = {}
+
+
+def _is_url(source: str) -> bool:
+    return "://" in source
+
+
+def local_variant_path(source: str) -> str:
+    """
+    Путь к пережатому локальному варианту изображения
+    :param source: URL или имя баннера
+    :return:
+    """
+    digest = hashlib.sha1(source.encode()).hexdigest()[:16]
+    return os.path.join(MEDIA_DIR, f"{digest}.jpg")
+
+
+def resolve_media(source: str):
+    """
+    Возвращает лучшее доступное представление изображения для отправки:
+    закэшированный file_id, затем локальный пережатый файл, затем сам источник
+    :param source: URL или file_id
+    :return: str (file_id/URL) или FSInputFile
+    """
+    track("media", source)
+    file_id = _file_ids.get(source)
+    if file_id is not None:
+        return file_id
+    if _is_url(source):
+        path = local_variant_path(source)
+        if os.path.exists(path):
+            _sources[path] = source
+            return FSInputFile(path)
+    return source
+
+
+def banner_media(banner) -> str | FSInputFile:
+    """
+    Изображение баннера для InputMediaPhoto
+    :param banner: объект Banner
+    :return:
+    """
+    return resolve_media(banner.image if banner and banner.image else ERROR_IMAGE)
+
+
+def media_source(media) -> str | None:
+    """
+    Обратное преобразование: по значению InputMediaPhoto.media находит исходный источник
+    """
+    if isinstance(media, FSInputFile):
+        return _sources.get(str(media.path))
+    if isinstance(media, str):
+        return _sources.get(media, media)
+    return None
+
+
+def remember_sent_media(media, message: Message | bool | None) -> None:
+    """
+    Запоминает file_id фото из отправленного/отредактированного сообщения.
+    Отрисованные экраны с этим источником становятся устаревшими (версия media),
+    и следующий рендер уже использует file_id
+    :param media: значение InputMediaPhoto.media, которое отправляли
+    :param message: ответ Bot API
+    :return:
+    """
+    if not isinstance(message, Message) or not message.photo:
+        return
+    source = media_source(media)
+    if source is None or source in _file_ids:
+        return
+    file_id = message.photo[-1].file_id
+    set_file_id(source, file_id)
+
+
+def local_media(path: str) -> str | FSInputFile:
+    """
+    Локальный файл (например, отрисованный график): file_id после первой отправки, иначе сам файл
+    :param path: путь к изображению
+    :return:
+    """
+    track("media", path)
+    file_id = _file_ids.get(path)
+    if file_id is not None:
+        return file_id
+    _sources[path] = path
+    return FSInputFile(path)
+
+
+def forget_media(source: str) -> None:
+    """
+    Забывает file_id удаленного локального файла
+    """
+    file_id = _file_ids.pop(source, None)
+    if file_id is not None:
+        _sources.pop(file_id, None)
+    _sources.pop(source, None)
+
+
+def set_file_id(source: str, file_id: str) -> None:
+    """
+    Явно задает file_id для источника (например, при загрузке баннера администратором)
+    """
+    _file_ids[source] = file_id
+    _sources[file_id] = source
+    bump("media", source)
+
+
+def recompress_image(data: bytes) -> bytes:
+    """
+    Пережимает изображение для мобильных клиентов: JPEG, длинная сторона не больше MEDIA_MAX_SIDE
+    :param data: исходные байты
+    :return: байты JPEG
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((MEDIA_MAX_SIDE, MEDIA_MAX_SIDE), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=MEDIA_JPEG_QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+async def store_local_variant(source: str, data: bytes) -> str:
+    """
+    Сохраняет пережатый вариант изображения в MEDIA_DIR
+    :param source: URL или имя баннера
+    :param data: исходные байты
+    :return: путь к файлу
+    """
+    compressed = await asyncio.to_thread(recompress_image, data)
+    path = local_variant_path(source)
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return path
+
+
+async def prepare_banner_media(sources: list[str]) -> None:
+    """
+    Скачивает и пережимает изображения баннеров, заданные ссылками, чтобы первая отправка шла
+    уже облегченным файлом, а не ссылкой, которую Telegram скачивает сам
+    :param sources: список URL
+    :return:
+    """
+    from aiohttp import ClientSession, ClientTimeout
+
+    urls = [source for source in sources if source and _is_url(source)
+            and not os.path.exists(local_variant_path(source))]
+    if not urls:
+        return
+    async with ClientSession(timeout=ClientTimeout(total=30)) as http:
+        for url in urls:
+            try:
+                async with http.get(url) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+                await store_local_variant(url, data)
+                bump("media", url)
+            except Exception as e:
+                logging.warning(f"Не удалось подготовить изображение {url}: {e}")
@@ -0,0 +1,92 @@
+import os
+from collections import OrderedDict
+
+from aiogram.types import Message
+
+from utils.media import media_source
+
+MESSAGE_STATE_SIZE = int(os.getenv("MESSAGE_STATE_SIZE", 20000))
+
+EDIT_NONE = "none"
+EDIT_MARKUP = "markup"
+EDIT_CAPTION = "caption"
+EDIT_MEDIA = "media"
+
+# (chat_id, message_id) -> ((хэш медиа, хэш подписи, хэш клавиатуры), отпечаток показанного сообщения).
+# Сведения локальны для процесса, поэтому хэшам верим, только пока сообщение выглядит так же,
+# как после нашей последней правки: его мог изменить другой экземпляр бота
+_message_state: OrderedDict[tuple[int, int], tuple[tuple[int, int, int], int]] = OrderedDict()
+
+
+def content_hashes(media, reply_markup) -> tuple[int, int, int]:
+    """
+    Хэши содержимого сообщения меню
+    :param media: InputMediaPhoto
+    :param reply_markup: InlineKeyboardMarkup или None
+    :return: (медиа, подпись, клавиатура)
+    """
+    # Сравниваем исходный источник, а не представление: URL, локальный файл и полученный
+    # по ним file_id - одна и та же картинка. Неизвестный InputFile считается всегда новым
+    source = media_source(media.media)
+    media_hash = hash(source) if source is not None else id(media.media)
+    caption_hash = hash((media.caption, media.parse_mode if isinstance(media.parse_mode, str) else None))
+    markup_hash = hash(reply_markup.model_dump_json(exclude_none=True)) if reply_markup is not None else 0
+    return media_hash, caption_hash, markup_hash
+
+
+def shown_state(message) -> int | None:
+    """
+    Отпечаток того, что сообщение показывает на самом деле (по данным Telegram)
+    :param message: Message из апдейта или ответа Bot API
+    :return: хэш (фото, подпись, клавиатура) или None, если сообщение недоступно
+    """
+    if not isinstance(message, Message):
+        return None
+    photo = message.photo[-1].file_unique_id if message.photo else None
+    markup = message.reply_markup.model_dump_json(exclude_none=True) if message.reply_markup is not None else None
+    return hash((photo, message.caption, markup))
+
+
+def plan_edit(chat_id: int, message_id: int, hashes: tuple[int, int, int], shown: int | None) -> str:
+    """
+    Определяет минимальное редактирование для сообщения
+    :param chat_id:
+    :param message_id:
+    :param hashes: результат content_hashes()
+    :param shown: shown_state() сообщения, которое сейчас видит пользователь
+    :return: EDIT_NONE / EDIT_MARKUP / EDIT_CAPTION / EDIT_MEDIA
+    """
+    state = _message_state.get((chat_id, message_id))
+    if state is None or shown is None or state[1] != shown:
+        return EDIT_MEDIA
+    previous = state[0]
+    if previous[0] != hashes[0]:
+        return EDIT_MEDIA
+    if previous[1] != hashes[1]:
+        return EDIT_CAPTION
+    if previous[2] != hashes[2]:
+        return EDIT_MARKUP
+    return EDIT_NONE
+
+
+def remember(chat_id: int, message_id: int, hashes: tuple[int, int, int], shown: int | None) -> None:
+    """
+    Запоминает, что сейчас показано в сообщении
+    :param hashes: результат content_hashes() для отправленного содержимого
+    :param shown: shown_state() сообщения после отправки/правки
+    """
+    key = (chat_id, message_id)
+    if shown is None:
+        _message_state.pop(key, None)
+        return
+    _message_state[key] = (hashes, shown)
+    _message_state.move_to_end(key)
+    while len(_message_state) > MESSAGE_STATE_SIZE:
+        _message_state.popitem(last=False)
+
+
+def forget(chat_id: int, message_id: int) -> None:
+    """
+    Сбрасывает сведения о сообщении (после неизвестной ошибки редактирования)
+    """
+    _message_state.pop((chat_id, message_id), None)
@@ -0,0 +1,36 @@
+import re
+from typing import NamedTuple
+
+QUICK_LOG_MAX_WEIGHT = 1000
+QUICK_LOG_MAX_REPS = 1000
+QUICK_LOG_MAX_SETS = 20
+
+# "80x10", "80х10х3", "62,5 * 8", "80×10"; разделитель - латинская/кириллическая x, * или ×
+QUICK_LOG_RE = re.compile(
+    r"^\s*(\d{1,4}(?:[.,]\d{1,3})?)\s*[xXхХ*×]\s*(\d{1,4})(?:\s*[xXхХ*×]\s*(\d{1,2}))?\s*$"
+)
+
+
+class QuickLog(NamedTuple):
+    weight: float
+    reps: int
+    sets: int
+
+
+def parse_quick_log(text: str | None) -> QuickLog | None:
+    """
+    Разбирает быструю запись подхода "вес x повторения [x подходы]"
+    :param text: текст сообщения
+    :return: QuickLog или None, если это не быстрая запись или значения вне допустимых пределов
+    """
+    if not text:
+        return None
+    match = QUICK_LOG_RE.match(text)
+    if match is None:
+        return None
+    weight = float(match.group(1).replace(",", "."))
+    reps = int(match.group(2))
+    sets = int(match.group(3)) if match.group(3) else 1
+    if weight > QUICK_LOG_MAX_WEIGHT or not 0 < reps <= QUICK_LOG_MAX_REPS or not 0 < sets <= QUICK_LOG_MAX_SETS:
+        return None
+    return QuickLog(weight, reps, sets)
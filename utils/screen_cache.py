@@ -0,0 +1,53 @@
+import os
+from collections import OrderedDict
+from typing import Hashable
+
+from utils.versions import ALL, is_fresh, subscribe
+
+SCREEN_CACHE_SIZE = int(os.getenv("SCREEN_CACHE_SIZE", 5000))
+
+
+class ScreenCache:
+    """
+    LRU-кэш отрисованных экранов меню: ключ -> (зависимости, (InputMediaPhoto, InlineKeyboardMarkup)).
+    Запись считается актуальной, пока не изменилась версия ни одной из её зависимостей.
+    """
+
+    def __init__(self, maxsize: int = SCREEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        deps, value = entry
+        if not is_fresh(deps):
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, deps: dict, value) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (tuple(deps.items()), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+screen_cache = ScreenCache()
+# Изменения других экземпляров приходят как новые версии; полный сброс - только по ALL
+subscribe(lambda scope, key: screen_cache.clear() if scope == ALL else None)
@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import hmac
+import os
+
+# Префикс payload ссылки t.me/<бот>?start=prog_<код>
+PROGRAM_SHARE_PREFIX = "prog_"
+SHARE_SIGNATURE_BYTES = 6
+
+
+def _secret() -> bytes:
+    return (os.getenv("SHARE_CODE_SECRET") or os.getenv("TOKEN") or "gym-assistant").encode()
+
+
+def _signature(payload: bytes) -> bytes:
+    return hmac.new(_secret(), payload, hashlib.sha256).digest()[:SHARE_SIGNATURE_BYTES]
+
+
+def encode_share_code(program_id: int) -> str:
+    """
+    Код программы для ссылки: id + подпись HMAC, чтобы коды нельзя было перебрать
+    :param program_id:
+    :return: строка из символов [A-Za-z0-9_-], допустимых в deep link
+    """
+    payload = program_id.to_bytes((program_id.bit_length() + 7) // 8 or 1, "big")
+    return base64.urlsafe_b64encode(payload + _signature(payload)).rstrip(b"=").decode()
+
+
+def decode_share_code(code: str) -> int | None:
+    """
+    Проверяет подпись и возвращает id программы
+    :param code: результат encode_share_code()
+    :return: id программы или None для некорректного кода
+    """
+    try:
+        raw = base64.urlsafe_b64decode(code + "=" * (-len(code) % 4))
+    except (ValueError, TypeError):
+        return None
+    payload, signature = raw[:-SHARE_SIGNATURE_BYTES], raw[-SHARE_SIGNATURE_BYTES:]
+    if not payload or not hmac.compare_digest(signature, _signature(payload)):
+        return None
+    return int.from_bytes(payload, "big")
+
+
+def program_share_link(bot_username: str, program_id: int) -> str:
+    """
+    Ссылка, открывающая бота с предложением скопировать программу
+    """
+    return f"https://t.me/{bot_username}?start={PROGRAM_SHARE_PREFIX}{encode_share_code(program_id)}"
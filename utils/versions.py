@@ -0,0 +1,125 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Hashable
+
+# (область, ключ) -> номер версии. Области: user, program, day, exercise, user_exercise,
+# catalog, banner, sessions, sets (подходы пользователя), media
+_versions: dict[tuple[str, Hashable], int] = {}
+
+# Рассылка изменений другим экземплярам бота (см. database/invalidation.py)
+_publisher: Callable[[str, Hashable], None] | None = None
+# Кэши, которым нужно знать об изменениях, сделанных другими экземплярами
+_subscribers: list[Callable[[str, Hashable], None]] = []
+
+# Область события "сбросить всё" (например, после потери связи с шиной)
+ALL = "*"
+
+_dependencies: ContextVar[dict | None] = ContextVar("version_dependencies", default=None)
+
+
+def get_version(scope: str, key: Hashable = None) -> int:
+    """
+    Текущая версия данных
+    :param scope: область (user, day, ...)
+    :param key: id объекта внутри области
+    :return:
+    """
+    return _versions.get((scope, key), 0)
+
+
+def bump(scope: str, key: Hashable = None) -> int:
+    """
+    Отмечает, что данные изменились. Вызывается функциями записи после commit
+    :param scope: область (user, day, ...)
+    :param key: id объекта внутри области
+    :return: новая версия
+    """
+    version = _versions.get((scope, key), 0) + 1
+    _versions[(scope, key)] = version
+    if _publisher is not None:
+        _publisher(scope, key)
+    return version
+
+
+def set_publisher(publisher: Callable[[str, Hashable], None] | None) -> None:
+    """
+    Задает функцию, которой bump() передает каждое локальное изменение
+    """
+    global _publisher
+    _publisher = publisher
+
+
+def subscribe(callback: Callable[[str, Hashable], None]) -> None:
+    """
+    Подписывает кэш на изменения, пришедшие от других экземпляров.
+    callback(scope, key) вызывается после увеличения версии; scope == ALL означает,
+    что кэш нужно очистить целиком
+    """
+    _subscribers.append(callback)
+
+
+def _notify(scope: str, key: Hashable) -> None:
+    for callback in _subscribers:
+        try:
+            callback(scope, key)
+        except Exception:
+            logging.exception(f"Ошибка подписчика инвалидации ({scope}, {key})")
+
+
+def apply_remote(scope: str, key: Hashable = None) -> None:
+    """
+    Применяет изменение, сделанное другим экземпляром: увеличивает версию без повторной рассылки
+    :param scope: область (user, day, ...)
+    :param key: id объекта внутри области
+    :return:
+    """
+    _versions[(scope, key)] = _versions.get((scope, key), 0) + 1
+    _notify(scope, key)
+
+
+def invalidate_all() -> None:
+    """
+    Сбрасывает все кэши. Используется, когда часть событий могла быть потеряна
+    """
+    for dep in _versions:
+        _versions[dep] += 1
+    _notify(ALL, None)
+
+
+def track(scope: str, key: Hashable = None) -> None:
+    """
+    Запоминает, что текущий рендер прочитал данные (scope, key).
+    Вне tracking() ничего не делает.
+    Версия фиксируется при первом чтении, поэтому запись, случившаяся во время рендера,
+    сделает результат устаревшим сразу же.
+    """
+    deps = _dependencies.get()
+    if deps is not None and (scope, key) not in deps:
+        deps[(scope, key)] = _versions.get((scope, key), 0)
+
+
+@contextmanager
+def tracking():
+    """
+    Собирает зависимости всех чтений внутри блока
+    :return: словарь (scope, key) -> версия на момент чтения
+    """
+    deps = {}
+    token = _dependencies.set(deps)
+    try:
+        yield deps
+    finally:
+        _dependencies.reset(token)
+
+
+def is_fresh(deps) -> bool:
+    """
+    Проверяет, что ни одна из зависимостей не менялась
+    :param deps: пары ((scope, key), версия)
+    :return:
+    """
+    for dep, version in deps:
+        if _versions.get(dep, 0) != version:
+            return False
+    return True